@@ -1,140 +1,124 @@
 from pocketflow import Node, Flow, BatchNode
 import os
+import re
+import json
 import yaml  # Add YAML support
 import logging
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
 
 # Import utility functions
-from utils.call_llm import call_llm
+from utils.call_llm import call_llm, get_prompt_budget, supports_structured_output, supports_tools, warm_up, keep_models_warm
+from utils.structured_output import parse_json_object, parse_tool_call
+from utils.yaml_repair import load_yaml_reply, extract_yaml_block
+from utils.token_budget import PromptBudget
+from utils.stream_parser import ToolDecisionStreamParser
+from utils.response_sinks import ResponseSink
 from utils.insert_file import insert_file
 from utils.read_file import read_file
 from utils.delete_file import delete_file
 from utils.replace_file import replace_file
 from utils.search_ops import grep_search
 from utils.dir_ops import list_dir
+from utils.log_config import configure_logging
+from utils.telemetry import telemetry, last_finish_reason, start_metrics_export, write_metrics_textfile
+from utils.tracing import TracedFlow, trace_session, note_io
+from utils.profiling import profile_session, profile_iteration
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('coding_agent.log')
-    ]
-)
-logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger('coding_agent')
 
-def format_history_summary(history: List[Dict[str, Any]]) -> str:
-    if not history:
-        return "No previous actions."
+def file_size(path: str) -> int:
+    """Size of a file in bytes, 0 if it does not exist; tool spans report it as bytes read/written."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def format_action_entry(index: int, action: Dict[str, Any], compact: bool = False) -> str:
+    # compact drops file contents, matches and trees, which make up most of
+    # the history, for prompts that would otherwise exceed their budget
+    # Header for all entries - removed timestamp
+    entry = f"Action {index+1}:\n"
+    entry += f"- Tool: {action['tool']}\n"
+    entry += f"- Reason: {action['reason']}\n"
     
-    history_str = "\n"
+    # Add parameters
+    params = action.get("params", {})
+    if params:
+        entry += f"- Parameters:\n"
+        for k, v in params.items():
+            entry += f"  - {k}: {v}\n"
     
-    for i, action in enumerate(history):
-        # Header for all entries - removed timestamp
-        history_str += f"Action {i+1}:\n"
-        history_str += f"- Tool: {action['tool']}\n"
-        history_str += f"- Reason: {action['reason']}\n"
-        
-        # Add parameters
-        params = action.get("params", {})
-        if params:
-            history_str += f"- Parameters:\n"
-            for k, v in params.items():
-                history_str += f"  - {k}: {v}\n"
-        
-        # Add detailed result information
-        result = action.get("result")
-        if result:
-            if isinstance(result, dict):
-                success = result.get("success", False)
-                history_str += f"- Result: {'Success' if success else 'Failed'}\n"
-                
-                # Add tool-specific details
-                if action['tool'] == 'read_file' and success:
-                    content = result.get("content", "")
+    # Add detailed result information
+    result = action.get("result")
+    if result:
+        if isinstance(result, dict):
+            success = result.get("success", False)
+            entry += f"- Result: {'Success' if success else 'Failed'}\n"
+            
+            # Add tool-specific details
+            if action['tool'] == 'read_file' and success:
+                content = result.get("content", "")
+                if compact:
+                    entry += f"- Content: ({len(content.splitlines())} lines omitted, read the file again if needed)\n"
+                else:
                     # Show full content without truncating
-                    history_str += f"- Content: {content}\n"
-                elif action['tool'] == 'grep_search' and success:
-                    matches = result.get("matches", [])
-                    history_str += f"- Matches: {len(matches)}\n"
-                    # Show all matches without limiting to first 3
-                    for j, match in enumerate(matches):
-                        history_str += f"  {j+1}. {match.get('file')}:{match.get('line')}: {match.get('content')}\n"
-                elif action['tool'] == 'edit_file' and success:
-                    operations = result.get("operations", 0)
-                    history_str += f"- Operations: {operations}\n"
-                    
-                    # Include the reasoning if available
-                    reasoning = result.get("reasoning", "")
-                    if reasoning:
-                        history_str += f"- Reasoning: {reasoning}\n"
-                elif action['tool'] == 'list_dir' and success:
-                    # Get the tree visualization string
-                    tree_visualization = result.get("tree_visualization", "")
-                    history_str += "- Directory structure:\n"
+                    entry += f"- Content: {content}\n"
+            elif action['tool'] == 'grep_search' and success:
+                matches = result.get("matches", [])
+                entry += f"- Matches: {len(matches)}\n"
+                if compact:
+                    return entry
+                # Show all matches without limiting to first 3
+                for j, match in enumerate(matches):
+                    entry += f"  {j+1}. {match.get('file')}:{match.get('line')}: {match.get('content')}\n"
+            elif action['tool'] == 'edit_file' and success:
+                operations = result.get("operations", 0)
+                entry += f"- Operations: {operations}\n"
+                
+                # Include the reasoning if available
+                reasoning = result.get("reasoning", "")
+                if reasoning:
+                    entry += f"- Reasoning: {reasoning}\n"
+            elif action['tool'] == 'list_dir' and success:
+                # Get the tree visualization string
+                tree_visualization = result.get("tree_visualization", "")
+                entry += "- Directory structure:\n"
+                if compact:
+                    return entry + "  (omitted, list the directory again if needed)\n"
+                
+                # Properly handle and format the tree visualization
+                if tree_visualization and isinstance(tree_visualization, str):
+                    # First, ensure we handle any special line ending characters properly
+                    clean_tree = tree_visualization.replace('\r\n', '\n').strip()
                     
-                    # Properly handle and format the tree visualization
-                    if tree_visualization and isinstance(tree_visualization, str):
-                        # First, ensure we handle any special line ending characters properly
-                        clean_tree = tree_visualization.replace('\r\n', '\n').strip()
-                        
-                        if clean_tree:
-                            # Add each line with proper indentation
-                            for line in clean_tree.split('\n'):
-                                # Ensure the line is properly indented
-                                if line.strip():  # Only include non-empty lines
-                                    history_str += f"  {line}\n"
-                        else:
-                            history_str += "  (No tree structure data)\n"
+                    if clean_tree:
+                        # Add each line with proper indentation
+                        for line in clean_tree.split('\n'):
+                            # Ensure the line is properly indented
+                            if line.strip():  # Only include non-empty lines
+                                entry += f"  {line}\n"
                     else:
-                        history_str += "  (Empty or inaccessible directory)\n"
-                        logger.debug(f"Tree visualization missing or invalid: {tree_visualization}")
-            else:
-                history_str += f"- Result: {result}\n"
-        
-        # Add separator between actions
-        history_str += "\n" if i < len(history) - 1 else ""
+                        entry += "  (No tree structure data)\n"
+                else:
+                    entry += "  (Empty or inaccessible directory)\n"
+                    logger.debug(f"Tree visualization missing or invalid: {tree_visualization}")
+        else:
+            entry += f"- Result: {result}\n"
     
-    return history_str
+    return entry
 
-#############################################
-# Main Decision Agent Node
-#############################################
-class MainDecisionAgent(Node):
-    def prep(self, shared: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
-        # Get user query and history
-        user_query = shared.get("user_query", "")
-        history = shared.get("history", [])
-        
-        # Increment iteration counter
-        iteration_count = shared.get("iteration_count", 0) + 1
-        shared["iteration_count"] = iteration_count
-        
-        # Check iteration limit
-        max_iterations = shared.get("max_iterations", 10)
-        if iteration_count > max_iterations:
-            logger.warning(f"Reached maximum iterations ({max_iterations})")
-            return "finish", history
-        
-        return user_query, history
+def format_history_summary(history: List[Dict[str, Any]]) -> str:
+    if not history:
+        return "No previous actions."
     
-    def exec(self, inputs: Tuple[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
-        user_query, history = inputs
-        
-        # Format history for the prompt
-        history_str = format_history_summary(history)
-        
-        # Regular tool selection prompt
-        prompt = f"""You are a coding assistant that helps modify and navigate code. You have full access to codebase. Given the following request, 
-decide which tool to use from the available options.
+    # Add separator between actions
+    return "\n" + "\n".join(format_action_entry(i, action) for i, action in enumerate(history))
 
-User request: {user_query}
-
-Here are the actions you performed:
-{history_str}
+# Static part of the decision prompt. It never changes between iterations, so
+# it goes first and providers can serve it from their prefix cache.
+DECISION_SYSTEM_PROMPT = """You are a coding assistant that helps modify and navigate code. You have full access to codebase. Given the user's request 
+and the actions performed so far, decide which tool to use from the available options.
 
 Available tools:
 1. read_file: Read content from a file
@@ -162,9 +146,9 @@ Available tools:
        instructions: Add try-except block around the file reading operation
        code_edit: |
             // ... existing file reading code ...
-            function newEdit() {{
+            function newEdit() {
                 // new code here
-            }}
+            }
             // ... existing file reading code ...
 
 3. delete_file: Remove a file
@@ -230,7 +214,7 @@ Available tools:
    - Example:
      tool: finish
      reason: I have completed the requested task of finding all logger instances
-     params: {{}}
+     params: {}
 
 Return a YAML object with the following structure:
 ```yaml
@@ -242,34 +226,203 @@ params:
 
 Choose the most appropriate tool based on the user's request and previous actions.
 """
+
+DECISION_INSTRUCTION = "Decide which tool to use next. Return only the YAML object."
+
+# With native tool calling the catalog travels as tool definitions
+# (see tool_definitions), so the system prompt only sets the task
+DECISION_TOOLS_SYSTEM_PROMPT = """You are a coding assistant that helps modify and navigate code. You have full access to codebase. Given the user's request 
+and the actions performed so far, call the one tool that should be used next, explaining in its reason argument why it was chosen.
+Call finish once the request is complete.
+"""
+
+DECISION_TOOLS_INSTRUCTION = "Decide which tool to use next and call it."
+
+def tool_definition(action: str, target: Any) -> Dict[str, Any]:
+    """
+    OpenAI-style function definition of a MainDecisionAgent action, built
+    from the tool_description, tool_params and tool_required attributes of
+    the node the action leads to, or of every node of a sub-flow such as the
+    edit agent. Every tool also takes the reason for choosing it.
+    """
+    nodes = []
+    pending = [target.start_node] if isinstance(target, Flow) else [target]
+    while pending:
+        node = pending.pop(0)
+        if node is None or any(node is seen for seen in nodes):
+            continue
+        nodes.append(node)
+        if isinstance(target, Flow):
+            pending.extend(node.successors.values())
+    properties = {"reason": {"type": "string", "description": "Why this tool is used next"}}
+    required = ["reason"]
+    for node in nodes:
+        properties.update(getattr(node, "tool_params", {}))
+        required.extend(getattr(node, "tool_required", []))
+    description = next((node.tool_description for node in nodes if hasattr(node, "tool_description")), action)
+    return {
+        "type": "function",
+        "function": {
+            "name": action,
+            "description": description,
+            "parameters": {"type": "object", "properties": properties, "required": required}
+        }
+    }
+
+def tool_definitions(successors: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Function definitions of all actions a MainDecisionAgent is connected to."""
+    return [tool_definition(action, target) for action, target in successors.items()]
+
+def parse_yaml_reply(
+    response: str,
+    keys: Optional[List[str]],
+    top_keys: Tuple[str, ...],
+    node: str,
+    max_tokens: int
+) -> Any:
+    """
+    Parse the YAML of a reply, repairing it locally if it is malformed. Only
+    if that fails is the model asked, in a short follow-up with just the
+    broken YAML, to fix it.
+    
+    Raises:
+        yaml.YAMLError: If the fixed reply does not parse either
+    """
+    try:
+        return load_yaml_reply(response, keys, top_keys)
+    except yaml.YAMLError as e:
+        error = " ".join(str(e).split())
+    logger.warning(f"YAML reply does not parse after local repair ({error}), asking the model to fix it")
+    prompt = [{
+        "role": "user",
+        "content": f"Fix this YAML so that it parses ({error}). Keep its content unchanged and "
+                   f"return only the corrected YAML in a ```yaml block.\n\n```yaml\n{extract_yaml_block(response)}\n```"
+    }]
+    fixed = call_llm(prompt, max_tokens=max_tokens, stop=["\n```\n"], node=node)
+    return load_yaml_reply(fixed, keys, top_keys)
+
+def build_decision_messages(
+    user_query: str,
+    history: List[Dict[str, Any]],
+    budget: Optional[PromptBudget] = None,
+    native_tools: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Build the tool-decision prompt as a static system prefix followed by chat
+    messages that only ever grow at the end: the request, one message per
+    performed action, and the closing instruction. With a budget, older
+    actions are shown without their results, or left out, once the full
+    history no longer fits. native_tools replaces the YAML tool catalog with
+    a short prompt for backends that receive tool definitions instead.
+    """
+    system_prompt = DECISION_TOOLS_SYSTEM_PROMPT if native_tools else DECISION_SYSTEM_PROMPT
+    instruction = DECISION_TOOLS_INSTRUCTION if native_tools else DECISION_INSTRUCTION
+    request = f"User request: {user_query}"
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": request}
+    ]
+    if budget is None:
+        entries = [format_action_entry(i, action) for i, action in enumerate(history)]
+    else:
+        budget.take("system", system_prompt)
+        budget.take("request", request)
+        budget.take("instruction", instruction)
+        entries, dropped = budget.fit_entries("history", [
+            (format_action_entry(i, action), format_action_entry(i, action, compact=True))
+            for i, action in enumerate(history)
+        ])
+        if dropped:
+            note = f"(Actions 1 to {dropped} omitted to fit the prompt budget.)"
+            budget.take("history", note)
+            messages.append({"role": "user", "content": note})
+    for entry in entries:
+        messages.append({"role": "user", "content": entry})
+    if not history:
+        messages.append({"role": "user", "content": "No previous actions."})
+    messages.append({"role": "user", "content": instruction})
+    return messages
+
+#############################################
+# Main Decision Agent Node
+#############################################
+class MainDecisionAgent(Node):
+    # Generation limits: a decision is a short YAML block, but insert_file and
+    # edit_file params may carry whole file bodies. Generation stops at the
+    # fence closing the ```yaml block (fences inside block scalars are indented).
+    # A decision cut off at the limit is rejected rather than run with a truncated body.
+    max_tokens = 4096
+    stop = ["\n```\n"]
+    
+    def prep(self, shared: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        # Get user query and history
+        user_query = shared.get("user_query", "")
+        history = shared.get("history", [])
         
-        # Call LLM to decide which tool to use
-        response = call_llm(prompt)
+        # Increment iteration counter
+        iteration_count = shared.get("iteration_count", 0) + 1
+        shared["iteration_count"] = iteration_count
+        
+        # Check iteration limit
+        max_iterations = shared.get("max_iterations", 10)
+        if iteration_count > max_iterations:
+            logger.warning(f"Reached maximum iterations ({max_iterations})")
+            return "finish", history
+        
+        # Counted for the tokens-per-iteration metric; memory snapshot when profiling
+        telemetry.record_iteration()
+        profile_iteration(iteration_count, shared)
+        return user_query, history
+    
+    def exec(self, inputs: Tuple[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+        user_query, history = inputs
+        
+        # Backends with tool calling get the actions as function definitions,
+        # the others the static YAML tool catalog
+        node = type(self).__name__
+        native_tools = bool(self.successors) and supports_tools(node)
+        tools = tool_definitions(self.successors) if native_tools else None
+        
+        # Static prefix first, then the growing request/history suffix,
+        # trimmed to what the node's model can take
+        budget = PromptBudget(get_prompt_budget(node, self.max_tokens))
+        if tools:
+            budget.take("tools", json.dumps(tools, separators=(",", ":")))
+        prompt = build_decision_messages(user_query, history, budget, native_tools)
+        budget.record(node)
+        
+        if native_tools:
+            response = call_llm(prompt, max_tokens=self.max_tokens, node=node, tools=tools)
+            call = parse_tool_call(response)
+            if call is not None and call[0] in self.successors:
+                tool, arguments = call
+                reason = arguments.pop("reason", "")
+                return {"tool": tool, "reason": reason, "params": arguments}
+            # A hedge or fallback backend without tool calling answered in text; the
+            # tools prompt does not describe the YAML format, so ask again with the catalog
+            logger.warning("No valid tool call in response, asking again for a YAML decision")
+            budget = PromptBudget(get_prompt_budget(node, self.max_tokens))
+            prompt = build_decision_messages(user_query, history, budget)
+            budget.record(node)
+        
+        # Stream the decision; the stop sequence ends generation at the block's
+        # closing fence, or the parser does once the block parses
+        parser = ToolDecisionStreamParser(self._decision_keys())
+        response = call_llm(prompt, on_token=parser.feed, max_tokens=self.max_tokens, stop=self.stop, node=node)
+        finish_reason = last_finish_reason()
+        if parser.close(stopped=finish_reason == "stop"):
+            return parser.decision
         
         try:
-            # Extract YAML content from the response
-            yaml_content = ""
-            if "```yaml" in response:
-                yaml_blocks = response.split("```yaml")
-                if len(yaml_blocks) > 1:
-                    yaml_content = yaml_blocks[1].split("```")[0].strip()
-            elif "```yml" in response:
-                yaml_blocks = response.split("```yml")
-                if len(yaml_blocks) > 1:
-                    yaml_content = yaml_blocks[1].split("```")[0].strip()
-            elif "```" in response:
-                # Try to extract from generic code block
-                yaml_blocks = response.split("```")
-                if len(yaml_blocks) > 1:
-                    yaml_content = yaml_blocks[1].strip()
-            
-            if not yaml_content:
-                # If no code blocks found, try to parse the entire response
-                yaml_content = response.strip()
+            if finish_reason == "length":
+                # The open block would parse, with file content cut off mid-line
+                raise ValueError(f"Decision was cut off at max_tokens ({self.max_tokens})")
             
-            # Parse YAML response
-            decision = yaml.safe_load(yaml_content)
-            if not decision or "tool" not in decision:
+            # Parse YAML response, repairing it (or, failing that, having it fixed) if malformed
+            decision = parse_yaml_reply(
+                response, self._decision_keys(), ToolDecisionStreamParser.TOP_KEYS, node, self.max_tokens
+            )
+            if not isinstance(decision, dict) or "tool" not in decision:
                 raise ValueError("Invalid tool decision format")
             
             return decision
@@ -282,6 +435,15 @@ Choose the most appropriate tool based on the user's request and previous action
                 "params": {}
             }
     
+    def _decision_keys(self) -> Optional[List[str]]:
+        # Keys a YAML decision may contain: its own and every tool parameter
+        if not self.successors:
+            return None
+        keys = list(ToolDecisionStreamParser.TOP_KEYS)
+        for tool in tool_definitions(self.successors):
+            keys.extend(tool["function"]["parameters"]["properties"])
+        return keys
+    
     def post(self, shared: Dict[str, Any], prep_res: Tuple[str, List[Dict[str, Any]]], exec_res: Dict[str, Any]) -> str:
         # Add the decision to history
         history = shared.get("history", [])
@@ -295,6 +457,11 @@ Choose the most appropriate tool based on the user's request and previous action
 # Read File Action Node
 #############################################
 class ReadFileAction(Node):
+    # Tool definition offered to MainDecisionAgent (see tool_definition)
+    tool_description = "Read content from a file"
+    tool_params = {"target_file": {"type": "string", "description": "Path relative to the working directory"}}
+    tool_required = ["target_file"]
+    
     def prep(self, shared: Dict[str, Any]) -> str:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -319,7 +486,10 @@ class ReadFileAction(Node):
     
     def exec(self, file_path: str) -> Tuple[str, bool]:
         # Call read_file utility which returns a tuple of (content, success)
-        return read_file(file_path)
+        content, success = read_file(file_path)
+        if success:
+            note_io(read=file_size(file_path))
+        return content, success
     
     def post(self, shared: Dict[str, Any], prep_res: str, exec_res: Tuple[str, bool]) -> str:
         # Unpack the tuple returned by read_file()
@@ -337,6 +507,15 @@ class ReadFileAction(Node):
 # Grep Search Action Node
 #############################################
 class GrepSearchAction(Node):
+    tool_description = "Search for a pattern in files"
+    tool_params = {
+        "query": {"type": "string", "description": "Text or regular expression to search for"},
+        "case_sensitive": {"type": "boolean", "description": "Match case (default false)"},
+        "include_pattern": {"type": "string", "description": "Glob of files to search, e.g. *.py"},
+        "exclude_pattern": {"type": "string", "description": "Glob of files to skip"}
+    }
+    tool_required = ["query"]
+    
     def prep(self, shared: Dict[str, Any]) -> Dict[str, Any]:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -392,6 +571,10 @@ class GrepSearchAction(Node):
 # List Directory Action Node
 #############################################
 class ListDirAction(Node):
+    tool_description = "List the contents of a directory as a tree"
+    tool_params = {"relative_workspace_path": {"type": "string", "description": "Directory relative to the working directory (default .)"}}
+    tool_required = []
+    
     def prep(self, shared: Dict[str, Any]) -> str:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -433,6 +616,13 @@ class ListDirAction(Node):
 # Insert File Action Node
 #############################################
 class InsertFileAction(Node):
+    tool_description = "Create a new file"
+    tool_params = {
+        "target_file": {"type": "string", "description": "Path relative to the working directory"},
+        "content": {"type": "string", "description": "The content to write to the file"}
+    }
+    tool_required = ["target_file", "content"]
+    
     def prep(self, shared: Dict[str, Any]) -> Dict[str, Any]:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -467,7 +657,9 @@ class InsertFileAction(Node):
         content = params["content"]
 
         # Call insert_file utility which returns (success, message)
-        return insert_file(file_path, content)
+        result = insert_file(file_path, content)
+        note_io(written=file_size(file_path))
+        return result
 
     def post(self, shared: Dict[str, Any], prep_res: Dict[str, Any], exec_res: Tuple[bool, str]) -> str:
         success, message = exec_res
@@ -487,6 +679,10 @@ class InsertFileAction(Node):
 # Delete File Action Node
 #############################################
 class DeleteFileAction(Node):
+    tool_description = "Remove a file"
+    tool_params = {"target_file": {"type": "string", "description": "Path relative to the working directory"}}
+    tool_required = ["target_file"]
+    
     def prep(self, shared: Dict[str, Any]) -> str:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -528,6 +724,12 @@ class DeleteFileAction(Node):
 # Read Target File Node (Edit Agent)
 #############################################
 class ReadTargetFileNode(Node):
+    # Entry of the edit sub-flow: describes the edit_file tool, whose other
+    # parameters are declared by AnalyzeAndPlanNode
+    tool_description = "Make changes to an existing file"
+    tool_params = {"target_file": {"type": "string", "description": "Path relative to the working directory"}}
+    tool_required = ["target_file"]
+    
     def prep(self, shared: Dict[str, Any]) -> str:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -548,7 +750,10 @@ class ReadTargetFileNode(Node):
     
     def exec(self, file_path: str) -> Tuple[str, bool]:
         # Call read_file utility which returns (content, success)
-        return read_file(file_path)
+        content, success = read_file(file_path)
+        if success:
+            note_io(read=file_size(file_path))
+        return content, success
     
     def post(self, shared: Dict[str, Any], prep_res: str, exec_res: Tuple[str, bool]) -> str:
         content, success = exec_res
@@ -559,10 +764,118 @@ class ReadTargetFileNode(Node):
         if history:
             history[-1]["file_content"] = content
         
+# Static part of the edit-planning prompt
+EDIT_PLAN_SYSTEM_PROMPT = """
+You are a code editing assistant. Your task is to analyze code changes and convert them into specific edit operations.
+
+IMPORTANT: You MUST return a YAML object with EXACTLY this structure:
+```yaml
+reasoning: |
+  Your detailed explanation of how you interpreted the edit pattern
+  and why you chose specific line numbers for the changes.
+
+operations:
+  - start_line: <number>  # REQUIRED: 1-indexed line number where edit starts
+    end_line: <number>    # REQUIRED: 1-indexed line number where edit ends
+    replacement: |        # REQUIRED: The new code to insert
+      <new code here>
+```
+
+RULES:
+1. The YAML structure MUST include both "reasoning" and "operations" fields
+2. Each operation MUST have start_line, end_line, and replacement
+3. Line numbers are 1-indexed and inclusive
+4. For appending content, use total_lines + 1 as both start_line and end_line
+5. Do not include "// ... existing code ..." in replacements
+6. Validate that all line numbers are within file bounds (1 to total_lines)
+"""
+
+# Variant for backends that constrain the reply to EDIT_PLAN_SCHEMA
+EDIT_PLAN_JSON_SYSTEM_PROMPT = """
+You are a code editing assistant. Your task is to analyze code changes and convert them into specific edit operations.
+
+Return a JSON object with a "reasoning" string (how you interpreted the edit pattern and why you chose
+specific line numbers) and an "operations" list. Each operation has:
+- start_line: 1-indexed line number where the edit starts
+- end_line: 1-indexed line number where the edit ends
+- replacement: the new code to insert
+
+RULES:
+1. Each operation MUST have start_line, end_line, and replacement
+2. Line numbers are 1-indexed and inclusive
+3. For appending content, use total_lines + 1 as both start_line and end_line
+4. Do not include "// ... existing code ..." in replacements
+5. Validate that all line numbers are within file bounds (1 to total_lines)
+"""
+
+# Keys of an edit plan, used to repair malformed YAML plans
+EDIT_PLAN_KEYS = ["reasoning", "operations", "start_line", "end_line", "replacement"]
+
+EDIT_PLAN_SCHEMA = {
+    "title": "edit_plan",
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        "operations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "start_line": {"type": "integer"},
+                    "end_line": {"type": "integer"},
+                    "replacement": {"type": "string"}
+                },
+                "required": ["start_line", "end_line", "replacement"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["reasoning", "operations"],
+    "additionalProperties": False
+}
+
+# Lines of a code_edit pattern that stand for unchanged code
+EXISTING_CODE_MARKER = re.compile(r"\.\.\.\s*existing")
+
+def find_edit_focus(file_lines: List[str], code_edit: str) -> Tuple[int, int]:
+    """
+    Locate the part of a file a code_edit pattern refers to, as a 0-indexed
+    (start, end) line range, from the pattern's context lines that occur in
+    the file at most twice. (0, 0) if none do.
+    """
+    anchors = {
+        line.strip() for line in code_edit.split("\n")
+        if len(line.strip()) >= 8 and not EXISTING_CODE_MARKER.search(line)
+    }
+    positions: Dict[str, List[int]] = {}
+    for i, line in enumerate(file_lines):
+        if line.strip() in anchors:
+            positions.setdefault(line.strip(), []).append(i)
+    hits = [i for found in positions.values() if len(found) <= 2 for i in found]
+    if not hits:
+        return 0, 0
+    return min(hits), max(hits) + 1
+
 #############################################
 # Analyze and Plan Changes Node
 #############################################
 class AnalyzeAndPlanNode(Node):
+    # Generation limits: operations carry replacement code, so allow a large
+    # budget, but stop at the fence closing the ```yaml block
+    max_tokens = 4096
+    stop = ["\n```\n"]
+    
+    tool_params = {
+        "instructions": {"type": "string", "description": "What to change and why"},
+        "code_edit": {
+            "type": "string",
+            "description": "The code changes with context. Use \"// ... existing code ...\" for unchanged code "
+                           "between edits, include enough context to locate the changes, minimize repeating "
+                           "unchanged code and never omit code without the marker. No line numbers needed."
+        }
+    }
+    tool_required = ["instructions", "code_edit"]
+    
     def prep(self, shared: Dict[str, Any]) -> Dict[str, Any]:
         # Get history
         history = shared.get("history", [])
@@ -596,30 +909,33 @@ class AnalyzeAndPlanNode(Node):
         file_lines = file_content.split('\n')
         total_lines = len(file_lines)
         
-        # Generate a prompt for the LLM to analyze the edit using YAML instead of JSON
-        prompt = f"""
-You are a code editing assistant. Your task is to analyze code changes and convert them into specific edit operations.
-
-IMPORTANT: You MUST return a YAML object with EXACTLY this structure:
-```yaml
-reasoning: |
-  Your detailed explanation of how you interpreted the edit pattern
-  and why you chose specific line numbers for the changes.
-
-operations:
-  - start_line: <number>  # REQUIRED: 1-indexed line number where edit starts
-    end_line: <number>    # REQUIRED: 1-indexed line number where edit ends
-    replacement: |        # REQUIRED: The new code to insert
-      <new code here>
-```
-
-RULES:
-1. The YAML structure MUST include both "reasoning" and "operations" fields
-2. Each operation MUST have start_line, end_line, and replacement
-3. Line numbers are 1-indexed and inclusive
-4. For appending content, use total_lines + 1 as both start_line and end_line
-5. Do not include "// ... existing code ..." in replacements
-6. Validate that all line numbers are within file bounds (1 to {total_lines})
+        # Backends with structured output return JSON that follows
+        # EDIT_PLAN_SCHEMA; the others are asked for a fenced YAML block
+        node = type(self).__name__
+        structured = supports_structured_output(node)
+        system_prompt = EDIT_PLAN_JSON_SYSTEM_PROMPT if structured else EDIT_PLAN_SYSTEM_PROMPT
+        
+        # Files too large for the node's budget are sent as a numbered window
+        # of lines around the part the edit pattern refers to
+        budget = PromptBudget(get_prompt_budget(node, self.max_tokens))
+        budget.take("system", system_prompt)
+        budget.take("instructions", instructions)
+        budget.take("code_edit", code_edit)
+        file_note = ""
+        if budget.counter.count(file_content) > budget.remaining:
+            numbered = [f"{i+1}| {line}" for i, line in enumerate(file_lines)]
+            start, end = budget.fit_lines("file", numbered, find_edit_focus(file_lines, code_edit))
+            file_content = "\n".join(numbered[start:end])
+            file_note = (f"\nOnly lines {start+1} to {end} are shown, each prefixed with its line number and \"| \"; "
+                         f"the prefix is not part of the file.")
+        else:
+            budget.take("file", file_content)
+        budget.record(node)
+        
+        # Static instructions first (cacheable), then the per-edit material
+        prompt = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"""The file has {total_lines} lines, so valid line numbers are 1 to {total_lines}.{file_note}
 
 FILE CONTENT:
 {file_content}
@@ -631,35 +947,33 @@ CODE EDIT PATTERN:
 {code_edit}
 
 Now, analyze the file content and edit pattern to determine the exact line numbers and replacement text.
-Return ONLY the YAML object with your analysis and operations.
-"""
+Return ONLY the {"JSON" if structured else "YAML"} object with your analysis and operations.
+"""}
+        ]
         
         # Call LLM to analyze
-        response = call_llm(prompt)
-
-        # Look for YAML structure in the response
-        yaml_content = ""
-        if "```yaml" in response:
-            yaml_blocks = response.split("```yaml")
-            if len(yaml_blocks) > 1:
-                yaml_content = yaml_blocks[1].split("```")[0].strip()
-        elif "```yml" in response:
-            yaml_blocks = response.split("```yml")
-            if len(yaml_blocks) > 1:
-                yaml_content = yaml_blocks[1].split("```")[0].strip()
-        elif "```" in response:
-            # Try to extract from generic code block
-            yaml_blocks = response.split("```")
-            if len(yaml_blocks) > 1:
-                yaml_content = yaml_blocks[1].strip()
-        
-        if not yaml_content:
-            raise ValueError("No YAML object found in response. LLM must return a YAML object with 'reasoning' and 'operations' fields.")
-        
-        try:
-            decision = yaml.safe_load(yaml_content)
-        except yaml.YAMLError as e:
-            raise ValueError(f"Invalid YAML format in LLM response: {str(e)}")
+        if structured:
+            response = call_llm(prompt, max_tokens=self.max_tokens, node=node, response_schema=EDIT_PLAN_SCHEMA)
+        else:
+            response = call_llm(prompt, max_tokens=self.max_tokens, stop=self.stop, node=node)
+        
+        decision = None
+        if structured:
+            try:
+                decision = parse_json_object(response)
+            except ValueError as e:
+                # A fallback backend without structured output may have answered
+                logger.warning(f"Edit plan is not valid JSON ({e}), trying YAML")
+        
+        if decision is None:
+            if not response.strip():
+                raise ValueError("No YAML object found in response. LLM must return a YAML object with 'reasoning' and 'operations' fields.")
+            
+            # Malformed YAML is repaired locally, or as a last resort fixed by the model
+            try:
+                decision = parse_yaml_reply(response, EDIT_PLAN_KEYS, ("reasoning", "operations"), node, self.max_tokens)
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid YAML format in LLM response: {str(e)}")
         
         # Validate the required fields
         if not isinstance(decision, dict):
@@ -749,13 +1063,17 @@ class ApplyChangesNode(BatchNode):
         return sorted_ops
     
     def exec(self, op: Dict[str, Any]) -> Tuple[bool, str]:
-        # Call replace_file utility which returns (success, message)
-        return replace_file(
+        # Call replace_file utility which returns (success, message); it
+        # reads and rewrites the whole file
+        note_io(read=file_size(op["target_file"]))
+        result = replace_file(
             target_file=op["target_file"],
             start_line=op["start_line"],
             end_line=op["end_line"],
             content=op["replacement"]
         )
+        note_io(written=file_size(op["target_file"]))
+        return result
     
     def post(self, shared: Dict[str, Any], prep_res: List[Dict[str, Any]], exec_res_list: List[Tuple[bool, str]]) -> str:
         # Check if all operations were successful
@@ -783,49 +1101,72 @@ class ApplyChangesNode(BatchNode):
         
 
 
+# Static part of the final-response prompt
+RESPONSE_SYSTEM_PROMPT = """
+You are a coding assistant. You have just performed a series of actions based on the 
+user's request. Summarize what you did in a clear, helpful response.
+
+Generate a comprehensive yet concise response that explains:
+1. What actions were taken
+2. What was found or modified
+3. Any next steps the user might want to take
+
+IMPORTANT: 
+- Focus on the outcomes and results, not the specific tools used
+- Write as if you are directly speaking to the user
+- When providing code examples or structured information, use YAML format enclosed in triple backticks
+"""
+
 #############################################
 # Format Response Node
 #############################################
 class FormatResponseNode(Node):
-    def prep(self, shared: Dict[str, Any]) -> List[Dict[str, Any]]:
-        # Get history
+    # Generation limits: a concise summary; no stop sequence because the
+    # summary may legitimately contain fenced YAML examples
+    max_tokens = 1024
+    stop = None
+    
+    tool_description = "End the process and provide the final response"
+    tool_params = {}
+    tool_required = []
+    
+    def prep(self, shared: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[ResponseSink]]:
+        # Get history and the optional caller-supplied sink for streamed tokens
         history = shared.get("history", [])
+        sink = shared.get("response_sink")
         
-        return history
+        return history, sink
     
-    def exec(self, history: List[Dict[str, Any]]) -> str:
+    def exec(self, inputs: Tuple[List[Dict[str, Any]], Optional[ResponseSink]]) -> str:
+        history, sink = inputs
+        
         # If no history, return a generic message
         if not history:
+            if sink:
+                sink("No actions were performed.")
             return "No actions were performed."
         
         # Generate a summary of actions for the LLM using the utility function
         actions_summary = format_history_summary(history)
         
-        # Prompt for the LLM to generate the final response
-        prompt = f"""
-You are a coding assistant. You have just performed a series of actions based on the 
-user's request. Summarize what you did in a clear, helpful response.
-
-Here are the actions you performed:
-{actions_summary}
-
-Generate a comprehensive yet concise response that explains:
-1. What actions were taken
-2. What was found or modified
-3. Any next steps the user might want to take
-
-IMPORTANT: 
-- Focus on the outcomes and results, not the specific tools used
-- Write as if you are directly speaking to the user
-- When providing code examples or structured information, use YAML format enclosed in triple backticks
-"""
+        # Static instructions first (cacheable), then the action summary
+        prompt = [
+            {"role": "system", "content": RESPONSE_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Here are the actions you performed:\n{actions_summary}"}
+        ]
         
-        # Call LLM to generate response
-        response = call_llm(prompt)
+        # Call LLM to generate response, streaming it to the sink if there is one
+        if sink:
+            def forward(chunk: str) -> bool:
+                sink(chunk)
+                return False  # never abort the summary
+            response = call_llm(prompt, on_token=forward, max_tokens=self.max_tokens, stop=self.stop, node=type(self).__name__)
+        else:
+            response = call_llm(prompt, max_tokens=self.max_tokens, stop=self.stop, node=type(self).__name__)
         
         return response
     
-    def post(self, shared: Dict[str, Any], prep_res: List[Dict[str, Any]], exec_res: str) -> str:
+    def post(self, shared: Dict[str, Any], prep_res: Tuple[List[Dict[str, Any]], Optional[ResponseSink]], exec_res: str) -> str:
         logger.info(f"###### Final Response Generated ######\n{exec_res}\n###### End of Response ######")
         
         # Store response in shared
@@ -846,13 +1187,17 @@ def create_edit_agent() -> Flow:
     read_target >> analyze_plan
     analyze_plan >> apply_changes
     
-    # Create flow
-    return Flow(start=read_target)
+    # Create flow (spans nest under the edit_file node when tracing)
+    return TracedFlow(start=read_target, name="EditAgent")
 
 #############################################
 # Create Directory Action Node
 #############################################
 class CreateDirectoryAction(Node):
+    tool_description = "Create a new directory"
+    tool_params = {"target_dir": {"type": "string", "description": "Directory path relative to the working directory"}}
+    tool_required = ["target_dir"]
+    
     def prep(self, shared: Dict[str, Any]) -> str:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -902,6 +1247,10 @@ class CreateDirectoryAction(Node):
 # Delete Directory Action Node
 #############################################
 class DeleteDirectoryAction(Node):
+    tool_description = "Remove a directory and all its contents"
+    tool_params = {"target_dir": {"type": "string", "description": "Directory path relative to the working directory"}}
+    tool_required = ["target_dir"]
+    
     def prep(self, shared: Dict[str, Any]) -> str:
         # Get parameters from the last history entry
         history = shared.get("history", [])
@@ -994,31 +1343,47 @@ def create_main_flow() -> Flow:
     delete_dir_action >> main_agent  # Add new connection
     
     # Create flow
-    flow = Flow(start=main_agent)
+    flow = TracedFlow(start=main_agent)
     flow.set_params({"max_iterations": 10})
     return flow
 
-# Create the main flow
-coding_agent_flow = create_main_flow()
+# The main flow, built on first use
+_coding_agent_flow = None
 
-def run_flow_with_limit(shared: Dict[str, Any], max_iterations: int = 10) -> None:
+def get_coding_agent_flow() -> Flow:
+    """Return the main flow, building it on first use."""
+    global _coding_agent_flow
+    if _coding_agent_flow is None:
+        _coding_agent_flow = create_main_flow()
+    return _coding_agent_flow
+
+def run_flow_with_limit(shared: Dict[str, Any], max_iterations: int = 10, profile: Optional[str] = None) -> None:
     """
     Run the coding agent flow with a custom iteration limit.
     
     Args:
         shared: The shared state dictionary
         max_iterations: Maximum number of iterations before stopping (default: 10)
+        profile: 'cprofile' or 'sample' to profile the session (default: AGENT_PROFILE env var, see utils.profiling)
     """
+    configure_logging()
+    start_metrics_export()
+    
     # Reset iteration counter
     shared["iteration_count"] = 0
     shared["max_iterations"] = max_iterations
     
-    # Run the flow
-    coding_agent_flow.run(shared)
+    # Open the LLM connection while nothing is waiting on it
+    warm_up()
+    
+    # Run the flow, keeping local models loaded between LLM calls
+    with keep_models_warm(), trace_session(), profile_session(profile):
+        get_coding_agent_flow().run(shared)
     
     # Log final iteration count
     final_count = shared.get("iteration_count", 0)
     logger.info(f"Flow completed after {final_count} iterations")
+    write_metrics_textfile()
     
     # Clear iteration counter
     shared.pop("iteration_count", None)
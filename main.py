@@ -1,17 +1,18 @@
 import os
 import logging
 import yaml
-from flow import coding_agent_flow
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('coding_agent.log')
-    ]
+from typing import Optional
+from flow import get_coding_agent_flow
+from utils.call_llm import (
+    warm_up, get_pool_stats, get_usage_stats, get_hedge_stats, get_resilience_stats,
+    get_concurrency_stats, get_single_flight_stats, get_host_stats,
+    get_model_load_stats, get_context_stats, get_prompt_stats, get_prompt_log_stats, get_telemetry_stats, keep_models_warm
 )
+from utils.response_sinks import ResponseSink, stdout_sink
+from utils.log_config import configure_logging
+from utils.telemetry import start_metrics_export, write_metrics_textfile
+from utils.tracing import trace_session
+from utils.profiling import profile_session
 
 logger = logging.getLogger('main')
 
@@ -26,7 +27,16 @@ def load_prompt_from_file(file_path: str) -> str:
         logger.error(f"Error loading prompt file: {str(e)}")
         raise
 
-def run_flow(query: str = None, working_dir: str = None) -> None:
+def run_flow(
+    query: str = None,
+    working_dir: str = None,
+    response_sink: Optional[ResponseSink] = None,
+    profile: Optional[str] = None
+) -> None:
+    # profile: 'cprofile' or 'sample' writes a per-session profile (default: AGENT_PROFILE env var)
+    configure_logging()
+    start_metrics_export()
+    
     # Set default working directory if not provided
     if working_dir is None:
         working_dir = os.path.join(os.getcwd(), "project")
@@ -49,15 +59,41 @@ def run_flow(query: str = None, working_dir: str = None) -> None:
         "user_query": query,
         "working_dir": working_dir,
         "history": [],
-        "response": None
+        "response": None,
+        # Receives the final answer token by token (stdout, callback or SSESink)
+        "response_sink": response_sink
     }
     
     logger.info(f"Working directory: {working_dir}")
     
-    # Run the flow
-    coding_agent_flow.run(shared)
+    # Open the LLM connection while nothing is waiting on it
+    warm_up()
+    
+    # Run the flow, keeping local models loaded between LLM calls
+    with keep_models_warm(), trace_session(), profile_session(profile):
+        get_coding_agent_flow().run(shared)
+    
+    logger.info(f"LLM connection pool stats: {get_pool_stats()}")
+    logger.info(f"LLM token usage (cached vs fresh prompt tokens): {get_usage_stats()}")
+    logger.info(f"LLM retries, circuit breakers and rate limits: {get_resilience_stats()}")
+    logger.info(f"LLM adaptive concurrency limits: {get_concurrency_stats()}")
+    logger.info(f"LLM single-flight coalescing: {get_single_flight_stats()}")
+    logger.info(f"Prompt tokens per node and section: {get_prompt_stats()}")
+    logger.info(f"Prompt log: {get_prompt_log_stats()}")
+    logger.info(f"LLM call latency, tokens and retries per node: {get_telemetry_stats()}")
+    write_metrics_textfile()
+    host_stats = get_host_stats()
+    if host_stats:
+        logger.info(f"Ollama host balancing: {host_stats}")
+        logger.info(f"Ollama model loads (cold vs warm): {get_model_load_stats()}")
+        logger.info(f"Ollama context buckets: {get_context_stats()}")
+    hedge_stats = get_hedge_stats()
+    if hedge_stats:
+        logger.info(f"LLM hedging stats: {hedge_stats}")
 
 if __name__ == "__main__":
+    configure_logging()
+    
     # Load the prompt files, grouped by category
     prompt_files = [
         # Create category
@@ -83,4 +119,4 @@ if __name__ == "__main__":
         query = ""
     
     working_dir = "project"
-    run_flow(query=query, working_dir=working_dir)
\ No newline at end of file
+    run_flow(query=query, working_dir=working_dir, response_sink=stdout_sink)
\ No newline at end of file
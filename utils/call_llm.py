@@ -1,91 +1,490 @@
 import os
 import logging
+import asyncio
+import threading
+from contextlib import nullcontext, contextmanager
 import json
-from datetime import datetime
-from .ollama_client import OllamaClient
-from .openrouter_client import OpenRouterClient
+from typing import Optional, Callable, List, Dict, Any, Union
+from dotenv import load_dotenv
+from .llm_cache import LLMCache
+from .llm_routing import LLMRouter, load_routes
+from .hedging import hedged_generate, ahedged_generate
+from .resilience import is_backend_failure
+from .concurrency import get_concurrency_limiter, concurrency_stats
+from .single_flight import SingleFlight
+from .token_budget import prompt_stats
+from .prompt_log import get_prompt_log
+from .telemetry import track_call, telemetry
 
-# Configure logging
-log_directory = os.getenv("LOG_DIR", "logs")
-os.makedirs(log_directory, exist_ok=True)
-log_file = os.path.join(log_directory, f"llm_calls_{datetime.now().strftime('%Y%m%d')}.log")
-
-# Set up logger
+# Handlers are attached by log_config.configure_logging
 logger = logging.getLogger("llm_logger")
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(log_file)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
 
-# Simple cache configuration
-cache_file = "llm_cache.json"
+# Response cache, opened on first use
+_cache = None
+_cache_lock = threading.Lock()
+
+# Per-node provider/model/params, built on first use
+_router = None
+_router_lock = threading.Lock()
+
+def get_router() -> LLMRouter:
+    """
+    Return the process-wide router, building it on first use
+
+    Nodes without a route use the provider named by LLM_PROVIDER (default
+    'openrouter'). Clients, and with them connection pools and API key
+    checks, are only created when a node first calls them.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                load_dotenv()
+                _router = LLMRouter(load_routes(), default_provider=os.getenv("LLM_PROVIDER", "openrouter"))
+    return _router
+
+def set_router(router: Optional[LLMRouter]) -> None:
+    """Replace the process-wide router, e.g. with fake clients; None rebuilds it from the environment on next use."""
+    global _router
+    with _router_lock:
+        _router = router
+
+def get_cache() -> LLMCache:
+    """Return the process-wide response cache, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
+
+# A prompt is either plain text or a list of chat messages
+Prompt = Union[str, List[Dict[str, Any]]]
 
-# Initialize Ollama client
-# llm_client = OllamaClient()
-llm_client = OpenRouterClient()
+def _cache_key(prompt: Prompt, client, request_params: Optional[Dict[str, Any]] = None) -> str:
+    # Everything that changes the output must be part of the key; the async
+    # clients share keys with their sync base class
+    provider = type(client).__name__.replace("Async", "", 1)
+    model = f"{provider}:{client.model}"
+    params = {
+        "temperature": getattr(client, "temperature", None),
+        "max_tokens": getattr(client, "max_tokens", None),
+        "n_ctx": getattr(client, "n_ctx", None)
+    }
+    params.update({k: v for k, v in (request_params or {}).items() if v is not None})
+    text = prompt if isinstance(prompt, str) else json.dumps(prompt, sort_keys=True)
+    return LLMCache.make_key(text, model, params)
+
+def _request_kwargs(
+    route_params: Dict[str, Any],
+    max_tokens: Optional[int],
+    stop: Optional[List[str]],
+    client: Any = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    # Route params override the node's defaults; temperature, max_tokens and
+    # stop are first-class generate() arguments, anything else is passed through.
+    # The schema and tools are only sent to clients whose model supports them.
+    params = dict(route_params)
+    kwargs = {
+        "max_tokens": params.pop("max_tokens", max_tokens),
+        "stop": params.pop("stop", stop)
+    }
+    if "temperature" in params:
+        kwargs["temperature"] = params.pop("temperature")
+    if response_schema and client is not None and client.supports_structured_output():
+        kwargs["response_schema"] = response_schema
+    if tools and client is not None and client.supports_tools():
+        kwargs["tools"] = tools
+    if params:
+        kwargs["additional_params"] = params
+    return kwargs
+
+async def _arequest_kwargs(
+    route_params: Dict[str, Any],
+    max_tokens: Optional[int],
+    stop: Optional[List[str]],
+    client: Any = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    # The first capability check of a client is a blocking HTTP probe; run it
+    # in a worker thread so it does not stall the event loop
+    if client is not None and (response_schema or tools):
+        return await asyncio.to_thread(_request_kwargs, route_params, max_tokens, stop, client, response_schema, tools)
+    return _request_kwargs(route_params, max_tokens, stop, client, response_schema, tools)
+
+def _flag(name: str) -> bool:
+    # Feature switches are read per call so they follow the environment of the run
+    return os.getenv(name, "true").lower() in ("1", "true", "yes")
+
+# AIMD concurrency control per backend: LLM_ADAPTIVE_CONCURRENCY=false disables it
+# Coalescing of identical in-flight prompts: LLM_SINGLE_FLIGHT=false disables it
+single_flight = SingleFlight()
+
+def _backend_slot(client, node: Optional[str], use_async: bool = False):
+    # The breaker name identifies the backend and is shared by sync and async clients;
+    # latency is compared per node, whose calls are alike in length
+    if not _flag("LLM_ADAPTIVE_CONCURRENCY"):
+        return nullcontext()
+    limiter = get_concurrency_limiter(client.breaker.name)
+    request_class = node or "default"
+    return limiter.aslot(request_class) if use_async else limiter.slot(request_class)
+
+def _select_backend(node: Optional[str], use_async: bool = False):
+    # Returns (client, route params, hedge, fallback); while the primary's
+    # circuit is open the route's fallback is used directly, without hedging
+    client, route_params = get_router().resolve(node, use_async)
+    fallback = get_router().fallback(node, use_async)
+    if fallback is not None and not client.breaker.is_available():
+        logger.warning(f"Circuit for {client.breaker.name} is open, using fallback {fallback[0].model}")
+        return fallback[0], fallback[1], None, None
+    return client, route_params, get_router().hedge(node, use_async), fallback
 
 # Learn more about calling the LLM: https://the-pocket.github.io/PocketFlow/utility_function/llm.html
-def call_llm(prompt: str, use_cache: bool = False) -> str:
+def call_llm(
+    prompt: Prompt,
+    use_cache: bool = False,
+    on_token: Optional[Callable[[str], Optional[bool]]] = None,
+    max_tokens: Optional[int] = None,
+    stop: Optional[List[str]] = None,
+    node: Optional[str] = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None
+) -> str:
     """
     Call Ollama API to get a response
+
+    prompt may be a list of chat messages; put the static part first (system
+    message) and append new turns at the end so provider prefix caching hits.
+    If on_token is given the response is streamed and on_token is called with
+    each chunk; returning True from it aborts the rest of the generation.
+    max_tokens and stop let each caller bound its own output. node names the
+    calling node class and selects its provider, model and sampling params
+    from the routing table. Transient failures are retried by the client; if
+    the backend stays down and the route has a fallback, the call moves there.
+    response_schema asks for a reply that is a JSON object following the
+    schema, on backends that support structured output; callers still have to
+    accept free text from the others (see supports_structured_output). tools
+    likewise offers OpenAI-style function definitions to backends that
+    support tool calling; a tool call comes back as the JSON object
+    {"name": ..., "arguments": {...}} (see supports_tools). Tool calls are
+    only returned by non-streaming calls.
     """
-    # Log the prompt
-    logger.info(f"PROMPT: {prompt}")
+    with track_call(node) as call:
+        # Log the prompt (written by a background thread, see prompt_log)
+        get_prompt_log().log_prompt(prompt, node)
     
-    # Check cache if enabled
-    if use_cache:
-        # Load cache from disk
-        cache = {}
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, 'r') as f:
-                    cache = json.load(f)
-            except:
-                logger.warning(f"Failed to load cache, starting with empty cache")
+        client, route_params, hedge, fallback = _select_backend(node)
+        request_kwargs = _request_kwargs(route_params, max_tokens, stop, client, response_schema, tools)
+        call.model = client.model
+    
+        # Check cache if enabled
+        cache_key = None
+        if use_cache:
+            cache_key = _cache_key(prompt, client, request_kwargs)
+            cached = get_cache().get(cache_key)
+            if cached is not None:
+                logger.info(f"Cache hit for key {cache_key[:12]}")
+                call.outcome = "cache_hit"
+                # Streaming callers (sinks, the decision stream parser) get the text in one chunk
+                if on_token is not None:
+                    on_token(cached)
+                return cached
+    
+        # Call Ollama API
+        def generate():
+            # Returns (text, aborted, cache key of the backend that answered)
+            nonlocal client, request_kwargs
+            key = cache_key
+            aborted = False
+            emitted = False
+            handle_token = None
+            if on_token is not None:
+                def handle_token(chunk: str) -> bool:
+                    nonlocal aborted, emitted
+                    call.first_token()
+                    emitted = True
+                    aborted = bool(on_token(chunk))
+                    return aborted
         
-        # Return from cache if exists
-        if prompt in cache:
-            logger.info(f"Cache hit for prompt: {prompt[:50]}...")
-            return cache[prompt]
+            try:
+                with _backend_slot(client, node):
+                    if hedge is not None:
+                        # Race a backup backend if the primary is slower than its p95
+                        hedge_client, hedge_params, policy = hedge
+                        response_text = hedged_generate(
+                            client, hedge_client, prompt,
+                            request_kwargs, _request_kwargs(hedge_params, max_tokens, stop, hedge_client, response_schema, tools),
+                            policy, on_token=handle_token
+                        )
+                    elif handle_token is None:
+                        response_text = client.generate(prompt, **request_kwargs)
+                    else:
+                        response_text = client.generate(prompt, stream=True, on_token=handle_token, **request_kwargs)
+            except Exception as e:
+                # Fail over only if the backend is down and nothing reached the caller yet
+                if fallback is None or emitted or not is_backend_failure(e):
+                    raise
+                logger.warning(f"Primary backend failed ({e}), using fallback {fallback[0].model}")
+                client = fallback[0]
+                call.model = client.model
+                request_kwargs = _request_kwargs(fallback[1], max_tokens, stop, client, response_schema, tools)
+                if use_cache:
+                    key = _cache_key(prompt, client, request_kwargs)
+                with _backend_slot(client, node):
+                    if handle_token is None:
+                        response_text = client.generate(prompt, **request_kwargs)
+                    else:
+                        response_text = client.generate(prompt, stream=True, on_token=handle_token, **request_kwargs)
+            return response_text, aborted, key
     
-    # Call Ollama API
-    try:
-        response_text = llm_client.generate(prompt)
+        try:
+            if _flag("LLM_SINGLE_FLIGHT"):
+                # Identical prompts already in flight (e.g. parallel sessions replaying
+                # one task) wait for that generation instead of paying for their own
+                flight_key = cache_key or _cache_key(prompt, client, request_kwargs)
+                (response_text, aborted, cache_key), shared = single_flight.do(flight_key, generate)
+                if shared:
+                    if aborted:
+                        # The leader stopped reading early; that text may not satisfy this caller
+                        response_text, aborted, cache_key = generate()
+                    else:
+                        logger.info(f"Coalesced with in-flight request {flight_key[:12]}")
+                        call.outcome = "coalesced"
+                        if on_token is not None:
+                            on_token(response_text)
+                        # The leader already logged and cached the response
+                        return response_text
+            else:
+                response_text, aborted, cache_key = generate()
+        
+            # Log the response
+            get_prompt_log().log_response(response_text, node, aborted)
+        
+            # Update cache if enabled; a truncated stream is not a full response
+            if use_cache and not aborted:
+                get_cache().put(cache_key, response_text)
+                logger.info(f"Added to cache")
         
-        # Log the response
-        logger.info(f"RESPONSE: {response_text}")
+            return response_text
         
-        # Update cache if enabled
+        except Exception as e:
+            logger.error(f"Error calling Ollama API: {e}")
+            raise
+
+async def acall_llm(
+    prompt: Prompt,
+    use_cache: bool = False,
+    timeout: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    stop: Optional[List[str]] = None,
+    node: Optional[str] = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None
+) -> str:
+    """
+    Async version of call_llm.
+
+    Requests from all coroutines share the async client's connection pool, so
+    one event loop can keep many calls in flight. Cancelling the calling task
+    aborts the underlying HTTP request.
+
+    Args:
+        prompt: Input prompt, or a list of chat messages
+        use_cache: Serve from / store in the response cache
+        timeout: Deadline for this request in seconds (None for the client's read timeout)
+        max_tokens: Maximum tokens to generate
+        stop: Stop sequences that end the generation
+        node: Calling node class name, selects the route
+        response_schema: JSON schema the reply must follow, where the backend supports it
+        tools: Function definitions the model must call one of, where the backend supports it
+
+    Returns:
+        Generated text
+    """
+    with track_call(node) as call:
+        get_prompt_log().log_prompt(prompt, node)
+
+        client, route_params, hedge, fallback = _select_backend(node, use_async=True)
+        request_kwargs = await _arequest_kwargs(route_params, max_tokens, stop, client, response_schema, tools)
+        call.model = client.model
+
+        cache_key = None
         if use_cache:
-            # Load cache again to avoid overwrites
-            cache = {}
-            if os.path.exists(cache_file):
-                try:
-                    with open(cache_file, 'r') as f:
-                        cache = json.load(f)
-                except:
-                    pass
-            
-            # Add to cache and save
-            cache[prompt] = response_text
+            cache_key = _cache_key(prompt, client, request_kwargs)
+            cached = get_cache().get(cache_key)
+            if cached is not None:
+                logger.info(f"Cache hit for key {cache_key[:12]}")
+                call.outcome = "cache_hit"
+                return cached
+
+        async def generate():
+            # Returns (text, cache key of the backend that answered)
+            nonlocal client, request_kwargs
+            key = cache_key
             try:
-                with open(cache_file, 'w') as f:
-                    json.dump(cache, f)
-                logger.info(f"Added to cache")
+                async with _backend_slot(client, node, use_async=True):
+                    if hedge is not None:
+                        hedge_client, hedge_params, policy = hedge
+                        response_text = await ahedged_generate(
+                            client, hedge_client, prompt,
+                            dict(request_kwargs, timeout=timeout),
+                            dict(await _arequest_kwargs(hedge_params, max_tokens, stop, hedge_client, response_schema, tools), timeout=timeout),
+                            policy
+                        )
+                    else:
+                        response_text = await client.generate(prompt, timeout=timeout, **request_kwargs)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Failed to save cache: {e}")
-        
+                if fallback is None or not is_backend_failure(e):
+                    raise
+                logger.warning(f"Primary backend failed ({e}), using fallback {fallback[0].model}")
+                client = fallback[0]
+                call.model = client.model
+                request_kwargs = await _arequest_kwargs(fallback[1], max_tokens, stop, client, response_schema, tools)
+                if use_cache:
+                    key = _cache_key(prompt, client, request_kwargs)
+                async with _backend_slot(client, node, use_async=True):
+                    response_text = await client.generate(prompt, timeout=timeout, **request_kwargs)
+            return response_text, key
+
+        try:
+            if _flag("LLM_SINGLE_FLIGHT"):
+                flight_key = cache_key or _cache_key(prompt, client, request_kwargs)
+                (response_text, cache_key), shared = await single_flight.ado(flight_key, generate)
+                if shared:
+                    logger.info(f"Coalesced with in-flight request {flight_key[:12]}")
+                    call.outcome = "coalesced"
+                    return response_text
+            else:
+                response_text, cache_key = await generate()
+        except asyncio.CancelledError:
+            logger.info("LLM call cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Error calling LLM API: {e}")
+            raise
+
+        get_prompt_log().log_response(response_text, node)
+
+        if use_cache:
+            get_cache().put(cache_key, response_text)
+            logger.info(f"Added to cache")
+
         return response_text
-        
-    except Exception as e:
-        logger.error(f"Error calling Ollama API: {e}")
-        raise
+
+def warm_up() -> bool:
+    """Open a pooled connection for every routed LLM client ahead of the first call."""
+    warmed = True
+    for name, client in get_router().clients().items():
+        ok = client.warm_up()
+        logger.info(f"Connection warm-up for {name} {'succeeded' if ok else 'failed'}")
+        warmed = warmed and ok
+    return warmed
+
+@contextmanager
+def keep_models_warm():
+    """Keep local models loaded (see OllamaClient.session_started) for the duration of a session."""
+    clients = [client for client in get_router().clients().values() if hasattr(client, "session_started")]
+    for client in clients:
+        client.session_started()
+    try:
+        yield
+    finally:
+        for client in clients:
+            client.session_finished()
+
+def _serving_client(node: Optional[str]):
+    # The client _select_backend sends the node's next call to: the fallback while the primary's circuit is open
+    client, _ = get_router().resolve(node)
+    fallback = get_router().fallback(node)
+    if fallback is not None and not client.breaker.is_available():
+        return fallback[0]
+    return client
+
+def supports_structured_output(node: Optional[str] = None) -> bool:
+    """Whether the backend serving node's next call can constrain its reply to a JSON schema."""
+    return _serving_client(node).supports_structured_output()
+
+def supports_tools(node: Optional[str] = None) -> bool:
+    """Whether the backend serving node's next call supports native tool calling."""
+    return _serving_client(node).supports_tools()
+
+def get_prompt_budget(node: Optional[str] = None, max_tokens: Optional[int] = None) -> int:
+    """
+    Get the prompt token budget of a node
+
+    The node's route prompt_budget wins, then LLM_PROMPT_BUDGET, and otherwise
+    whatever fits in the routed model's context window next to max_tokens.
+    """
+    budget = get_router().prompt_budget(node) or os.getenv("LLM_PROMPT_BUDGET")
+    if budget:
+        return int(budget)
+    client, route_params = get_router().resolve(node)
+    return client.prompt_budget(route_params.get("max_tokens", max_tokens))
+
+def get_telemetry_stats() -> dict:
+    """Return per-node, per-model call counts, latency/TTFT p50 and p99, tokens and retries, plus tokens per iteration."""
+    return telemetry.snapshot()
+
+def get_prompt_log_stats() -> dict:
+    """Records written and dropped by the background prompt log."""
+    return get_prompt_log().stats()
+
+def get_prompt_stats() -> dict:
+    """Return per-node, per-section prompt token counts and how often prompts were trimmed."""
+    return prompt_stats.snapshot()
+
+def get_pool_stats() -> dict:
+    """Return connection pool statistics per LLM client."""
+    return {name: client.pool_stats() for name, client in get_router().clients().items()}
+
+def get_usage_stats() -> dict:
+    """Return token usage totals per LLM client, including prefix-cached prompt tokens."""
+    return {name: client.usage_stats() for name, client in get_router().clients().items()}
+
+def get_hedge_stats() -> dict:
+    """Return hedge rate, win counts and current delay per hedged route."""
+    return get_router().hedge_stats()
+
+def get_resilience_stats() -> dict:
+    """Return retry counts, circuit breaker state and rate limiter waits per LLM client."""
+    return {name: client.resilience_stats() for name, client in get_router().clients().items()}
+
+def get_concurrency_stats() -> dict:
+    """Return the current adaptive concurrency limit and in-flight count per backend."""
+    return concurrency_stats()
+
+def get_single_flight_stats() -> dict:
+    """Return how many calls were coalesced onto an identical in-flight request."""
+    return single_flight.stats()
+
+def get_host_stats() -> dict:
+    """Return per-host load and model affinity state of every balanced (Ollama) client."""
+    return {name: client.host_stats() for name, client in get_router().clients().items() if hasattr(client, "host_stats")}
+
+def get_model_load_stats() -> dict:
+    """Return cold vs warm model load counts and times per local (Ollama) client."""
+    return {name: client.load_stats() for name, client in get_router().clients().items() if hasattr(client, "load_stats")}
+
+def get_context_stats() -> dict:
+    """Return num_ctx bucket usage, reloads and truncations per local (Ollama) client."""
+    return {
+        name: client.context_stats() for name, client in get_router().clients().items()
+        if hasattr(client, "context_stats") and client.context_stats() is not None
+    }
+
+def get_cache_stats() -> dict:
+    """Return hit/miss counters and size of the response cache."""
+    return get_cache().stats()
 
 def clear_cache() -> None:
-    """Clear the cache file if it exists."""
-    if os.path.exists(cache_file):
-        os.remove(cache_file)
-        logger.info("Cache cleared")
+    """Remove all cached responses."""
+    get_cache().clear()
+    logger.info("Cache cleared")
 
 if __name__ == "__main__":
     test_prompt = "Hello, how are you?"
@@ -0,0 +1,179 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Dict, Any, List
+from .resilience import is_overload
+
+logger = logging.getLogger("llm_concurrency")
+
+# Poll interval of async waiters (sync waiters are woken by a condition)
+_ASYNC_POLL = 0.02
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limit on concurrent requests to one backend.
+
+    The limit grows additively (about +1 per limit's worth of successful
+    requests) while it is actually binding and latency stays flat, and is cut
+    multiplicatively when the backend signals overload (429/503, timeouts) or
+    when the short-term latency average rises above tolerance times the
+    long-term one. The averages are kept per request class (the calling node):
+    a short tool decision and a long summary take very different times, so a
+    shift in which nodes are running is not a rise. Cuts are spaced by at
+    least one typical request latency so a burst of failures from one
+    overload episode counts once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 64,
+        overload_backoff: float = 0.5,
+        latency_backoff: float = 0.8,
+        latency_tolerance: float = 2.0
+    ):
+        """
+        Args:
+            name: Backend name for logs and stats
+            initial_limit: Starting concurrency limit
+            min_limit: Lower bound of the limit
+            max_limit: Upper bound of the limit
+            overload_backoff: Factor applied to the limit on 429s and timeouts
+            latency_backoff: Factor applied to the limit when latency rises
+            latency_tolerance: Short/long latency ratio considered a rise
+        """
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.overload_backoff = overload_backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        # Request class -> [short-term, long-term] latency average
+        self._latency: Dict[str, List[float]] = {}
+        self._last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+    @classmethod
+    def from_env(cls, name: str) -> "AdaptiveConcurrencyLimiter":
+        """Build a limiter from the LLM_CONCURRENCY_INITIAL / _MIN / _MAX env vars."""
+        return cls(
+            name,
+            initial_limit=float(os.getenv("LLM_CONCURRENCY_INITIAL", "4")),
+            min_limit=float(os.getenv("LLM_CONCURRENCY_MIN", "1")),
+            max_limit=float(os.getenv("LLM_CONCURRENCY_MAX", "64"))
+        )
+
+    def _try_acquire(self) -> Optional[bool]:
+        # Returns whether the limit was binding at admission, or None if full
+        with self._cond:
+            if self._in_flight >= int(self.limit):
+                return None
+            self._in_flight += 1
+            return self._in_flight >= int(self.limit)
+
+    def _decrease(self, factor: float, reason: str, spacing: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < spacing:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+        logger.info(f"Concurrency limit for {self.name} cut to {int(self.limit)} ({reason})")
+
+    def _release(self, request_class: str, latency: float, binding: bool, error: Optional[BaseException]) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            averages = self._latency.get(request_class)
+            if error is not None:
+                if is_overload(error):
+                    self._decrease(self.overload_backoff, type(error).__name__, averages[1] if averages else 0.0)
+            else:
+                if averages is None:
+                    averages = self._latency[request_class] = [latency, latency]
+                else:
+                    averages[0] += 0.3 * (latency - averages[0])
+                    averages[1] += 0.02 * (latency - averages[1])
+                if averages[0] > averages[1] * self.latency_tolerance:
+                    self._decrease(self.latency_backoff, f"latency of {request_class} rising", averages[1])
+                elif binding and self.limit < self.max_limit:
+                    # Only grow when the limit is what held requests back
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                    self.increases += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, request_class: str = "default"):
+        """Hold one concurrency slot for the block and feed its outcome back under request_class."""
+        binding = self._try_acquire()
+        if binding is None:
+            with self._cond:
+                while self._in_flight >= int(self.limit):
+                    self._cond.wait()
+                self._in_flight += 1
+                binding = True
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._release(request_class, time.monotonic() - start, binding, e)
+            raise
+        self._release(request_class, time.monotonic() - start, binding, None)
+
+    @asynccontextmanager
+    async def aslot(self, request_class: str = "default"):
+        """Async version of slot; waits without blocking the event loop."""
+        binding = self._try_acquire()
+        while binding is None:
+            await asyncio.sleep(_ASYNC_POLL)
+            binding = self._try_acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._release(request_class, time.monotonic() - start, binding, e)
+            raise
+        self._release(request_class, time.monotonic() - start, binding, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the controller state
+
+        Returns:
+            Dictionary with the current limit, in-flight count, adjustments and
+            short/long latency averages per request class
+        """
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self._in_flight,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "latency": {name: {"short": short, "long": long} for name, (short, long) in self._latency.items()}
+            }
+
+# One controller per backend, shared by its sync and async clients
+_limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_concurrency_limiter(name: str) -> AdaptiveConcurrencyLimiter:
+    """Get the process-wide controller of a backend, creating it from the environment."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = AdaptiveConcurrencyLimiter.from_env(name)
+        return limiter
+
+def concurrency_stats() -> Dict[str, Dict[str, Any]]:
+    """Return the state of every backend's controller."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
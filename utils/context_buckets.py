@@ -0,0 +1,109 @@
+import os
+import logging
+import threading
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger("context_buckets")
+
+DEFAULT_BUCKETS = (2048, 4096, 8192, 16384, 32768)
+
+class ContextSizer:
+    """
+    Chooses Ollama's num_ctx for a request from a small fixed set of sizes.
+
+    Ollama reloads the model whenever num_ctx changes, and silently drops the
+    start of prompts that do not fit. Using a few buckets keeps reloads rare:
+    the size the model is already loaded with is kept whenever the request
+    fits in it, otherwise the smallest bucket that fits is used. A request
+    larger than the biggest bucket gets the biggest one and is reported as
+    truncated.
+    """
+
+    def __init__(self, buckets: List[int], safety_margin: float = 1.25, reserve: int = 1024):
+        """
+        Args:
+            buckets: Allowed num_ctx values
+            safety_margin: Factor applied to the prompt token estimate
+            reserve: Output tokens reserved when the request sets no max_tokens
+        """
+        self.buckets = sorted(set(buckets))
+        self.safety_margin = safety_margin
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.resized = 0
+        self.kept_loaded = 0
+        self.truncated = 0
+        self.truncated_tokens = 0
+        self.per_bucket: Dict[int, int] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["ContextSizer"]:
+        """
+        Build a sizer from OLLAMA_CTX_BUCKETS (comma-separated sizes, "off" to
+        always send the client's n_ctx), OLLAMA_MAX_CTX and OLLAMA_CTX_RESERVE
+        """
+        value = os.getenv("OLLAMA_CTX_BUCKETS", "")
+        if value.lower() in ("off", "false", "0", "none"):
+            return None
+        buckets = [int(v) for v in value.split(",") if v.strip()] or list(DEFAULT_BUCKETS)
+        max_ctx = os.getenv("OLLAMA_MAX_CTX")
+        if max_ctx:
+            buckets = [b for b in buckets if b <= int(max_ctx)] or [int(max_ctx)]
+        return cls(buckets, reserve=int(os.getenv("OLLAMA_CTX_RESERVE", "1024")))
+
+    def needed(self, prompt_tokens: int, max_tokens: Optional[int]) -> int:
+        """Context needed for a prompt of prompt_tokens (estimated) plus its output."""
+        return int(prompt_tokens * self.safety_margin) + (max_tokens or self.reserve)
+
+    def choose(self, needed: int, loaded: Optional[int] = None) -> int:
+        """
+        Pick num_ctx for a request
+
+        Args:
+            needed: Context the request needs (see needed())
+            loaded: num_ctx the model is currently loaded with on the target host, if known
+
+        Returns:
+            num_ctx to send
+        """
+        if loaded is not None and loaded >= needed:
+            size = loaded
+            kept = True
+        else:
+            size = next((b for b in self.buckets if b >= needed), self.buckets[-1])
+            kept = False
+        with self._lock:
+            self.requests += 1
+            self.per_bucket[size] = self.per_bucket.get(size, 0) + 1
+            if kept:
+                self.kept_loaded += 1
+            elif loaded is not None and loaded != size:
+                self.resized += 1
+            if needed > size:
+                self.truncated += 1
+                self.truncated_tokens += needed - size
+        if needed > size:
+            logger.warning(f"Request needs ~{needed} tokens of context but the largest bucket is {size}; "
+                           f"Ollama will truncate the prompt")
+        elif loaded is not None and loaded != size:
+            logger.info(f"Resizing context from {loaded} to {size} tokens (model reload)")
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get sizing statistics
+
+        Returns:
+            Dictionary with requests per bucket, reloads caused, reloads avoided and truncations
+        """
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "requests": self.requests,
+                "per_bucket": dict(self.per_bucket),
+                "kept_loaded": self.kept_loaded,
+                "resized": self.resized,
+                "truncated": self.truncated,
+                "truncated_tokens": self.truncated_tokens
+            }
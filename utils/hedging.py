@@ -0,0 +1,249 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, Callable
+
+logger = logging.getLogger("llm_hedging")
+
+# Hedged attempts run on a shared pool so the calling thread can time them out
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+    return _executor
+
+class HedgePolicy:
+    """
+    Decides when to send a backup request and keeps the statistics needed to tune it.
+
+    The hedge delay is the given percentile of recently observed primary
+    latencies (time to first token), clamped to [min_delay, max_delay]. Until
+    enough samples exist, initial_delay is used.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        min_delay: float = 0.5,
+        max_delay: float = 30.0,
+        initial_delay: float = 5.0,
+        window: int = 200,
+        min_samples: int = 10
+    ):
+        """
+        Args:
+            percentile: Latency percentile that triggers the hedge (0-100)
+            min_delay: Lower bound of the hedge delay in seconds
+            max_delay: Upper bound of the hedge delay in seconds
+            initial_delay: Delay used until min_samples latencies were observed
+            window: Number of recent latencies kept
+            min_samples: Samples needed before the percentile is trusted
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.wins = {"primary": 0, "secondary": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "HedgePolicy":
+        """Build a policy from the tuning keys of a route's hedge section."""
+        keys = ("percentile", "min_delay", "max_delay", "initial_delay", "window", "min_samples")
+        return cls(**{k: config[k] for k in keys if k in config})
+
+    def observe(self, latency: float) -> None:
+        """Record a primary latency sample."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> float:
+        """Current hedge delay in seconds."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        index = min(int(len(samples) * self.percentile / 100), len(samples) - 1)
+        return min(max(samples[index], self.min_delay), self.max_delay)
+
+    def record(self, hedged: bool, winner: Optional[str]) -> None:
+        """Record the outcome of one call."""
+        with self._lock:
+            self.calls += 1
+            if hedged:
+                self.hedged += 1
+            if winner:
+                self.wins[winner] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hedging statistics
+
+        Returns:
+            Dictionary with call count, hedge rate, wins per backend and current delay
+        """
+        delay = self.delay()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "wins": dict(self.wins),
+                "delay": delay,
+                "samples": len(self._latencies)
+            }
+
+def hedged_generate(
+    primary: Any,
+    secondary: Any,
+    prompt: Any,
+    primary_kwargs: Dict[str, Any],
+    secondary_kwargs: Dict[str, Any],
+    policy: HedgePolicy,
+    on_token: Optional[Callable[[str], Optional[bool]]] = None
+) -> str:
+    """
+    Generate with a backup request if the primary is slow.
+
+    Both attempts stream. The first one to produce a token wins: its chunks go
+    to on_token and the other attempt aborts on its next chunk, which closes
+    its connection and cancels the generation upstream. If the primary has not
+    produced a token after policy.delay(), the secondary is started.
+
+    Args:
+        primary: Primary client
+        secondary: Secondary (hedge) client
+        prompt: Prompt or chat messages
+        primary_kwargs: generate() keyword arguments for the primary
+        secondary_kwargs: generate() keyword arguments for the secondary
+        policy: Hedge policy holding latency samples and statistics
+        on_token: Caller's streaming callback, fed from the winning attempt only
+
+    Returns:
+        Generated text of the winning attempt
+
+    Raises:
+        Exception: The primary's error if every attempt failed
+    """
+    lock = threading.Lock()
+    first_token = threading.Event()
+    state = {"winner": None}
+    start = time.monotonic()
+
+    def make_callback(name: str) -> Callable[[str], bool]:
+        seen = [False]
+
+        def callback(chunk: str) -> bool:
+            if not seen[0]:
+                seen[0] = True
+                if name == "primary":
+                    # Losing primaries are sampled too, so slow responses keep the delay honest
+                    policy.observe(time.monotonic() - start)
+            with lock:
+                if state["winner"] is None:
+                    state["winner"] = name
+                    first_token.set()
+                if state["winner"] != name:
+                    return True
+            return bool(on_token(chunk)) if on_token is not None else False
+        return callback
+
+    executor = _get_executor()
+    futures = {
+        # Each attempt runs in a copy of the caller's context so its usage is attributed to the call
+        executor.submit(contextvars.copy_context().run, primary.generate, prompt, stream=True, on_token=make_callback("primary"), **primary_kwargs): "primary"
+    }
+    primary_future = next(iter(futures))
+    primary_future.add_done_callback(lambda _: first_token.set())
+
+    hedged = False
+    if not first_token.wait(policy.delay()) or (primary_future.done() and primary_future.exception() is not None):
+        if state["winner"] is None:
+            hedged = True
+            logger.info(f"Hedging after {time.monotonic() - start:.2f}s")
+            futures[executor.submit(
+                contextvars.copy_context().run, secondary.generate, prompt, stream=True, on_token=make_callback("secondary"), **secondary_kwargs
+            )] = "secondary"
+
+    errors = {}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            if future.exception() is not None:
+                errors[name] = future.exception()
+                continue
+            with lock:
+                if state["winner"] is None:
+                    # Finished without emitting a token (empty response)
+                    state["winner"] = name
+                won = state["winner"] == name
+            if won:
+                policy.record(hedged, name)
+                return future.result()
+
+    policy.record(hedged, None)
+    raise errors.get("primary") or errors.get("secondary")
+
+async def ahedged_generate(
+    primary: Any,
+    secondary: Any,
+    prompt: Any,
+    primary_kwargs: Dict[str, Any],
+    secondary_kwargs: Dict[str, Any],
+    policy: HedgePolicy
+) -> str:
+    """
+    Async version of hedged_generate for the async clients.
+
+    The first attempt to complete successfully wins and the other task is
+    cancelled, which aborts its HTTP request. The async clients do not
+    stream, so policy samples completion times rather than time to first
+    token; it must not be the policy of the sync path (see LLMRouter.hedge).
+    """
+    start = time.monotonic()
+    tasks = {asyncio.ensure_future(primary.generate(prompt, **primary_kwargs)): "primary"}
+    done, _ = await asyncio.wait(set(tasks), timeout=policy.delay())
+
+    hedged = False
+    if not done or next(iter(done)).exception() is not None:
+        hedged = True
+        logger.info(f"Hedging after {time.monotonic() - start:.2f}s")
+        tasks[asyncio.ensure_future(secondary.generate(prompt, **secondary_kwargs))] = "secondary"
+
+    errors = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks[task]
+                if task.exception() is not None:
+                    errors[name] = task.exception()
+                    continue
+                if name == "primary" or any(tasks[other] == "primary" for other in pending):
+                    # A primary that loses is cancelled before it finishes; its latency is
+                    # at least the time to now, so the slow tail still raises the delay
+                    policy.observe(time.monotonic() - start)
+                policy.record(hedged, name)
+                return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    policy.record(hedged, None)
+    raise errors.get("primary") or errors.get("secondary")
@@ -0,0 +1,213 @@
+import socket
+import asyncio
+import logging
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger("http_pool")
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that enables TCP keep-alive probes on pooled sockets so idle
+    connections between agent iterations are not silently dropped by NATs/proxies.
+    """
+
+    def __init__(self, keep_alive_idle: Optional[int] = None, **kwargs):
+        self.keep_alive_idle = keep_alive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        if self.keep_alive_idle and hasattr(socket, "TCP_KEEPIDLE"):
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keep_alive_idle))
+        kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+def create_session(
+    pool_size: int = 10,
+    keep_alive: bool = True,
+    keep_alive_idle: Optional[int] = None
+) -> requests.Session:
+    """
+    Create a requests session backed by a shared connection pool.
+
+    Args:
+        pool_size: Maximum number of pooled connections per host
+        keep_alive: Keep connections open between requests (sends "Connection: close" if False)
+        keep_alive_idle: Seconds of idleness before TCP keep-alive probes start (Linux only)
+
+    Returns:
+        Configured requests.Session, safe to share between threads
+    """
+    session = requests.Session()
+    if keep_alive:
+        adapter = KeepAliveAdapter(
+            keep_alive_idle=keep_alive_idle,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.headers["Connection"] = "close"
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def warm_up(session: requests.Session, url: str, timeout: Tuple[float, float]) -> bool:
+    """
+    Open a pooled connection to url ahead of the first real request so the
+    TCP/TLS handshake is not paid by the first LLM call.
+
+    Args:
+        session: Session whose pool should be warmed
+        url: Any URL on the target host
+        timeout: (connect, read) timeout in seconds
+
+    Returns:
+        True if a connection was established, False otherwise
+    """
+    try:
+        # Any HTTP status means the connection is up and now sits in the pool
+        session.head(url, timeout=timeout).close()
+        return True
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Connection warm-up to {url} failed: {e}")
+        return False
+
+def pool_stats(session: requests.Session) -> Dict[str, Any]:
+    """
+    Collect connection pool statistics for a session.
+
+    Args:
+        session: Session created by create_session
+
+    Returns:
+        Dictionary with per-host and total counts of requests, opened connections,
+        reused connections and idle connections
+    """
+    hosts = {}
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen or not hasattr(adapter, "poolmanager"):
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # The pool queue is pre-filled with None placeholders for unopened slots
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+            num_requests = getattr(pool, "num_requests", 0)
+            num_connections = getattr(pool, "num_connections", 0)
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "requests": num_requests,
+                "connections_opened": num_connections,
+                "connections_reused": max(num_requests - num_connections, 0),
+                "idle_connections": idle
+            }
+
+    totals = {"requests": 0, "connections_opened": 0, "connections_reused": 0, "idle_connections": 0}
+    for host_stats in hosts.values():
+        for k in totals:
+            totals[k] += host_stats[k]
+    totals["hosts"] = hosts
+    return totals
+
+def create_async_client(
+    pool_size: int,
+    keep_alive: bool,
+    timeout: Tuple[float, float],
+    headers: Optional[Dict[str, str]] = None
+) -> httpx.AsyncClient:
+    """
+    Create an httpx.AsyncClient whose connection pool is shared by every
+    coroutine on the current event loop.
+
+    Args:
+        pool_size: Maximum number of pooled connections
+        keep_alive: Keep idle connections open between requests
+        timeout: (connect, read) timeout in seconds
+        headers: Default headers for every request
+
+    Returns:
+        Configured httpx.AsyncClient
+    """
+    return httpx.AsyncClient(
+        headers=headers,
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size if keep_alive else 0
+        ),
+        timeout=httpx.Timeout(timeout[1], connect=timeout[0])
+    )
+
+def discard_async_client(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """
+    Close a client created on another event loop, without awaiting it
+
+    Its connections belong to that loop. If the loop still runs (in another
+    thread) the client is closed there; once it has stopped, as after
+    asyncio.run returns, the sockets can only be shut down directly.
+
+    Args:
+        client: Client created by create_async_client
+        loop: Event loop the client was created on
+    """
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        return
+    pool = getattr(client._transport, "_pool", None)
+    for conn in list(getattr(pool, "connections", [])):
+        stream = getattr(getattr(conn, "_connection", None), "_network_stream", None)
+        sock = stream.get_extra_info("socket") if stream is not None else None
+        if sock is None:
+            continue
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+async def async_warm_up(client: httpx.AsyncClient, url: str) -> bool:
+    """
+    Async counterpart of warm_up.
+
+    Args:
+        client: Client whose pool should be warmed
+        url: Any URL on the target host
+
+    Returns:
+        True if a connection was established, False otherwise
+    """
+    try:
+        await client.head(url)
+        return True
+    except httpx.HTTPError as e:
+        logger.warning(f"Connection warm-up to {url} failed: {e}")
+        return False
+
+def async_pool_stats(client: Optional[httpx.AsyncClient], requests_sent: int) -> Dict[str, Any]:
+    """
+    Collect connection pool statistics for an httpx.AsyncClient.
+
+    Args:
+        client: Client created by create_async_client, or None if not opened yet
+        requests_sent: Number of requests sent through the client
+
+    Returns:
+        Dictionary with request, open and idle connection counts
+    """
+    connections = []
+    if client is not None:
+        pool = getattr(client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+    return {
+        "requests": requests_sent,
+        "connections_open": len(connections),
+        "idle_connections": sum(1 for conn in connections if conn.is_idle())
+    }
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger("llm_cache")
+
+class LLMCache:
+    """
+    On-disk LLM response cache backed by SQLite in WAL mode.
+
+    Entries are keyed by a hash of prompt + model + sampling params, values are
+    zlib-compressed. Reads are a single indexed lookup, and SQLite locking makes
+    the file safe to share between threads and processes. Eviction is LRU,
+    bounded by entry count and total compressed size, with an optional TTL.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        evict_every: int = 50
+    ):
+        """
+        Initialize the cache
+
+        Args:
+            path: SQLite file path (defaults to LLM_CACHE_PATH env var or 'llm_cache.db')
+            max_entries: Maximum number of entries (defaults to LLM_CACHE_MAX_ENTRIES env var or 10000)
+            max_bytes: Maximum total compressed size (defaults to LLM_CACHE_MAX_BYTES env var or 256 MiB)
+            ttl: Entry lifetime in seconds, 0 disables expiry (defaults to LLM_CACHE_TTL env var or 0)
+            evict_every: Run the eviction pass once per this many inserts
+        """
+        self.path = path or os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+        self.max_bytes = max_bytes or int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.ttl = ttl if ttl is not None else float(os.getenv("LLM_CACHE_TTL", "0"))
+        self.evict_every = evict_every
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._inserts = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(prompt: str, model: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Build the cache key for a request
+
+        Args:
+            prompt: Prompt text
+            model: Model identifier (including provider)
+            params: Sampling parameters that affect the output
+
+        Returns:
+            Hex SHA-256 digest
+        """
+        material = json.dumps({"model": model, "params": params or {}}, sort_keys=True, default=str)
+        digest = hashlib.sha256(material.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(prompt.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            Cached response text, or None on miss or expiry
+        """
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            value = zlib.decompress(row[0]).decode("utf-8")
+        except (sqlite3.Error, zlib.error) as e:
+            logger.warning(f"Cache lookup failed: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        """
+        Store a response
+
+        Args:
+            key: Key from make_key
+            value: Response text
+        """
+        blob = zlib.compress(value.encode("utf-8"))
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Cache insert failed: {e}")
+            return
+
+        with self._lock:
+            self._inserts += 1
+            should_evict = self._inserts % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove expired entries, then least recently used entries until the
+        cache is within its entry and size bounds
+
+        Returns:
+            Number of entries removed
+        """
+        removed = 0
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.ttl:
+                    removed += conn.execute(
+                        "DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,)
+                    ).rowcount
+
+                count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                if count > self.max_entries or total > self.max_bytes:
+                    excess_count = max(count - self.max_entries, 0)
+                    excess_bytes = max(total - self.max_bytes, 0)
+                    victims = []
+                    freed = 0
+                    for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+                        if len(victims) >= excess_count and freed >= excess_bytes:
+                            break
+                        victims.append((key,))
+                        freed += size
+                    conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+                    removed += len(victims)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Cache eviction failed: {e}")
+            return removed
+
+        if removed:
+            with self._lock:
+                self.evictions += removed
+            logger.info(f"Evicted {removed} cache entries")
+        return removed
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._conn().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics
+
+        Returns:
+            Dictionary with hit/miss/eviction counters of this process and the
+            current entry count and compressed size of the cache file
+        """
+        try:
+            count, total = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        except sqlite3.Error:
+            count, total = None, None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": count,
+                "bytes": total
+            }
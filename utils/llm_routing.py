@@ -0,0 +1,247 @@
+import os
+import yaml
+import logging
+import threading
+from typing import Optional, Dict, Any, Tuple
+from .ollama_client import OllamaClient, AsyncOllamaClient
+from .openrouter_client import OpenRouterClient, AsyncOpenRouterClient
+from .hedging import HedgePolicy
+
+logger = logging.getLogger("llm_routing")
+
+# provider name -> (sync client class, async client class)
+PROVIDERS = {
+    "openrouter": (OpenRouterClient, AsyncOpenRouterClient),
+    "ollama": (OllamaClient, AsyncOllamaClient),
+}
+
+def register_provider(name: str, client_class: Any, async_client_class: Any) -> None:
+    """
+    Make a provider available to routes and LLM_PROVIDER, e.g. a fake backend for benchmarks
+
+    Args:
+        name: Provider name used in routes
+        client_class: Sync client class; constructed with the route's options and model
+        async_client_class: Async client class with the same constructor
+    """
+    PROVIDERS[name] = (client_class, async_client_class)
+
+def load_routes(path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Load the routing table from a YAML file.
+
+    The file maps node class names (or "default") to a route:
+
+        MainDecisionAgent:
+          provider: ollama              # key of PROVIDERS
+          model: qwen2.5-coder:7b
+          options:                      # client constructor arguments
+            base_url: http://localhost:11434
+          params:                       # per-request sampling parameters
+            temperature: 0.1
+        AnalyzeAndPlanNode:
+          provider: openrouter
+          model: anthropic/claude-3.5-sonnet
+          params:
+            temperature: 0.0
+          hedge:                        # optional backup backend for slow calls
+            provider: openrouter
+            model: openai/gpt-4o
+            params: {temperature: 0.0}
+            percentile: 95              # HedgePolicy tuning keys
+            min_delay: 1.0
+          fallback:                     # optional backend used while the primary's
+            provider: ollama            # circuit breaker is open or after it failed
+            model: qwen2.5-coder:7b
+            params: {temperature: 0.0}
+
+    Args:
+        path: YAML file path (defaults to LLM_ROUTES_FILE env var); no file means no routes
+
+    Returns:
+        Dictionary of node name to route
+    """
+    path = path or os.getenv("LLM_ROUTES_FILE")
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        routes = yaml.safe_load(f) or {}
+    if not isinstance(routes, dict):
+        raise ValueError(f"Invalid routes file {path}: expected a mapping of node names to routes")
+    for node, route in routes.items():
+        if not isinstance(route, dict) or route.get("provider") not in PROVIDERS:
+            raise ValueError(f"Invalid route for {node}: provider must be one of {sorted(PROVIDERS)}")
+        for section in ("hedge", "fallback"):
+            target = route.get(section)
+            if target is not None and (not isinstance(target, dict) or target.get("provider") not in PROVIDERS):
+                raise ValueError(f"Invalid {section} for {node}: provider must be one of {sorted(PROVIDERS)}")
+    return routes
+
+class LLMRouter:
+    """
+    Resolves the client and sampling parameters to use for a calling node.
+
+    Clients are created on first use and shared by all nodes whose routes
+    point at the same provider, model and options, so routing does not cost
+    extra connection pools. The sync and async client of one backend share
+    its retry policy and circuit breaker.
+    """
+
+    def __init__(
+        self,
+        routes: Dict[str, Dict[str, Any]],
+        default_client: Any = None,
+        default_async_client: Any = None,
+        default_provider: Optional[str] = None
+    ):
+        """
+        Args:
+            routes: Routing table from load_routes
+            default_client: Client for nodes without a route (and no "default" route)
+            default_async_client: Async counterpart of default_client
+            default_provider: Provider (with its env-configured model) for nodes without a route,
+                used when no default client is given; its clients are created on first use
+        """
+        if default_provider is not None and default_provider not in PROVIDERS:
+            raise ValueError(f"Unknown provider {default_provider}: must be one of {sorted(PROVIDERS)}")
+        self.routes = routes
+        self.default_client = default_client
+        self.default_async_client = default_async_client
+        self.default_route = {"provider": default_provider} if default_provider and default_client is None else None
+        self._clients: Dict[Tuple, Any] = {}
+        self._hedge_policies: Dict[str, HedgePolicy] = {}
+        self._lock = threading.Lock()
+        if default_client is not None and default_async_client is not None:
+            self._share_resilience(default_client, default_async_client)
+
+    @staticmethod
+    def _share_resilience(source: Any, target: Any) -> None:
+        target.retry_policy = source.retry_policy
+        target.breaker = source.breaker
+
+    def _route_name(self, node: Optional[str]) -> Optional[str]:
+        if node and node in self.routes:
+            return node
+        return "default" if "default" in self.routes else None
+
+    def _route(self, node: Optional[str]) -> Optional[Dict[str, Any]]:
+        name = self._route_name(node)
+        return self.routes[name] if name else self.default_route
+
+    def _client(self, route: Dict[str, Any], use_async: bool) -> Any:
+        options = dict(route.get("options") or {})
+        if route.get("model"):
+            options["model"] = route["model"]
+        backend = (route["provider"], tuple(sorted((k, repr(v)) for k, v in options.items())))
+        key = (backend, use_async)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client_class = PROVIDERS[route["provider"]][1 if use_async else 0]
+                    client = client_class(**options)
+                    counterpart = self._clients.get((backend, not use_async))
+                    if counterpart is not None:
+                        self._share_resilience(counterpart, client)
+                    self._clients[key] = client
+                    logger.info(f"Created {client_class.__name__} for model {client.model}")
+        return client
+
+    def resolve(self, node: Optional[str] = None, use_async: bool = False) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Get the client and sampling parameters for a node
+
+        Args:
+            node: Calling node class name, or None for the default route
+            use_async: Return the async client variant
+
+        Returns:
+            Tuple of (client, sampling params)
+        """
+        route = self._route(node)
+        if route is None:
+            return (self.default_async_client if use_async else self.default_client), {}
+        return self._client(route, use_async), dict(route.get("params") or {})
+
+    def hedge(self, node: Optional[str] = None, use_async: bool = False) -> Optional[Tuple[Any, Dict[str, Any], HedgePolicy]]:
+        """
+        Get the backup backend for a node's route, if it has one
+
+        Args:
+            node: Calling node class name
+            use_async: Return the async client variant
+
+        Returns:
+            Tuple of (client, sampling params, policy), or None if the route is not hedged
+        """
+        name = self._route_name(node)
+        hedge = self.routes[name].get("hedge") if name else None
+        if not hedge:
+            return None
+        # The sync path hedges on time to first token, the async path on completion
+        # time, so each keeps its own latency samples
+        key = f"{name}:async" if use_async else name
+        policy = self._hedge_policies.get(key)
+        if policy is None:
+            with self._lock:
+                policy = self._hedge_policies.setdefault(key, HedgePolicy.from_config(hedge))
+        return self._client(hedge, use_async), dict(hedge.get("params") or {}), policy
+
+    def fallback(self, node: Optional[str] = None, use_async: bool = False) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """
+        Get the fallback backend for a node's route, if it has one
+
+        Args:
+            node: Calling node class name
+            use_async: Return the async client variant
+
+        Returns:
+            Tuple of (client, sampling params), or None if the route has no fallback
+        """
+        name = self._route_name(node)
+        fallback = self.routes[name].get("fallback") if name else None
+        if not fallback:
+            return None
+        return self._client(fallback, use_async), dict(fallback.get("params") or {})
+
+    def prompt_budget(self, node: Optional[str] = None) -> Optional[int]:
+        """Get the prompt token limit set on a node's route, if any."""
+        route = self._route(node)
+        return route.get("prompt_budget") if route else None
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        """
+        Get hedging statistics per route
+
+        Returns:
+            Dictionary of route name (with an ":async" suffix for async calls) to HedgePolicy.stats()
+        """
+        return {name: policy.stats() for name, policy in list(self._hedge_policies.items())}
+
+    def clients(self) -> Dict[str, Any]:
+        """
+        Get the sync client of every route (created if needed) and the default
+
+        The default provider's client is only included once a node without a
+        route has used it: when every node is routed elsewhere, that provider
+        may not be configured at all (e.g. no API key).
+
+        Returns:
+            Dictionary of "<Provider>:<model>" to client
+        """
+        clients = {}
+        if self.default_client is not None:
+            clients[f"{type(self.default_client).__name__}:{self.default_client.model}"] = self.default_client
+        if self.default_route is not None and "default" not in self.routes:
+            with self._lock:
+                created = [client for (backend, use_async), client in self._clients.items()
+                           if not use_async and backend == (self.default_route["provider"], ())]
+            for client in created:
+                clients[f"{type(client).__name__}:{client.model}"] = client
+        for route in self.routes.values():
+            for target in (route, route.get("hedge"), route.get("fallback")):
+                if target:
+                    client = self._client(target, use_async=False)
+                    clients[f"{type(client).__name__}:{client.model}"] = client
+        return clients
@@ -0,0 +1,58 @@
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+from .prompt_log import get_prompt_log
+
+# Loggers that also write a daily file of their own to the log directory
+DAILY_LOG_FILES = {
+    "llm_logger": "llm_calls",
+    "openrouter_logger": "openrouter",
+    "ollama_logger": "ollama",
+}
+
+_configured = False
+_lock = threading.Lock()
+
+def configure_logging(
+    level: int = logging.INFO,
+    log_dir: Optional[str] = None,
+    agent_log: Optional[str] = "coding_agent.log"
+) -> None:
+    """
+    Set up the agent's logging: console and agent_log for every logger, a
+    daily file per LLM logger in log_dir, and the background prompt log
+    (llm_prompts.log in log_dir, see prompt_log.PromptLog). Entry points call
+    this; importing modules never touches logging or the filesystem. Calls
+    after the first do nothing.
+
+    Args:
+        level: Root log level
+        log_dir: Directory of the daily LLM logs (defaults to LOG_DIR env var or 'logs')
+        agent_log: Log file of all loggers, None for the console only
+    """
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        handlers = [logging.StreamHandler()]
+        if agent_log:
+            handlers.append(logging.FileHandler(agent_log))
+        logging.basicConfig(
+            level=level,
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            handlers=handlers
+        )
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+        log_dir = log_dir or os.getenv("LOG_DIR", "logs")
+        os.makedirs(log_dir, exist_ok=True)
+        for name, prefix in DAILY_LOG_FILES.items():
+            file_handler = logging.FileHandler(os.path.join(log_dir, f"{prefix}_{datetime.now().strftime('%Y%m%d')}.log"))
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            logger = logging.getLogger(name)
+            logger.setLevel(logging.INFO)
+            logger.addHandler(file_handler)
+        get_prompt_log().start(os.path.join(log_dir, "llm_prompts.log"))
+        _configured = True
@@ -1,86 +1,553 @@
 import os
+import json
+import time
+import threading
+import asyncio
+import httpx
 import requests
-from typing import Optional
-from dotenv import load_dotenv
-from datetime import datetime
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, Callable, List, Union, Tuple
 import logging
+from .usage import UsageStats, ModelLoadStats
+from .resilience import RetryPolicy, CircuitBreaker, call_with_retries, acall_with_retries
+from .rate_limit import get_rate_limiter, estimate_tokens
+from .token_budget import count_prompt_tokens
+from .structured_output import tool_call_text
+from .telemetry import note_usage, note_server_ttft, note_finish_reason
+from .ollama_pool import OllamaHostPool, parse_base_urls
+from .context_buckets import ContextSizer
+from .http_pool import (
+    create_session, warm_up, pool_stats,
+    create_async_client, async_warm_up, async_pool_stats, discard_async_client
+)
 
-# Configure logging
-log_directory = os.getenv("LOG_DIR", "logs")
-os.makedirs(log_directory, exist_ok=True)
-log_file = os.path.join(log_directory, f"ollama_{datetime.now().strftime('%Y%m%d')}.log")
-
-# Set up logger
+# Handlers are attached by log_config.configure_logging
 logger = logging.getLogger("ollama_logger")
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(log_file)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
 
-# Load environment variables
-load_dotenv()
+def _keep_alive_value(value: Union[str, int, float]) -> Union[str, int]:
+    # Ollama takes a duration string ("30m") or a number of seconds; a bare
+    # number in a string would be rejected as a duration
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
 
 class OllamaClient:
     def __init__(
         self,
-        base_url: Optional[str] = None,
+        base_url: Optional[Union[str, List[str]]] = None,
         model: Optional[str] = None,
         n_ctx: Optional[int] = None,
-        temperature: Optional[float] = None
+        temperature: Optional[float] = None,
+        pool_size: Optional[int] = None,
+        keep_alive: Optional[bool] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        model_keep_alive: Optional[str] = None
     ):
         """
         Initialize Ollama client
         
         Args:
-            base_url: Base URL for Ollama API (defaults to OLLAMA_BASE_URL env var or 'http://localhost:11434')
+            base_url: Base URL for Ollama API, or a list / comma-separated string of URLs to balance
+                over (defaults to OLLAMA_BASE_URLS or OLLAMA_BASE_URL env var or 'http://localhost:11434')
             model: Model name to use (defaults to OLLAMA_MODEL env var or 'llama2')
-            n_ctx: Context window size (defaults to OLLAMA_N_CTX env var or 4096)
+            n_ctx: Context window size (defaults to OLLAMA_N_CTX env var or 4096); with context
+                buckets enabled (OLLAMA_CTX_BUCKETS) it is only used for preloading
             temperature: Sampling temperature (0.0 to 1.0, defaults to OLLAMA_TEMPERATURE env var or 0.7)
+            pool_size: Maximum pooled connections (defaults to OLLAMA_POOL_SIZE env var or 4)
+            keep_alive: Keep connections open between calls (defaults to OLLAMA_HTTP_KEEP_ALIVE env var or True)
+            connect_timeout: Connect timeout in seconds (defaults to OLLAMA_CONNECT_TIMEOUT env var or 5)
+            read_timeout: Read timeout in seconds (defaults to OLLAMA_READ_TIMEOUT env var or 600)
+            model_keep_alive: How long Ollama keeps the model in memory after a request, e.g. "30m"
+                or seconds, -1 for forever (defaults to OLLAMA_KEEP_ALIVE env var or '30m')
         """
-        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        self.base_urls = parse_base_urls(
+            base_url or os.getenv("OLLAMA_BASE_URLS") or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        )
+        self.base_url = self.base_urls[0]
         self.model = model or os.getenv("OLLAMA_MODEL", "llama2")
         self.n_ctx = n_ctx or int(os.getenv("OLLAMA_N_CTX", "4096"))
         self.temperature = temperature or float(os.getenv("OLLAMA_TEMPERATURE", "0.7"))
+        self.pool_size = pool_size or int(os.getenv("OLLAMA_POOL_SIZE", "4"))
+        if keep_alive is None:
+            keep_alive = os.getenv("OLLAMA_HTTP_KEEP_ALIVE", "true").lower() in ("1", "true", "yes")
+        self.keep_alive = keep_alive
+        self.timeout = (
+            connect_timeout or float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5")),
+            read_timeout or float(os.getenv("OLLAMA_READ_TIMEOUT", "600"))
+        )
+        self.model_keep_alive = _keep_alive_value(model_keep_alive or os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+        # Load the model during warm_up() so the first real call does not pay for it
+        self.preload_on_warm_up = os.getenv("OLLAMA_PRELOAD", "true").lower() in ("1", "true", "yes")
+        # While sessions are active, ping the model when no request kept it warm for this long
+        self.keep_warm_interval = float(os.getenv("OLLAMA_KEEP_WARM_INTERVAL", "240"))
+        # JSON schema "format" needs Ollama 0.5+; OLLAMA_STRUCTURED_OUTPUT=false for older servers
+        self.structured_output = os.getenv("OLLAMA_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+        # "auto" asks /api/show whether the model's template supports tools
+        self.tool_calling = os.getenv("OLLAMA_TOOL_CALLING", "auto").lower()
+        self._tools_supported = None
+
+        self.usage = UsageStats()
+        # Per-request num_ctx from a few fixed sizes, None to always send n_ctx
+        self.ctx_sizer = ContextSizer.from_env()
+        self.context_window = self.ctx_sizer.buckets[-1] if self.ctx_sizer else self.n_ctx
+        self.loads = ModelLoadStats(float(os.getenv("OLLAMA_COLD_LOAD_THRESHOLD", "0.5")))
+        self._last_request = 0.0
+        self._active_sessions = 0
+        self._keep_warm_cond = threading.Condition()
+        self._keep_warm_thread = None
+        # Requests are balanced over the hosts with model affinity
+        self.hosts = OllamaHostPool(
+            self.base_urls,
+            timeout=(self.timeout[0], 10),
+            check_interval=float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL", "15")),
+            max_outstanding=int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+        )
+        # Retries (OLLAMA_MAX_RETRIES, ...) and the breaker (OLLAMA_BREAKER_*) are per client
+        self.retry_policy = RetryPolicy.from_env("OLLAMA")
+        self.breaker = CircuitBreaker.from_env(f"ollama:{','.join(self.base_urls)}/{self.model}", "OLLAMA")
+        # Per-host limits (OLLAMA_MAX_IN_FLIGHT, ...) shared by all clients and processes
+        self.rate_limiter = get_rate_limiter("ollama-" + "+".join(urlparse(url).netloc for url in self.base_urls), "OLLAMA")
 
-        logger.info(f"base_url: {self.base_url}")
+        self._open_transport()
+
+        logger.info(f"base_urls: {self.base_urls}")
         logger.info(f"model: {self.model}")
         logger.info(f"n_ctx: {self.n_ctx}")
         logger.info(f"temperature: {self.temperature}")
+        logger.info(f"pool_size: {self.pool_size}, keep_alive: {self.keep_alive}, timeout: {self.timeout}")
+        logger.info(f"model_keep_alive: {self.model_keep_alive}")
+
+    def _open_transport(self) -> None:
+        # One pooled session shared by every call and thread using this client
+        self.session = create_session(pool_size=self.pool_size, keep_alive=self.keep_alive)
+
+    def _sync_session(self) -> requests.Session:
+        # Session for preloads, which also run from the keep-warm thread
+        return self.session
+
+    def preload(self) -> Optional[float]:
+        """
+        Load the model into memory on the host that will serve it
+        
+        Sends a generate request without a prompt, which makes Ollama load the
+        model and reset its keep_alive timer without generating anything.
+        
+        Returns:
+            Seconds the request took, or None if it failed
+        """
+        host = self.hosts.acquire(self.model)
+        # Load with the context size real requests will use, or they would reload it
+        num_ctx = self.hosts.loaded_context(host, self.model)
+        if num_ctx is None:
+            num_ctx = self.ctx_sizer.choose(self.n_ctx) if self.ctx_sizer else self.n_ctx
+        start = time.monotonic()
+        try:
+            response = self._sync_session().post(
+                f"{host.url}/api/generate",
+                json={"model": self.model, "keep_alive": self.model_keep_alive, "options": {"num_ctx": num_ctx}},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.hosts.release(host, error=e)
+            logger.warning(f"Preloading {self.model} on {host.url} failed: {e}")
+            return None
+        self.hosts.release(host, self.model, num_ctx=num_ctx)
+        elapsed = time.monotonic() - start
+        self._last_request = time.monotonic()
+        data = response.json()
+        # load_duration is in nanoseconds; fall back to wall time if it is missing
+        load = data.get("load_duration", elapsed * 1e9) / 1e9
+        cold = self.loads.record(load, preload=True)
+        logger.info(f"Preloaded {self.model} on {host.url} in {elapsed:.2f}s ({'cold' if cold else 'warm'})")
+        return elapsed
+
+    def session_started(self) -> None:
+        """
+        Mark an agent session as active
+        
+        While any session is active a background thread pings the model
+        whenever keep_warm_interval passes without a request, so tool I/O and
+        user think time between LLM calls do not let Ollama unload it.
+        """
+        with self._keep_warm_cond:
+            self._active_sessions += 1
+            if self._keep_warm_thread is None and self.keep_warm_interval > 0:
+                self._keep_warm_thread = threading.Thread(target=self._keep_warm, name="ollama-keep-warm", daemon=True)
+                self._keep_warm_thread.start()
+
+    def session_finished(self) -> None:
+        """Mark an agent session as finished."""
+        with self._keep_warm_cond:
+            self._active_sessions = max(self._active_sessions - 1, 0)
+            self._keep_warm_cond.notify_all()
+
+    def _keep_warm(self) -> None:
+        # A failed ping leaves _last_request unchanged, so also wait an
+        # interval after every attempt instead of retrying a down host at once
+        last_attempt = 0.0
+        while True:
+            with self._keep_warm_cond:
+                if self._active_sessions == 0:
+                    self._keep_warm_thread = None
+                    return
+                idle = time.monotonic() - max(self._last_request, last_attempt)
+                if idle < self.keep_warm_interval:
+                    self._keep_warm_cond.wait(self.keep_warm_interval - idle)
+                    continue
+            last_attempt = time.monotonic()
+            self.preload()
+
+    def load_stats(self) -> Dict[str, Any]:
+        """
+        Get model load statistics
+        
+        Returns:
+            Dictionary of cold and warm load counts and times
+        """
+        return self.loads.snapshot()
+
+    def warm_up(self) -> bool:
+        """
+        Health-check the Ollama servers, open a pooled connection to each and
+        preload the model (unless OLLAMA_PRELOAD is false)
+        
+        Returns:
+            True if every connection was established and the model loaded
+        """
+        self.hosts.refresh()
+        results = [warm_up(self.session, url, self.timeout) for url in self.base_urls]
+        if self.preload_on_warm_up:
+            results.append(self.preload() is not None)
+        return all(results)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Get connection pool statistics
+        
+        Returns:
+            Dictionary with request, opened, reused and idle connection counts
+        """
+        return pool_stats(self.session)
+
+    def supports_structured_output(self) -> bool:
+        """
+        Check whether requests may constrain the reply with a JSON schema
+        
+        Returns:
+            True if requests may pass response_schema
+        """
+        return self.structured_output
+
+    def supports_tools(self) -> bool:
+        """
+        Check whether the model accepts tool definitions on /api/chat
+        
+        Returns:
+            True if requests may pass tools
+        """
+        if self.tool_calling != "auto":
+            return self.tool_calling in ("1", "true", "yes")
+        if self._tools_supported is None:
+            try:
+                # Plain request: the async client has no requests session to use
+                response = requests.post(
+                    f"{self.hosts.healthy_url()}/api/show", json={"model": self.model}, timeout=self.timeout
+                )
+                response.raise_for_status()
+                info = response.json()
+                if "capabilities" in info:
+                    self._tools_supported = "tools" in info["capabilities"]
+                else:
+                    # Before capabilities were reported, tool support showed in the template
+                    self._tools_supported = ".Tools" in (info.get("template") or "")
+                logger.info(f"tool calling for {self.model}: {self._tools_supported}")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning(f"Could not look up tool support of {self.model}: {e}")
+                self._tools_supported = False
+        return self._tools_supported
+
+    def prompt_budget(self, max_tokens: Optional[int] = None) -> int:
+        """
+        Get how many prompt tokens fit in the largest context next to the output
+        
+        Args:
+            max_tokens: Output tokens the request reserves (num_predict)
+            
+        Returns:
+            Prompt token budget, with the context sizer's safety margin applied
+        """
+        if self.ctx_sizer is None:
+            return self.context_window - (max_tokens or 1024)
+        return int((self.context_window - (max_tokens or self.ctx_sizer.reserve)) / self.ctx_sizer.safety_margin)
+
+    def resilience_stats(self) -> Dict[str, Any]:
+        """
+        Get retry and circuit breaker statistics
+        
+        Returns:
+            Dictionary with the retry count and the breaker state
+        """
+        return {
+            "retries": self.retry_policy.retries,
+            "breaker": self.breaker.stats(),
+            "rate_limit": self.rate_limiter.stats() if self.rate_limiter.enabled else None
+        }
+
+    def host_stats(self) -> Dict[str, Any]:
+        """
+        Get load balancing state
+        
+        Returns:
+            Dictionary of host URL to health, outstanding requests and loaded models
+        """
+        return self.hosts.stats()
+
+    def context_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Get context bucket statistics
+        
+        Returns:
+            Dictionary of requests per num_ctx bucket, reloads and truncations, or None if disabled
+        """
+        return self.ctx_sizer.stats() if self.ctx_sizer else None
+
+    def _needed_context(
+        self,
+        prompt: Union[str, List[Dict[str, Any]]],
+        max_tokens: Optional[int],
+        additional_params: Optional[Dict[str, Any]]
+    ) -> Optional[int]:
+        # None keeps the payload's num_ctx (buckets disabled or set by the caller)
+        if self.ctx_sizer is None or (additional_params and "num_ctx" in additional_params):
+            return None
+        return self.ctx_sizer.needed(count_prompt_tokens(prompt), max_tokens)
+
+    def _size_context(self, payload: Dict[str, Any], host: Any, needed: Optional[int]) -> Tuple[Dict[str, Any], int]:
+        # num_ctx depends on what the chosen host has loaded, so it is set per attempt
+        if needed is None:
+            return payload, payload["options"].get("num_ctx")
+        num_ctx = self.ctx_sizer.choose(needed, self.hosts.loaded_context(host, self.model))
+        return dict(payload, options=dict(payload["options"], num_ctx=num_ctx)), num_ctx
+
+    def _post(
+        self,
+        path: str,
+        payload: Dict[str, Any],
+        stream: bool,
+        needed_context: Optional[int] = None,
+        tokens: int = 0
+    ) -> Tuple[requests.Response, Any, int, Callable[[], None]]:
+        # Only the request up to the response headers is retried; once a
+        # stream has started, chunks may already have reached the caller.
+        # Every attempt takes its own rate budget and slot and picks a host,
+        # so a retry can land on another server; the caller releases the
+        # returned host and slot when the response is consumed
+        def send() -> Tuple[requests.Response, Any, int, Callable[[], None]]:
+            release = self.rate_limiter.claim(tokens)
+            try:
+                host = self.hosts.acquire(self.model)
+                body, num_ctx = self._size_context(payload, host, needed_context)
+                try:
+                    response = self.session.post(f"{host.url}{path}", json=body, stream=stream, timeout=self.timeout)
+                    try:
+                        response.raise_for_status()
+                    except requests.exceptions.HTTPError:
+                        response.close()
+                        raise
+                except Exception as e:
+                    self.hosts.release(host, error=e)
+                    raise
+            except BaseException:
+                release()
+                raise
+            return response, host, num_ctx, release
+        return call_with_retries(send, self.retry_policy, self.breaker)
 
     def generate(
         self,
-        prompt: str,
+        prompt: Union[str, List[Dict[str, Any]]],
         stream: bool = False,
-        temperature: Optional[float] = None
+        temperature: Optional[float] = None,
+        on_token: Optional[Callable[[str], Optional[bool]]] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        additional_params: Optional[Dict[str, Any]] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None
     ) -> str:
         """
         Generate text using Ollama API
         
+        A list of chat messages is sent to /api/chat. Keeping their leading
+        messages identical between calls lets Ollama reuse the KV cache of the
+        common prefix instead of re-evaluating it.
+        
         Args:
-            prompt: Input prompt
+            prompt: Input prompt, or a list of chat messages
             stream: Whether to stream the response
             temperature: Override default temperature for this request
+            on_token: Called with each streamed chunk; returning True aborts the generation
+            max_tokens: Maximum tokens to generate (num_predict), unlimited if None
+            stop: Stop sequences that end the generation
+            additional_params: Extra model options (e.g. top_p, repeat_penalty)
+            response_schema: JSON schema the reply must follow (sent as format)
+            tools: OpenAI-style function definitions for /api/chat (see supports_tools)
             
         Returns:
-            Generated text
+            Generated text, or for a tool call the JSON object {"name": ..., "arguments": {...}}
             
         Raises:
-            requests.exceptions.RequestException: If API call fails
+            requests.exceptions.RequestException: If API call fails after retries
+            CircuitOpenError: If the backend's circuit breaker is open
         """
-        response = requests.post(
-            f"{self.base_url}/api/generate",
-            json={
-                "model": self.model,
-                "prompt": prompt,
-                "stream": stream,
-                "options": {
-                    "num_ctx": self.n_ctx,
-                    "temperature": temperature if temperature is not None else self.temperature
-                }
-            }
+        response, host, num_ctx, release = self._post(
+            self._endpoint(prompt),
+            self._build_payload(prompt, stream, temperature, max_tokens, stop, additional_params, response_schema, tools),
+            stream,
+            self._needed_context(prompt, max_tokens, additional_params),
+            estimate_tokens(prompt, max_tokens)
         )
-        response.raise_for_status()
-        return response.json()["response"]
+        try:
+            if stream:
+                text = self._handle_stream(response, on_token)
+            else:
+                text = self._parse_response(response.json())
+        except BaseException as e:
+            self.hosts.release(host, error=e)
+            raise
+        finally:
+            release()
+        self.hosts.release(host, self.model, num_ctx=num_ctx)
+        return text
+
+    def _handle_stream(self, response, on_token: Optional[Callable[[str], Optional[bool]]] = None) -> str:
+        """
+        Handle streaming (NDJSON) response from Ollama API
+        
+        Args:
+            response: Response object from requests
+            on_token: Called with each chunk; returning True stops reading and
+                closes the connection, which makes Ollama stop generating
+            
+        Returns:
+            Generated text (up to the abort point if on_token stopped it)
+        """
+        parts = []
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "error" in chunk:
+                    raise requests.exceptions.RequestException(f"Ollama stream error: {chunk['error']}")
+                content = self._chunk_text(chunk)
+                if content:
+                    parts.append(content)
+                    if on_token is not None and on_token(content):
+                        break
+                if chunk.get("done"):
+                    note_finish_reason(chunk.get("done_reason"))
+                    self._record_usage(chunk)
+                    self._record_load(chunk)
+                    break
+        finally:
+            response.close()
+        return "".join(parts)
+
+    @staticmethod
+    def _endpoint(prompt: Union[str, List[Dict[str, Any]]]) -> str:
+        return "/api/generate" if isinstance(prompt, str) else "/api/chat"
+
+    @staticmethod
+    def _chunk_text(data: Dict[str, Any]) -> str:
+        # /api/chat replies carry message.content (or message.tool_calls),
+        # /api/generate replies carry response
+        if "message" in data:
+            message = data["message"] or {}
+            if message.get("tool_calls"):
+                return tool_call_text(message["tool_calls"][0]["function"])
+            return message.get("content") or ""
+        return data.get("response") or ""
+
+    def _record_usage(self, data: Dict[str, Any]) -> None:
+        # Ollama reports only freshly evaluated prompt tokens; tokens reused
+        # from the KV cache are not counted, so a shrinking prompt_eval_count
+        # on a growing prompt is what prefix reuse looks like here
+        if "prompt_eval_count" not in data and "eval_count" not in data:
+            return
+        self.usage.record(
+            prompt_tokens=data.get("prompt_eval_count", 0),
+            completion_tokens=data.get("eval_count", 0)
+        )
+        note_usage(data.get("prompt_eval_count", 0), data.get("eval_count", 0))
+        if "prompt_eval_duration" in data:
+            # Non-streamed calls have no client-side first token; the server's load and prompt time stand in
+            note_server_ttft((data.get("load_duration", 0) + data["prompt_eval_duration"]) / 1e9)
+        logger.info(f"usage: prompt_eval_count={data.get('prompt_eval_count')} eval_count={data.get('eval_count')}")
+
+    def _record_load(self, data: Dict[str, Any]) -> None:
+        self._last_request = time.monotonic()
+        if "load_duration" in data:
+            if self.loads.record(data["load_duration"] / 1e9):
+                logger.info(f"Cold model load: {data['load_duration'] / 1e9:.2f}s")
+
+    def _parse_response(self, data: Dict[str, Any]) -> str:
+        self._record_usage(data)
+        self._record_load(data)
+        note_finish_reason(data.get("done_reason"))
+        return self._chunk_text(data)
+
+    def usage_stats(self) -> Dict[str, Any]:
+        """
+        Get token usage totals
+        
+        Returns:
+            Dictionary of evaluated prompt and completion token totals
+        """
+        return self.usage.snapshot()
+
+    def _build_payload(
+        self,
+        prompt: Union[str, List[Dict[str, Any]]],
+        stream: bool,
+        temperature: Optional[float],
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        additional_params: Optional[Dict[str, Any]] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        options = {
+            "num_ctx": self.n_ctx,
+            "temperature": temperature if temperature is not None else self.temperature
+        }
+        if additional_params:
+            options.update(additional_params)
+        if max_tokens:
+            options["num_predict"] = max_tokens
+        if stop:
+            options["stop"] = stop
+        payload = {
+            "model": self.model,
+            "stream": stream,
+            "options": options,
+            "keep_alive": self.model_keep_alive
+        }
+        if response_schema:
+            payload["format"] = response_schema
+        if tools and not isinstance(prompt, str):
+            payload["tools"] = tools
+        if isinstance(prompt, str):
+            payload["prompt"] = prompt
+        else:
+            payload["messages"] = prompt
+        return payload
     
     def list_models(self) -> list:
         """
@@ -92,13 +559,13 @@ class OllamaClient:
         Raises:
             requests.exceptions.RequestException: If API call fails
         """
-        response = requests.get(f"{self.base_url}/api/tags")
+        response = self.session.get(f"{self.hosts.healthy_url()}/api/tags", timeout=self.timeout)
         response.raise_for_status()
         return response.json()["models"]
     
     def pull_model(self, model_name: str) -> None:
         """
-        Pull a model from Ollama hub
+        Pull a model from Ollama hub onto every host
         
         Args:
             model_name: Name of the model to pull
@@ -106,8 +573,158 @@ class OllamaClient:
         Raises:
             requests.exceptions.RequestException: If API call fails
         """
-        response = requests.post(
-            f"{self.base_url}/api/pull",
-            json={"name": model_name}
-        )
-        response.raise_for_status() 
\ No newline at end of file
+        for url in self.base_urls:
+            response = self.session.post(
+                f"{url}/api/pull",
+                json={"name": model_name},
+                timeout=(self.timeout[0], None)
+            )
+            response.raise_for_status()
+
+class AsyncOllamaClient(OllamaClient):
+    """
+    asyncio variant of OllamaClient.
+
+    All coroutines running on one event loop share a single httpx connection
+    pool. Cancelling the awaiting task aborts the HTTP request, which also
+    stops the generation on the Ollama server.
+    """
+
+    def _open_transport(self) -> None:
+        # httpx.AsyncClient binds its connections to an event loop, so it is
+        # created on first use and recreated if the loop changes
+        self._http = None
+        self._http_loop = None
+        self._requests = 0
+        self._preload_session = None
+
+    def _sync_session(self) -> requests.Session:
+        if self._preload_session is None:
+            self._preload_session = create_session(pool_size=1)
+        return self._preload_session
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop:
+            if self._http is not None:
+                # The previous loop's pool would otherwise keep its connections open
+                discard_async_client(self._http, self._http_loop)
+            self._http = create_async_client(self.pool_size, self.keep_alive, self.timeout)
+            self._http_loop = loop
+        return self._http
+
+    async def warm_up(self) -> bool:
+        """
+        Health-check the Ollama servers, open a pooled connection to each and
+        preload the model (unless OLLAMA_PRELOAD is false)
+        
+        Returns:
+            True if every connection was established and the model loaded
+        """
+        await asyncio.to_thread(self.hosts.refresh)
+        results = [await async_warm_up(self._client(), url) for url in self.base_urls]
+        if self.preload_on_warm_up:
+            results.append(await asyncio.to_thread(self.preload) is not None)
+        return all(results)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Get connection pool statistics
+        
+        Returns:
+            Dictionary with request, open and idle connection counts
+        """
+        return async_pool_stats(self._http, self._requests)
+
+    async def generate(
+        self,
+        prompt: Union[str, List[Dict[str, Any]]],
+        temperature: Optional[float] = None,
+        timeout: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        additional_params: Optional[Dict[str, Any]] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """
+        Generate text using Ollama API
+        
+        Args:
+            prompt: Input prompt, or a list of chat messages
+            temperature: Override default temperature for this request
+            timeout: Overall deadline for this request in seconds
+            max_tokens: Maximum tokens to generate (num_predict), unlimited if None
+            stop: Stop sequences that end the generation
+            additional_params: Extra model options (e.g. top_p, repeat_penalty)
+            response_schema: JSON schema the reply must follow (sent as format)
+            tools: OpenAI-style function definitions for /api/chat (see supports_tools)
+            
+        Returns:
+            Generated text, or for a tool call the JSON object {"name": ..., "arguments": {...}}
+            
+        Raises:
+            httpx.HTTPError: If API call fails after retries
+            CircuitOpenError: If the backend's circuit breaker is open
+            asyncio.TimeoutError: If the deadline passes (retries included)
+        """
+        payload = self._build_payload(prompt, False, temperature, max_tokens, stop, additional_params, response_schema, tools)
+        needed_context = self._needed_context(prompt, max_tokens, additional_params)
+
+        tokens = estimate_tokens(prompt, max_tokens)
+
+        async def send() -> httpx.Response:
+            # Every attempt, retries included, takes its own rate budget and slot
+            async with self.rate_limiter.aacquire(tokens):
+                self._requests += 1
+                host = self.hosts.acquire(self.model)
+                body, num_ctx = self._size_context(payload, host, needed_context)
+                try:
+                    response = await self._client().post(f"{host.url}{self._endpoint(prompt)}", json=body)
+                    response.raise_for_status()
+                except BaseException as e:
+                    self.hosts.release(host, error=e)
+                    raise
+                self.hosts.release(host, self.model, num_ctx=num_ctx)
+                return response
+
+        response = await asyncio.wait_for(acall_with_retries(send, self.retry_policy, self.breaker), timeout)
+        return self._parse_response(response.json())
+
+    async def list_models(self) -> list:
+        """
+        List available models
+        
+        Returns:
+            List of available models
+            
+        Raises:
+            httpx.HTTPError: If API call fails
+        """
+        response = await self._client().get(f"{self.hosts.healthy_url()}/api/tags")
+        response.raise_for_status()
+        return response.json()["models"]
+
+    async def pull_model(self, model_name: str) -> None:
+        """
+        Pull a model from Ollama hub onto every host
+        
+        Args:
+            model_name: Name of the model to pull
+            
+        Raises:
+            httpx.HTTPError: If API call fails
+        """
+        for url in self.base_urls:
+            response = await self._client().post(
+                f"{url}/api/pull",
+                json={"name": model_name},
+                timeout=httpx.Timeout(None, connect=self.timeout[0])
+            )
+            response.raise_for_status()
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
@@ -0,0 +1,224 @@
+import time
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Set, Tuple
+import httpx
+import requests
+from .http_pool import create_session
+
+logger = logging.getLogger("ollama_pool")
+
+class OllamaHost:
+    """Health, model and load state of one Ollama server."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        # None until the first health check: the host is assumed to have any model
+        self.available: Optional[Set[str]] = None
+        self.loaded: Set[str] = set()
+        # num_ctx each loaded model was last loaded with
+        self.context: Dict[str, int] = {}
+        self.checked_at = 0.0
+
+    def has(self, model: str) -> bool:
+        return self.available is None or model in self.available or model in self.loaded
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "loaded": sorted(self.loaded),
+            "context": dict(self.context)
+        }
+
+def _model_names(data: Dict[str, Any]) -> Set[str]:
+    names = set()
+    for entry in data.get("models") or []:
+        for key in ("name", "model"):
+            if entry.get(key):
+                names.add(entry[key])
+    return names
+
+class OllamaHostPool:
+    """
+    Least-outstanding-requests balancing over several Ollama servers.
+
+    Requests go to a healthy host that already has the model loaded in
+    memory, else one that has it pulled, else any healthy host; ties are
+    broken by the fewest outstanding requests and then the fewest served.
+    Once every preferred host has max_outstanding requests running, the next
+    tier is considered too, so a busy warm host spills over to idle ones.
+    Health comes from /api/tags (and loaded models from /api/ps), checked in a
+    background thread every check_interval seconds once the pool is in use,
+    and from connection errors seen on real requests.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        timeout: Tuple[float, float] = (5, 10),
+        check_interval: float = 15.0,
+        max_outstanding: int = 4
+    ):
+        """
+        Args:
+            urls: Base URLs of the Ollama servers
+            timeout: (connect, read) timeout of the health checks
+            check_interval: Seconds between health checks
+            max_outstanding: Outstanding requests per host before affinity gives way to load
+        """
+        if not urls:
+            raise ValueError("At least one Ollama base URL is required")
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_outstanding = max_outstanding
+        self._lock = threading.Lock()
+        self._session = None
+        self._checker = None
+
+    def _check(self, host: OllamaHost) -> None:
+        try:
+            tags = self._session.get(f"{host.url}/api/tags", timeout=self.timeout)
+            tags.raise_for_status()
+            available = _model_names(tags.json())
+            loaded = set()
+            context = {}
+            ps = self._session.get(f"{host.url}/api/ps", timeout=self.timeout)
+            if ps.ok:
+                loaded = _model_names(ps.json())
+                # Newer Ollama versions report the context size of each loaded model
+                for entry in ps.json().get("models") or []:
+                    if entry.get("context_length"):
+                        context[entry.get("name") or entry.get("model")] = entry["context_length"]
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self._lock:
+                if host.healthy:
+                    logger.warning(f"Ollama host {host.url} failed its health check: {e}")
+                host.healthy = False
+                host.checked_at = time.monotonic()
+            return
+        with self._lock:
+            if not host.healthy:
+                logger.info(f"Ollama host {host.url} is healthy again")
+            host.healthy = True
+            host.available = available
+            host.loaded = loaded
+            host.context = {model: context.get(model, host.context.get(model)) for model in loaded
+                            if model in context or model in host.context}
+            host.checked_at = time.monotonic()
+
+    def refresh(self) -> None:
+        """Health-check every host now."""
+        if self._session is None:
+            self._session = create_session(pool_size=len(self.hosts))
+        threads = [threading.Thread(target=self._check, args=(host,), daemon=True) for host in self.hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_checks(self) -> None:
+        while True:
+            self.refresh()
+            time.sleep(self.check_interval)
+
+    def _ensure_checker(self) -> None:
+        # A single host needs no balancing, so it is never polled
+        if self._checker is None and len(self.hosts) > 1:
+            with self._lock:
+                if self._checker is None:
+                    self._checker = threading.Thread(target=self._run_checks, name="ollama-health", daemon=True)
+                    self._checker.start()
+
+    def acquire(self, model: Optional[str] = None) -> OllamaHost:
+        """
+        Pick a host for a request and count it as outstanding until release
+
+        Args:
+            model: Requested model, used for affinity
+
+        Returns:
+            The chosen host
+        """
+        self._ensure_checker()
+        with self._lock:
+            healthy = [h for h in self.hosts if h.healthy] or self.hosts
+            tiers = [healthy]
+            if model:
+                tiers = [
+                    [h for h in healthy if model in h.loaded],
+                    [h for h in healthy if h.has(model)],
+                    healthy
+                ]
+            candidates = []
+            for tier in tiers:
+                candidates = candidates + [h for h in tier if h not in candidates]
+                if candidates and min(h.outstanding for h in candidates) < self.max_outstanding:
+                    break
+            host = min(candidates, key=lambda h: (h.outstanding, h.requests))
+            host.outstanding += 1
+            host.requests += 1
+            return host
+
+    def release(
+        self,
+        host: OllamaHost,
+        model: Optional[str] = None,
+        error: Optional[BaseException] = None,
+        num_ctx: Optional[int] = None
+    ) -> None:
+        """
+        Finish a request on a host
+
+        Args:
+            host: Host returned by acquire
+            model: Model that was requested; a success marks it loaded there
+            error: Error of the request, if it failed
+            num_ctx: Context size the request loaded the model with
+        """
+        with self._lock:
+            host.outstanding -= 1
+            if error is None:
+                if model:
+                    host.loaded.add(model)
+                    if num_ctx:
+                        host.context[model] = num_ctx
+            else:
+                host.failures += 1
+                if isinstance(error, (requests.exceptions.ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)):
+                    # Unreachable: skip it until the next health check says otherwise
+                    host.healthy = False
+                    logger.warning(f"Ollama host {host.url} unreachable: {error}")
+
+    def loaded_context(self, host: OllamaHost, model: str) -> Optional[int]:
+        """num_ctx the model is loaded with on a host, if known."""
+        with self._lock:
+            return host.context.get(model) if model in host.loaded else None
+
+    def healthy_url(self) -> str:
+        """URL of the first healthy host (or the first host if none is known healthy)."""
+        with self._lock:
+            return next((h.url for h in self.hosts if h.healthy), self.hosts[0].url)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get per-host state
+
+        Returns:
+            Dictionary of host URL to health, outstanding requests and loaded models
+        """
+        with self._lock:
+            return {host.url: host.snapshot() for host in self.hosts}
+
+def parse_base_urls(value: Any) -> List[str]:
+    """Split a base URL setting (list or comma-separated string) into normalized URLs."""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [url.strip().rstrip("/") for url in value if url and url.strip()]
@@ -1,24 +1,25 @@
 import os
+import json
+import asyncio
+import httpx
 import requests
-from typing import Optional, Dict, Any
-from dotenv import load_dotenv
-from datetime import datetime
+from typing import Optional, Dict, Any, Callable, List, Union, Tuple
 import logging
+from .usage import UsageStats
+from .resilience import RetryPolicy, CircuitBreaker, call_with_retries, acall_with_retries
+from .rate_limit import get_rate_limiter, estimate_tokens
+from .structured_output import json_schema_format, tool_call_text
+from .telemetry import note_usage, note_finish_reason
+from .http_pool import (
+    create_session, warm_up, pool_stats,
+    create_async_client, async_warm_up, async_pool_stats, discard_async_client
+)
 
-# Configure logging
-log_directory = os.getenv("LOG_DIR", "logs")
-os.makedirs(log_directory, exist_ok=True)
-log_file = os.path.join(log_directory, f"openrouter_{datetime.now().strftime('%Y%m%d')}.log")
-
-# Set up logger
+# Handlers are attached by log_config.configure_logging
 logger = logging.getLogger("openrouter_logger")
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(log_file)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
 
-# Load environment variables
-load_dotenv()
+# (base_url, model) -> request parameters the model supports, looked up once per process
+_supported_parameters: Dict[tuple, set] = {}
 
 class OpenRouterClient:
     def __init__(
@@ -26,7 +27,12 @@ class OpenRouterClient:
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
         model: Optional[str] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        keep_alive: Optional[bool] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        prompt_caching: Optional[bool] = None
     ):
         """
         Initialize OpenRouter client
@@ -36,6 +42,11 @@ class OpenRouterClient:
             base_url: Base URL for OpenRouter API (defaults to OPENROUTER_BASE_URL env var or 'https://openrouter.ai/api/v1')
             model: Model name to use (defaults to OPENROUTER_MODEL env var or 'anthropic/claude-3-opus-20240229')
             max_tokens: Maximum number of tokens to generate (defaults to OPENROUTER_MAX_TOKENS env var or 4096)
+            pool_size: Maximum pooled connections (defaults to OPENROUTER_POOL_SIZE env var or 10)
+            keep_alive: Keep connections open between calls (defaults to OPENROUTER_KEEP_ALIVE env var or True)
+            connect_timeout: Connect timeout in seconds (defaults to OPENROUTER_CONNECT_TIMEOUT env var or 10)
+            read_timeout: Read timeout in seconds (defaults to OPENROUTER_READ_TIMEOUT env var or 300)
+            prompt_caching: Add cache_control breakpoints to chat messages (defaults to OPENROUTER_PROMPT_CACHING env var or True)
         """
         self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
@@ -44,89 +55,348 @@ class OpenRouterClient:
         self.base_url = base_url or os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
         self.model = model or os.getenv("OPENROUTER_MODEL", "anthropic/claude-3-opus-20240229")
         self.max_tokens = max_tokens or int(os.getenv("OPENROUTER_MAX_TOKENS", "4096"))
+        # Prompt plus output must fit in the model's context window
+        self.context_window = int(os.getenv("OPENROUTER_CONTEXT_WINDOW", "128000"))
+        self.pool_size = pool_size or int(os.getenv("OPENROUTER_POOL_SIZE", "10"))
+        if keep_alive is None:
+            keep_alive = os.getenv("OPENROUTER_KEEP_ALIVE", "true").lower() in ("1", "true", "yes")
+        self.keep_alive = keep_alive
+        self.timeout = (
+            connect_timeout or float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10")),
+            read_timeout or float(os.getenv("OPENROUTER_READ_TIMEOUT", "300"))
+        )
+        if prompt_caching is None:
+            prompt_caching = os.getenv("OPENROUTER_PROMPT_CACHING", "true").lower() in ("1", "true", "yes")
+        self.prompt_caching = prompt_caching
+        # "auto" asks the model list whether the model supports response_format / tools
+        self.structured_output = os.getenv("OPENROUTER_STRUCTURED_OUTPUT", "auto").lower()
+        self.tool_calling = os.getenv("OPENROUTER_TOOL_CALLING", "auto").lower()
+        self.usage = UsageStats()
+        # Retries (OPENROUTER_MAX_RETRIES, ...) and the breaker (OPENROUTER_BREAKER_*) are per client
+        self.retry_policy = RetryPolicy.from_env("OPENROUTER")
+        self.breaker = CircuitBreaker.from_env(f"openrouter:{self.model}", "OPENROUTER")
+        # Account-wide RPM/TPM/in-flight limits (OPENROUTER_RPM, ...) shared by all clients and processes
+        self.rate_limiter = get_rate_limiter("openrouter", "OPENROUTER")
+
+        self._open_transport()
 
         logger.info(f"base_url: {self.base_url}")
         logger.info(f"model: {self.model}")
-        logger.info(f"max_tokens: {self.max_tokens}")
+        logger.info(f"max_tokens: {self.max_tokens}, context_window: {self.context_window}")
+        logger.info(f"pool_size: {self.pool_size}, keep_alive: {self.keep_alive}, timeout: {self.timeout}")
+        logger.info(f"prompt_caching: {self.prompt_caching}")
+
+    def _open_transport(self) -> None:
+        # One pooled session shared by every call and thread using this client
+        self.session = create_session(pool_size=self.pool_size, keep_alive=self.keep_alive)
+        self.session.headers.update(self._headers())
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": os.getenv("OPENROUTER_REFERER", "http://localhost:3000"),
+            "X-Title": os.getenv("OPENROUTER_TITLE", "My LLM App")
+        }
+
+    def warm_up(self) -> bool:
+        """
+        Open a pooled connection to the API host ahead of the first request
+        
+        Returns:
+            True if the connection was established
+        """
+        return warm_up(self.session, self.base_url, self.timeout)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Get connection pool statistics
+        
+        Returns:
+            Dictionary with request, opened, reused and idle connection counts
+        """
+        return pool_stats(self.session)
+
+    def _supports(self, setting: str, parameters: set) -> bool:
+        # setting is "true"/"false", or "auto" to ask the model list
+        if setting != "auto":
+            return setting in ("1", "true", "yes")
+        key = (self.base_url, self.model)
+        if key not in _supported_parameters:
+            try:
+                # Plain request: the async client has no requests session to use
+                response = requests.get(f"{self.base_url}/models", headers=self._headers(), timeout=self.timeout)
+                response.raise_for_status()
+                model = next((m for m in response.json()["data"] if m.get("id") == self.model), {})
+                _supported_parameters[key] = set(model.get("supported_parameters") or [])
+                logger.info(f"supported_parameters of {self.model}: {sorted(_supported_parameters[key])}")
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                # Not retried for every call; the features stay off for this process
+                logger.warning(f"Could not look up supported parameters of {self.model}: {e}")
+                _supported_parameters[key] = set()
+        return bool(_supported_parameters[key] & parameters)
+
+    def supports_structured_output(self) -> bool:
+        """
+        Check whether the model accepts a JSON schema in response_format
+        
+        Returns:
+            True if requests may pass response_schema
+        """
+        return self._supports(self.structured_output, {"structured_outputs", "response_format"})
+
+    def supports_tools(self) -> bool:
+        """
+        Check whether the model accepts tool definitions and returns tool_calls
+        
+        Returns:
+            True if requests may pass tools
+        """
+        return self._supports(self.tool_calling, {"tools"})
+
+    def prompt_budget(self, max_tokens: Optional[int] = None) -> int:
+        """
+        Get how many prompt tokens fit in the context window next to the output
+        
+        Args:
+            max_tokens: Output tokens the request reserves (defaults to the client's max_tokens)
+            
+        Returns:
+            Prompt token budget
+        """
+        return self.context_window - (max_tokens or self.max_tokens)
+
+    def resilience_stats(self) -> Dict[str, Any]:
+        """
+        Get retry and circuit breaker statistics
+        
+        Returns:
+            Dictionary with the retry count and the breaker state
+        """
+        return {
+            "retries": self.retry_policy.retries,
+            "breaker": self.breaker.stats(),
+            "rate_limit": self.rate_limiter.stats() if self.rate_limiter.enabled else None
+        }
+
+    def _post(self, url: str, payload: Dict[str, Any], stream: bool, tokens: int) -> Tuple[requests.Response, Callable[[], None]]:
+        # Only the request up to the response headers is retried; once a
+        # stream has started, chunks may already have reached the caller.
+        # Every attempt takes its own rate budget and slot; the caller
+        # releases the returned slot when the response is consumed
+        def send() -> Tuple[requests.Response, Callable[[], None]]:
+            release = self.rate_limiter.claim(tokens)
+            try:
+                response = self.session.post(url, json=payload, stream=stream, timeout=self.timeout)
+                try:
+                    response.raise_for_status()
+                except requests.exceptions.HTTPError:
+                    response.close()
+                    raise
+            except BaseException:
+                release()
+                raise
+            return response, release
+        return call_with_retries(send, self.retry_policy, self.breaker)
 
     def generate(
         self,
-        prompt: str,
+        prompt: Union[str, List[Dict[str, Any]]],
         temperature: float = 0.2,
         stream: bool = False,
-        additional_params: Optional[Dict[str, Any]] = None
+        additional_params: Optional[Dict[str, Any]] = None,
+        on_token: Optional[Callable[[str], Optional[bool]]] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None
     ) -> str:
         """
         Generate text using OpenRouter API
         
         Args:
-            prompt: Input prompt
+            prompt: Input prompt, or a list of chat messages
             temperature: Sampling temperature (0.0 to 1.0)
             stream: Whether to stream the response
             additional_params: Additional parameters to pass to the API
+            on_token: Called with each streamed chunk; returning True aborts the generation
+            max_tokens: Override the client's max_tokens for this request
+            stop: Stop sequences that end the generation
+            response_schema: JSON schema the reply must follow (see supports_structured_output)
+            tools: OpenAI-style function definitions the model must call one of (see supports_tools)
             
         Returns:
-            Generated text
+            Generated text, or for a tool call the JSON object {"name": ..., "arguments": {...}}
             
         Raises:
-            requests.exceptions.RequestException: If API call fails
+            requests.exceptions.RequestException: If API call fails after retries
+            CircuitOpenError: If the backend's circuit breaker is open
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "HTTP-Referer": os.getenv("OPENROUTER_REFERER", "http://localhost:3000"),
-            "X-Title": os.getenv("OPENROUTER_TITLE", "My LLM App")
-        }
+        payload = self._build_payload(prompt, temperature, stream, additional_params, max_tokens, stop, response_schema, tools)
+
+        response, release = self._post(
+            f"{self.base_url}/chat/completions", payload, stream, estimate_tokens(prompt, payload["max_tokens"])
+        )
+        try:
+            if stream:
+                return self._handle_stream(response, on_token)
+            else:
+                return self._parse_response(response.json())
+        finally:
+            release()
 
+    def _build_payload(
+        self,
+        prompt: Union[str, List[Dict[str, Any]]],
+        temperature: float,
+        stream: bool,
+        additional_params: Optional[Dict[str, Any]],
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        if isinstance(prompt, str):
+            messages = [{"role": "user", "content": prompt}]
+        else:
+            messages = self._apply_cache_control(prompt) if self.prompt_caching else prompt
         payload = {
             "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": messages,
             "temperature": temperature,
-            "max_tokens": self.max_tokens,
+            "max_tokens": max_tokens or self.max_tokens,
             "stream": stream
         }
+        if stop:
+            payload["stop"] = stop
+        if response_schema:
+            payload["response_format"] = json_schema_format(response_schema)
+        if tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = "required"
+            payload["parallel_tool_calls"] = False
+        if response_schema or tools:
+            # Only route to providers that honour the schema / tools
+            payload["provider"] = {"require_parameters": True}
 
         if additional_params:
             payload.update(additional_params)
+        return payload
+
+    @staticmethod
+    def _apply_cache_control(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Mark prompt-cache breakpoints: the end of the static system prefix and
+        the last message before the final turn, so the next call (which only
+        appends messages) can reuse everything up to there.
+        """
+        breakpoints = set()
+        if messages and messages[0].get("role") == "system":
+            breakpoints.add(0)
+        if len(messages) >= 2:
+            breakpoints.add(len(messages) - 2)
+
+        marked = []
+        for i, message in enumerate(messages):
+            if i in breakpoints and isinstance(message.get("content"), str):
+                message = dict(message)
+                message["content"] = [{
+                    "type": "text",
+                    "text": message["content"],
+                    "cache_control": {"type": "ephemeral"}
+                }]
+            marked.append(message)
+        return marked
 
-        response = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=headers,
-            json=payload
+    def _record_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        self.usage.record(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            cached_prompt_tokens=details.get("cached_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0)
         )
-        response.raise_for_status()
+        note_usage(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), details.get("cached_tokens", 0))
+        logger.info(
+            f"usage: prompt_tokens={usage.get('prompt_tokens')} "
+            f"cached={details.get('cached_tokens', 0)} completion_tokens={usage.get('completion_tokens')}"
+        )
+
+    def _parse_response(self, data: Dict[str, Any]) -> str:
+        self._record_usage(data.get("usage"))
+        note_finish_reason(data["choices"][0].get("finish_reason"))
+        message = data["choices"][0]["message"]
+        if message.get("tool_calls"):
+            return tool_call_text(message["tool_calls"][0]["function"])
+        if message.get("content") is None:
+            # Refused or filtered replies carry neither content nor a tool call
+            logger.warning(f"Empty reply from {self.model} (finish_reason {data['choices'][0].get('finish_reason')})")
+            return ""
+        return message["content"]
+
+    def usage_stats(self) -> Dict[str, Any]:
+        """
+        Get token usage totals, including prompt tokens served from the provider's prefix cache
         
-        if stream:
-            return self._handle_stream(response)
-        else:
-            return response.json()["choices"][0]["message"]["content"]
+        Returns:
+            Dictionary of prompt, cached, fresh and completion token totals
+        """
+        return self.usage.snapshot()
 
-    def _handle_stream(self, response):
+    def _handle_stream(self, response, on_token: Optional[Callable[[str], Optional[bool]]] = None) -> str:
         """
         Handle streaming response from OpenRouter API
         
         Args:
             response: Response object from requests
+            on_token: Called with each chunk; returning True stops reading and
+                closes the connection, which cancels the generation upstream
             
         Returns:
-            Complete generated text
+            Generated text (up to the abort point if on_token stopped it)
         """
-        full_text = ""
-        for line in response.iter_lines():
-            if line:
+        parts = []
+        # Native tool calls stream as a name and argument fragments; only the first call is used
+        tool_call = {"name": "", "arguments": ""}
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
                 line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data = line[6:]  # Remove 'data: ' prefix
-                    if data == '[DONE]':
+                if not line.startswith('data: '):
+                    # SSE comments such as ": OPENROUTER PROCESSING" keep the connection alive
+                    continue
+                data = line[6:]  # Remove 'data: ' prefix
+                if data == '[DONE]':
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                # Usage arrives in a final chunk after finish_reason
+                self._record_usage(chunk.get('usage'))
+                choices = chunk.get('choices') or [{}]
+                note_finish_reason(choices[0].get('finish_reason'))
+                delta = choices[0].get('delta') or {}
+                for call in delta.get('tool_calls') or []:
+                    if call.get('index', 0) == 0:
+                        function = call.get('function') or {}
+                        tool_call["name"] += function.get('name') or ''
+                        tool_call["arguments"] += function.get('arguments') or ''
+                content = delta.get('content') or ''
+                if content:
+                    parts.append(content)
+                    if on_token is not None and on_token(content):
                         break
-                    try:
-                        chunk = requests.json.loads(data)
-                        if chunk['choices'][0]['finish_reason'] is not None:
-                            break
-                        content = chunk['choices'][0]['delta'].get('content', '')
-                        full_text += content
-                    except requests.json.JSONDecodeError:
-                        continue
-        return full_text
+        finally:
+            response.close()
+        if tool_call["name"]:
+            # Same text as a non-streamed tool call, passed on as one chunk
+            text = tool_call_text(tool_call)
+            if on_token is not None:
+                on_token(text)
+            return text
+        return ''.join(parts)
 
     def list_models(self) -> list:
         """
@@ -138,15 +408,120 @@ class OpenRouterClient:
         Raises:
             requests.exceptions.RequestException: If API call fails
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "HTTP-Referer": os.getenv("OPENROUTER_REFERER", "http://localhost:3000"),
-            "X-Title": os.getenv("OPENROUTER_TITLE", "My LLM App")
-        }
-        
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/models",
-            headers=headers
+            timeout=self.timeout
         )
         response.raise_for_status()
-        return response.json()["data"] 
\ No newline at end of file
+        return response.json()["data"]
+
+class AsyncOpenRouterClient(OpenRouterClient):
+    """
+    asyncio variant of OpenRouterClient.
+
+    All coroutines running on one event loop share a single httpx connection
+    pool, so many agent sessions or sub-calls can be in flight at once.
+    Cancelling the awaiting task aborts the HTTP request.
+    """
+
+    def _open_transport(self) -> None:
+        # httpx.AsyncClient binds its connections to an event loop, so it is
+        # created on first use and recreated if the loop changes
+        self._http = None
+        self._http_loop = None
+        self._requests = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop:
+            if self._http is not None:
+                # The previous loop's pool would otherwise keep its connections open
+                discard_async_client(self._http, self._http_loop)
+            self._http = create_async_client(self.pool_size, self.keep_alive, self.timeout, self._headers())
+            self._http_loop = loop
+        return self._http
+
+    async def warm_up(self) -> bool:
+        """
+        Open a pooled connection to the API host ahead of the first request
+        
+        Returns:
+            True if the connection was established
+        """
+        return await async_warm_up(self._client(), self.base_url)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Get connection pool statistics
+        
+        Returns:
+            Dictionary with request, open and idle connection counts
+        """
+        return async_pool_stats(self._http, self._requests)
+
+    async def generate(
+        self,
+        prompt: Union[str, List[Dict[str, Any]]],
+        temperature: float = 0.2,
+        additional_params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """
+        Generate text using OpenRouter API
+        
+        Args:
+            prompt: Input prompt, or a list of chat messages
+            temperature: Sampling temperature (0.0 to 1.0)
+            additional_params: Additional parameters to pass to the API
+            max_tokens: Override the client's max_tokens for this request
+            stop: Stop sequences that end the generation
+            response_schema: JSON schema the reply must follow (see supports_structured_output)
+            tools: OpenAI-style function definitions the model must call one of (see supports_tools)
+            timeout: Overall deadline for this request in seconds
+            
+        Returns:
+            Generated text, or for a tool call the JSON object {"name": ..., "arguments": {...}}
+            
+        Raises:
+            httpx.HTTPError: If API call fails after retries
+            CircuitOpenError: If the backend's circuit breaker is open
+            asyncio.TimeoutError: If the deadline passes (retries included)
+        """
+        payload = self._build_payload(prompt, temperature, False, additional_params, max_tokens, stop, response_schema, tools)
+
+        tokens = estimate_tokens(prompt, payload["max_tokens"])
+
+        async def send() -> httpx.Response:
+            # Every attempt, retries included, takes its own rate budget and slot
+            async with self.rate_limiter.aacquire(tokens):
+                self._requests += 1
+                response = await self._client().post(f"{self.base_url}/chat/completions", json=payload)
+                response.raise_for_status()
+                return response
+
+        response = await asyncio.wait_for(acall_with_retries(send, self.retry_policy, self.breaker), timeout)
+        return self._parse_response(response.json())
+
+    async def list_models(self) -> list:
+        """
+        List available models
+        
+        Returns:
+            List of available models
+            
+        Raises:
+            httpx.HTTPError: If API call fails
+        """
+        response = await self._client().get(f"{self.base_url}/models")
+        response.raise_for_status()
+        return response.json()["data"]
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
@@ -0,0 +1,262 @@
+import os
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterator
+
+logger = logging.getLogger("profiling")
+
+MODES = ("cprofile", "sample")
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """
+    Low-overhead sampling profiler of one thread.
+
+    A background thread records the target thread's stack every interval
+    seconds; the cost is independent of how many calls the target makes,
+    unlike cProfile. Stacks are kept in the folded format of flamegraph.pl
+    and speedscope ("outer;inner;leaf count").
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        Args:
+            thread_id: Ident of the thread to sample
+            interval: Seconds between samples
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        # Set while the profiler itself works on the target thread
+        self.paused = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = None if self.paused else sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def write_folded(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def write_top(self, path: str, limit: int = 50) -> None:
+        """Functions by share of samples on top of the stack (self) and anywhere in it (total)."""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            labels = stack.split(";")
+            own[labels[-1]] += count
+            for label in set(labels):
+                total[label] += count
+        samples = self.samples or 1
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{self.samples} samples every {self.interval * 1000:.1f} ms\n\n")
+            for title, counts in (("Self", own), ("Total", total)):
+                f.write(f"{title}:\n")
+                for label, count in counts.most_common(limit):
+                    f.write(f"{100 * count / samples:6.2f}%  {count:7d}  {label}\n")
+                f.write("\n")
+
+def _deep_size(value: Any, seen: Optional[set] = None) -> int:
+    # Approximate retained size of the shared dict: containers and their contents, each object once
+    seen = seen if seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(item, seen) for item in value)
+    return size
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    # The profiler's own snapshots and imports are not the agent's memory
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+class SessionProfiler:
+    """
+    Profiles one agent session and writes its reports to a directory.
+
+    The session runs under cProfile (mode 'cprofile': session.prof for
+    pstats/snakeviz and cprofile.txt) or the StackSampler (mode 'sample':
+    stacks.folded and sample.txt). With memory tracing on, a tracemalloc
+    snapshot is taken at every MainDecisionAgent iteration and memory.txt
+    records, per iteration, traced memory, the size of the shared dict and
+    the source lines that allocated most since the previous iteration.
+    """
+
+    def __init__(self, mode: str, report_dir: str, memory: bool = True, interval: float = 0.005):
+        """
+        Args:
+            mode: 'cprofile' or 'sample'
+            report_dir: Directory the reports are written to
+            memory: Take tracemalloc snapshots per iteration
+            interval: Sampling interval in seconds (mode 'sample')
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}: must be one of {MODES}")
+        self.mode = mode
+        self.report_dir = report_dir
+        self.memory = memory
+        self.interval = interval
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracemalloc = False
+        self._memory_report: List[str] = []
+        self._started = 0.0
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(int(os.getenv("AGENT_PROFILE_FRAMES", "1")))
+                self._started_tracemalloc = True
+            self._snapshot = _take_snapshot()
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), self.interval)
+            self._sampler.start()
+
+    def iteration(self, number: int, shared: Dict[str, Any]) -> None:
+        """Record memory at the start of a decision iteration."""
+        if not self.memory:
+            return
+        # Keep the snapshot's own cost out of the CPU profile
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.paused = True
+        try:
+            self._record_memory(number, shared)
+        finally:
+            if self._sampler is not None:
+                self._sampler.paused = False
+            if self._profile is not None:
+                self._profile.enable()
+
+    def _record_memory(self, number: int, shared: Dict[str, Any]) -> None:
+        snapshot = _take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"Iteration {number} at {time.perf_counter() - self._started:.2f}s: "
+            f"traced {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB), "
+            f"shared {_deep_size(shared) / 1024:.0f} KiB, history {len(shared.get('history', []))} entries"
+        ]
+        if self._snapshot is not None:
+            for stat in snapshot.compare_to(self._snapshot, "lineno")[:10]:
+                lines.append(f"    {stat}")
+        self._memory_report.extend(lines + [""])
+        self._snapshot = snapshot
+
+    def stop(self) -> None:
+        """Stop profiling and write the reports."""
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        try:
+            self._write_reports()
+        except OSError as e:
+            logger.warning(f"Failed to write profile to {self.report_dir}: {e}")
+            return
+        logger.info(f"Profile ({self.mode}) written to {self.report_dir}")
+
+    def _write_reports(self) -> None:
+        os.makedirs(self.report_dir, exist_ok=True)
+        if self._profile is not None:
+            self._profile.dump_stats(os.path.join(self.report_dir, "session.prof"))
+            with open(os.path.join(self.report_dir, "cprofile.txt"), "w", encoding="utf-8") as f:
+                stats = pstats.Stats(self._profile, stream=f)
+                stats.sort_stats("cumulative").print_stats(50)
+                stats.sort_stats("tottime").print_stats(50)
+        if self._sampler is not None:
+            self._sampler.write_folded(os.path.join(self.report_dir, "stacks.folded"))
+            self._sampler.write_top(os.path.join(self.report_dir, "sample.txt"))
+        if self.memory:
+            with open(os.path.join(self.report_dir, "memory.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(self._memory_report))
+
+# Profiler of the session running in this thread or task
+_current_profiler: contextvars.ContextVar[Optional[SessionProfiler]] = contextvars.ContextVar("profiler", default=None)
+
+def profile_iteration(number: int, shared: Dict[str, Any]) -> None:
+    """Called by MainDecisionAgent at each iteration; does nothing unless the session is profiled."""
+    profiler = _current_profiler.get()
+    if profiler is not None:
+        profiler.iteration(number, shared)
+
+@contextmanager
+def profile_session(mode: Optional[str] = None, name: Optional[str] = None) -> Iterator[Optional[SessionProfiler]]:
+    """
+    Profile an agent session
+
+    Reports go to AGENT_PROFILE_DIR (default LOG_DIR/profiles)/<session>.
+    AGENT_PROFILE_MEMORY=false skips the tracemalloc snapshots, which slow
+    allocation-heavy code down; AGENT_PROFILE_INTERVAL sets the sampling
+    interval in seconds (default 0.005).
+
+    Args:
+        mode: 'cprofile' or 'sample' (defaults to AGENT_PROFILE env var; unset or 'off' disables profiling)
+        name: Session name used for the report directory (defaults to a timestamp)
+
+    Yields:
+        The session's SessionProfiler, or None when profiling is off
+    """
+    mode = (mode or os.getenv("AGENT_PROFILE", "off")).lower()
+    if mode == "off" or _current_profiler.get() is not None:
+        # Nested sessions are covered by the outer profile
+        yield _current_profiler.get()
+        return
+    name = name or f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+    report_dir = os.path.join(os.getenv("AGENT_PROFILE_DIR") or os.path.join(os.getenv("LOG_DIR", "logs"), "profiles"), name)
+    profiler = SessionProfiler(
+        mode, report_dir,
+        memory=os.getenv("AGENT_PROFILE_MEMORY", "true").lower() in ("1", "true", "yes"),
+        interval=float(os.getenv("AGENT_PROFILE_INTERVAL", "0.005"))
+    )
+    token = _current_profiler.set(profiler)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        _current_profiler.reset(token)
+        profiler.stop()
@@ -0,0 +1,233 @@
+import os
+import gzip
+import queue
+import atexit
+import shutil
+import hashlib
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger("prompt_log")
+
+# Log every prompt in full, or a hash plus what changed since the node's previous prompt
+MODES = ("full", "delta", "off")
+
+# Shorter shared prefixes are not worth a reference
+DELTA_MIN_PREFIX = 256
+
+_STOP = object()
+
+def prompt_hash(text: str) -> str:
+    """Short content hash that identifies a prompt in the log."""
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()[:12]
+
+def prompt_text(prompt: Union[str, List[Dict[str, Any]]]) -> str:
+    """Flatten a prompt to text for logging and hashing."""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n\n".join(f"[{m.get('role')}]\n{m.get('content')}" for m in prompt)
+
+def _common_prefix_length(a: str, b: str) -> int:
+    # Binary search on slice comparisons, which run in C; a character loop
+    # over prompts of hundreds of kilobytes would stall the writer
+    if b.startswith(a):
+        return len(a)
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+class PromptLog:
+    """
+    Background writer of LLM prompts and responses.
+
+    Callers only put the prompt on a bounded queue; flattening, hashing and
+    file I/O happen on a writer thread, so a slow disk never delays an LLM
+    call. When the queue is full records are dropped and counted rather than
+    blocking. The file rotates by size, optionally gzip-compressing old
+    files. In delta mode each prompt is logged as its hash plus the text
+    after the prefix it shares with the node's previous prompt, so the
+    unchanged system prompt, tool catalog and history are written once per
+    node instead of on every iteration.
+
+    Nothing is written until start() is called (see log_config.configure_logging).
+    """
+
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        backups: Optional[int] = None,
+        compress: Optional[bool] = None,
+        queue_size: Optional[int] = None
+    ):
+        """
+        Args:
+            mode: 'full', 'delta' or 'off' (defaults to LLM_PROMPT_LOG env var or 'full')
+            max_bytes: File size that triggers rotation (defaults to LLM_PROMPT_LOG_MAX_BYTES env var or 50 MiB)
+            backups: Rotated files to keep (defaults to LLM_PROMPT_LOG_BACKUPS env var or 5)
+            compress: Gzip rotated files (defaults to LLM_PROMPT_LOG_COMPRESS env var or true)
+            queue_size: Records that may wait for the writer (defaults to LLM_PROMPT_LOG_QUEUE env var or 1000)
+        """
+        self.mode = (mode or os.getenv("LLM_PROMPT_LOG", "full")).lower()
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown prompt log mode {self.mode}: must be one of {MODES}")
+        self.max_bytes = max_bytes or int(os.getenv("LLM_PROMPT_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+        self.backups = backups if backups is not None else int(os.getenv("LLM_PROMPT_LOG_BACKUPS", "5"))
+        self.compress = compress if compress is not None else os.getenv("LLM_PROMPT_LOG_COMPRESS", "true").lower() in ("1", "true", "yes")
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size or int(os.getenv("LLM_PROMPT_LOG_QUEUE", "1000")))
+        self._lock = threading.Lock()
+        self._handler: Optional[RotatingFileHandler] = None
+        self._thread: Optional[threading.Thread] = None
+        # node -> (text, hash) of its last prompt, only touched by the writer thread
+        self._last: Dict[str, Tuple[str, str]] = {}
+        self.written = 0
+        self.dropped = 0
+        self.chars_saved = 0
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self, path: str) -> None:
+        """Open the log file and start the writer thread; later calls do nothing."""
+        with self._lock:
+            if self._thread is not None or self.mode == "off":
+                return
+            handler = RotatingFileHandler(path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+            if self.compress:
+                handler.namer = lambda name: name + ".gz"
+                handler.rotator = _gzip_rotator
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+            self._handler = handler
+            self._thread = threading.Thread(target=self._run, name="prompt-log", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def log_prompt(self, prompt: Union[str, List[Dict[str, Any]]], node: Optional[str] = None) -> None:
+        """Queue a prompt (text or chat messages) for writing."""
+        if self._thread is not None:
+            # The caller may reuse its message list; the messages themselves are not modified
+            self._put(("PROMPT", node, prompt if isinstance(prompt, str) else list(prompt), False))
+
+    def log_response(self, text: str, node: Optional[str] = None, aborted: bool = False) -> None:
+        """Queue a response for writing."""
+        if self._thread is not None:
+            self._put(("RESPONSE", node, text, aborted))
+
+    def _put(self, item: tuple) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued record is written
+
+        Returns:
+            False if the timeout expired first
+        """
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        """Write what is queued, stop the writer thread and close the file."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+        self._handler.close()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                self._handler.flush()
+                item.set()
+                continue
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.error(f"Failed to write prompt log record: {e}")
+
+    def _write(self, kind: str, node: Optional[str], payload: Any, aborted: bool) -> None:
+        label = f" [{node}]" if node else ""
+        if kind == "RESPONSE":
+            message = f"RESPONSE{label}{' (aborted early)' if aborted else ''}: {payload}"
+        else:
+            message = self._format_prompt(label, node or "", prompt_text(payload))
+        record = logging.LogRecord("prompt_log", logging.INFO, __file__, 0, message, None, None)
+        self._handler.handle(record)
+        with self._lock:
+            self.written += 1
+
+    def _format_prompt(self, label: str, node: str, text: str) -> str:
+        digest = prompt_hash(text)
+        if self.mode != "delta":
+            return f"PROMPT{label} #{digest}: {text}"
+        stream = self._handler.stream
+        if self.max_bytes and stream is not None and stream.tell() + len(text) >= self.max_bytes:
+            # This record starts a new file; keep every file readable on its own
+            self._last.clear()
+        previous = self._last.get(node)
+        self._last[node] = (text, digest)
+        if previous is not None:
+            if previous[1] == digest:
+                self.chars_saved += len(text)
+                return f"PROMPT{label} #{digest}: (same as previous)"
+            shared = _common_prefix_length(previous[0], text)
+            if shared >= DELTA_MIN_PREFIX:
+                self.chars_saved += shared
+                return f"PROMPT{label} #{digest} = #{previous[1]}[:{shared}] + {text[shared:]}"
+        return f"PROMPT{label} #{digest}: {text}"
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get writer statistics
+
+        Returns:
+            Dictionary with mode, records written, dropped and queued, and characters saved by delta mode
+        """
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "written": self.written,
+                "dropped": self.dropped,
+                "queued": self._queue.qsize(),
+                "chars_saved": self.chars_saved
+            }
+
+_prompt_log = None
+_prompt_log_lock = threading.Lock()
+
+def get_prompt_log() -> PromptLog:
+    """Return the process-wide prompt log, created (but not started) on first use."""
+    global _prompt_log
+    if _prompt_log is None:
+        with _prompt_log_lock:
+            if _prompt_log is None:
+                _prompt_log = PromptLog()
+    return _prompt_log
@@ -0,0 +1,296 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Dict, Any, List, Union, Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows: limits are enforced per process only
+    fcntl = None
+
+logger = logging.getLogger("llm_rate_limit")
+
+# Longest single sleep while polling for a free in-flight slot
+_SLOT_POLL = 0.05
+
+# Waits shorter than this are bookkeeping, not throttling
+_MIN_REPORTED_WAIT = 0.01
+
+def estimate_tokens(prompt: Union[str, List[Dict[str, Any]]], max_tokens: Optional[int] = None) -> int:
+    """
+    Rough token cost of a request for tokens/min accounting
+
+    Providers count the completion budget against the limit up front, so
+    max_tokens is included. Four characters per token is close enough for
+    rate limiting.
+    """
+    if isinstance(prompt, str):
+        chars = len(prompt)
+    else:
+        chars = sum(len(str(m.get("content", ""))) for m in prompt)
+    return chars // 4 + (max_tokens or 0)
+
+def _no_release() -> None:
+    pass
+
+class RateLimiter:
+    """
+    Client-side limiter for one provider account or host.
+
+    Combines two token buckets (requests/min and tokens/min) with a cap on
+    in-flight requests. With shared=True the buckets live in a state file and
+    every in-flight request holds one of max_in_flight slot files, all guarded
+    by flock, so every process on the host draws from the same budget. A
+    process that dies releases its slots with its file descriptors. A limit of
+    0 disables that dimension. Clients take it for every attempt, retries
+    included, so throttled retries are charged and no slot is held through
+    a retry's backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_in_flight: int = 0,
+        shared: bool = True,
+        state_dir: Optional[str] = None
+    ):
+        """
+        Args:
+            name: Limiter name, also used for the state file names
+            requests_per_minute: Request budget per minute
+            tokens_per_minute: Token budget per minute (see estimate_tokens)
+            max_in_flight: Maximum concurrent requests
+            shared: Coordinate with other processes through files in state_dir
+            state_dir: Directory of the state and slot files (defaults to <tmp>/llm-rate-limit)
+        """
+        self.name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        self.shared = shared and fcntl is not None
+        self.state_dir = state_dir or os.path.join(tempfile.gettempdir(), "llm-rate-limit")
+        self._lock = threading.Lock()
+        # Local bucket state, used when not shared
+        self._state = {"t": time.time(), "requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self._in_flight = 0
+        self.acquired = 0
+        self.waited = 0
+        self.wait_time = 0.0
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str) -> "RateLimiter":
+        """Build a limiter from <prefix>_RPM / _TPM / _MAX_IN_FLIGHT and LLM_RATE_LIMIT_SHARED / _DIR."""
+        return cls(
+            name,
+            requests_per_minute=float(os.getenv(f"{prefix}_RPM", "0")),
+            tokens_per_minute=float(os.getenv(f"{prefix}_TPM", "0")),
+            max_in_flight=int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", "0")),
+            shared=os.getenv("LLM_RATE_LIMIT_SHARED", "true").lower() in ("1", "true", "yes"),
+            state_dir=os.getenv("LLM_RATE_LIMIT_DIR")
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests_per_minute or self.tokens_per_minute or self.max_in_flight)
+
+    def _path(self, suffix: str) -> str:
+        os.makedirs(self.state_dir, exist_ok=True)
+        return os.path.join(self.state_dir, f"{self.name}.{suffix}")
+
+    def _refill(self, state: Dict[str, float], tokens: int) -> float:
+        # Refill both buckets, then take one request and the tokens if both
+        # have enough; otherwise return how long until they will
+        now = time.time()
+        elapsed = max(now - state["t"], 0.0)
+        state["t"] = now
+        wait = 0.0
+        for key, rate, cost in (("requests", self.requests_per_minute, 1), ("tokens", self.tokens_per_minute, tokens)):
+            if not rate:
+                continue
+            # A request larger than the whole bucket may start once it is full
+            cost = min(cost, rate)
+            state[key] = min(state[key] + elapsed * rate / 60.0, rate)
+            if state[key] < cost:
+                wait = max(wait, (cost - state[key]) * 60.0 / rate)
+        if wait == 0.0:
+            if self.requests_per_minute:
+                state["requests"] -= 1
+            if self.tokens_per_minute:
+                state["tokens"] -= min(tokens, self.tokens_per_minute)
+        return wait
+
+    def _take(self, tokens: int) -> float:
+        if not (self.requests_per_minute or self.tokens_per_minute):
+            return 0.0
+        with self._lock:
+            if not self.shared:
+                return self._refill(self._state, tokens)
+            with open(self._path("bucket"), "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    state = dict(self._state)
+                wait = self._refill(state, tokens)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return wait
+
+    def _claim_slot(self) -> Optional[Any]:
+        # Returns a slot handle (True or an open slot file), or None if all are busy
+        if not self.max_in_flight:
+            return True
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return None
+            if not self.shared:
+                self._in_flight += 1
+                return True
+            for i in range(self.max_in_flight):
+                f = open(self._path(f"slot{i}"), "a")
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    f.close()
+                    continue
+                self._in_flight += 1
+                return f
+            return None
+
+    def _release_slot(self, slot: Any) -> None:
+        if not self.max_in_flight:
+            return
+        with self._lock:
+            self._in_flight -= 1
+            if slot is not True:
+                fcntl.flock(slot, fcntl.LOCK_UN)
+                slot.close()
+
+    def _record(self, waited: float) -> None:
+        with self._lock:
+            self.acquired += 1
+            if waited > _MIN_REPORTED_WAIT:
+                self.waited += 1
+                self.wait_time += waited
+
+    def claim(self, tokens: int = 0) -> Callable[[], None]:
+        """
+        Block until a slot and the rate budget are available and hold the slot
+
+        Used where the slot must outlive the call that took it, e.g. a
+        streamed response read after the request returned.
+
+        Args:
+            tokens: Estimated token cost of the request
+
+        Returns:
+            Function that releases the slot
+        """
+        if not self.enabled:
+            return _no_release
+        start = time.monotonic()
+        slot = self._claim_slot()
+        while slot is None:
+            time.sleep(_SLOT_POLL)
+            slot = self._claim_slot()
+        try:
+            wait = self._take(tokens)
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._take(tokens)
+        except BaseException:
+            self._release_slot(slot)
+            raise
+        waited = time.monotonic() - start
+        if waited > _MIN_REPORTED_WAIT:
+            logger.info(f"Rate limiter {self.name} delayed request by {waited:.2f}s")
+        self._record(waited)
+        return lambda: self._release_slot(slot)
+
+    @contextmanager
+    def acquire(self, tokens: int = 0):
+        """
+        Block until a slot and the rate budget are available, hold the slot for the block
+
+        Args:
+            tokens: Estimated token cost of the request
+        """
+        release = self.claim(tokens)
+        try:
+            yield
+        finally:
+            release()
+
+    @asynccontextmanager
+    async def aacquire(self, tokens: int = 0):
+        """Async version of acquire; waits without blocking the event loop."""
+        if not self.enabled:
+            yield
+            return
+        start = time.monotonic()
+        slot = self._claim_slot()
+        while slot is None:
+            await asyncio.sleep(_SLOT_POLL)
+            slot = self._claim_slot()
+        try:
+            wait = self._take(tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._take(tokens)
+            self._record(time.monotonic() - start)
+            yield
+        finally:
+            self._release_slot(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get limiter statistics
+
+        Returns:
+            Dictionary with limits, current in-flight count and time spent waiting
+        """
+        with self._lock:
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self._in_flight,
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "wait_time": self.wait_time
+            }
+
+# One limiter per provider account / host, shared by every client using it
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(name: str, prefix: str) -> RateLimiter:
+    """
+    Get the process-wide limiter for a backend, creating it from the environment
+
+    Args:
+        name: Backend name, e.g. "openrouter" or "ollama-localhost_11434"
+        prefix: Environment variable prefix of its limits
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = RateLimiter.from_env(name, prefix)
+        return limiter
+
+def rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    """Return statistics of every enabled limiter."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters if limiter.enabled}
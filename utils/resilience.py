@@ -0,0 +1,300 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Callable, Tuple
+import httpx
+import requests
+from .telemetry import note_retry
+
+logger = logging.getLogger("llm_resilience")
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Status codes meaning the backend is past its capacity
+OVERLOAD_STATUSES = {429, 503, 529}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open."""
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header
+
+    Args:
+        value: Header value, either delay-seconds or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if absent or unparseable
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[float]]:
+    """
+    Decide whether a failed request is transient
+
+    Args:
+        error: Exception raised by requests or httpx
+
+    Returns:
+        Tuple of (retryable, Retry-After seconds or None)
+    """
+    response = None
+    if isinstance(error, (requests.exceptions.HTTPError, httpx.HTTPStatusError)):
+        response = error.response
+    elif isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                            httpx.TransportError)):
+        return True, None
+
+    if response is None:
+        return False, None
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    return response.status_code in RETRYABLE_STATUSES, retry_after
+
+def is_backend_failure(error: Exception) -> bool:
+    """True if the error means the backend is unavailable (worth failing over), not a bad request."""
+    return isinstance(error, CircuitOpenError) or classify_error(error)[0]
+
+def is_overload(error: BaseException) -> bool:
+    """True if the error means the backend is saturated: rate limited, overloaded or timing out."""
+    if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, (requests.exceptions.HTTPError, httpx.HTTPStatusError)) and error.response is not None:
+        return error.response.status_code in OVERLOAD_STATUSES
+    return False
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter that honours Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        max_retry_after: float = 60.0
+    ):
+        """
+        Args:
+            max_attempts: Total attempts including the first one
+            base_delay: Backoff base in seconds
+            max_delay: Cap of the jittered backoff in seconds
+            max_retry_after: Give up instead of waiting longer than this for Retry-After
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "RetryPolicy":
+        """Build a policy from <prefix>_MAX_RETRIES / _RETRY_BASE_DELAY / _RETRY_MAX_DELAY env vars."""
+        return cls(
+            max_attempts=int(os.getenv(f"{prefix}_MAX_RETRIES", "2")) + 1,
+            base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv(f"{prefix}_RETRY_MAX_DELAY", "20"))
+        )
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Delay before the next attempt
+
+        Args:
+            attempt: Number of the attempt that just failed (1-based)
+            retry_after: Server-requested delay, if any
+
+        Returns:
+            Seconds to sleep, or None to stop retrying
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            # Spread clients that were told the same Retry-After
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+class CircuitBreaker:
+    """
+    Per-backend circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast for recovery_timeout seconds; then a single probe call is let
+    through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        Args:
+            name: Backend name for logs
+            failure_threshold: Consecutive failures that open the circuit
+            recovery_timeout: Seconds to stay open before probing
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.trips = 0
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str) -> "CircuitBreaker":
+        """Build a breaker from <prefix>_BREAKER_THRESHOLD / _BREAKER_RECOVERY env vars."""
+        return cls(
+            name,
+            failure_threshold=int(os.getenv(f"{prefix}_BREAKER_THRESHOLD", "5")),
+            recovery_timeout=float(os.getenv(f"{prefix}_BREAKER_RECOVERY", "30"))
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.recovery_timeout:
+            return "half_open"
+        return "open"
+
+    def is_available(self) -> bool:
+        """True unless the circuit is open (a half-open circuit accepts a probe)."""
+        with self._lock:
+            state = self._state()
+            return state == "closed" or (state == "half_open" and not self._probing)
+
+    def before_call(self) -> None:
+        """
+        Reserve a call
+
+        Raises:
+            CircuitOpenError: If the circuit is open or a probe is already running
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.trips += 1
+                logger.warning(f"Circuit for {self.name} opened after {self._failures} failures")
+            self._probing = False
+
+    def release(self) -> None:
+        """Give back a reserved probe without a verdict (the call was cancelled)."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state(), "consecutive_failures": self._failures, "trips": self.trips}
+
+def call_with_retries(send: Callable[[], Any], policy: RetryPolicy, breaker: Optional[CircuitBreaker] = None) -> Any:
+    """
+    Run a request with retries and circuit breaking
+
+    Args:
+        send: Performs one attempt; must raise (e.g. via raise_for_status) on failure
+        policy: Retry policy
+        breaker: Circuit breaker of the backend
+
+    Returns:
+        Whatever send returns
+
+    Raises:
+        CircuitOpenError: If the breaker is open
+        Exception: The last error once retries are exhausted or the error is not transient
+    """
+    if breaker is not None:
+        breaker.before_call()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = send()
+        except Exception as e:
+            retryable, retry_after = classify_error(e)
+            delay = policy.backoff(attempt, retry_after) if retryable else None
+            if delay is None:
+                # Client errors (4xx other than 429) say nothing about backend health
+                if breaker is not None:
+                    breaker.record_failure() if retryable else breaker.record_success()
+                raise
+            policy.record_retry()
+            note_retry()
+            logger.warning(f"Attempt {attempt} failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+async def acall_with_retries(send: Callable[[], Any], policy: RetryPolicy, breaker: Optional[CircuitBreaker] = None) -> Any:
+    """Async version of call_with_retries; send returns an awaitable."""
+    if breaker is not None:
+        breaker.before_call()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = await send()
+        except asyncio.CancelledError:
+            if breaker is not None:
+                # A cancelled probe must not leave the breaker stuck half-open
+                breaker.release()
+            raise
+        except Exception as e:
+            retryable, retry_after = classify_error(e)
+            delay = policy.backoff(attempt, retry_after) if retryable else None
+            if delay is None:
+                if breaker is not None:
+                    breaker.record_failure() if retryable else breaker.record_success()
+                raise
+            policy.record_retry()
+            note_retry()
+            logger.warning(f"Attempt {attempt} failed ({e}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
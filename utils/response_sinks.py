@@ -0,0 +1,51 @@
+import sys
+import json
+from typing import Callable, TextIO
+
+# A response sink is any callable that receives streamed text chunks
+ResponseSink = Callable[[str], None]
+
+def stdout_sink(chunk: str) -> None:
+    """Write a chunk to stdout immediately."""
+    sys.stdout.write(chunk)
+    sys.stdout.flush()
+
+class SSESink:
+    """
+    Response sink that writes chunks as Server-Sent Events.
+
+    Each chunk becomes a `data:` event (JSON-encoded so newlines survive),
+    and close() sends a final `done` event.
+    """
+
+    def __init__(self, stream: TextIO, event: str = "token"):
+        """
+        Args:
+            stream: Writable text stream of the HTTP response
+            event: Event name for token chunks
+        """
+        self.stream = stream
+        self.event = event
+
+    def __call__(self, chunk: str) -> None:
+        self.stream.write(f"event: {self.event}\ndata: {json.dumps(chunk)}\n\n")
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.stream.write("event: done\ndata: {}\n\n")
+        self.stream.flush()
+
+if __name__ == "__main__":
+    import io
+
+    # Stream a few chunks to stdout
+    for chunk in ["Hello", ", ", "world", "!\n"]:
+        stdout_sink(chunk)
+
+    # Stream the same chunks as SSE events
+    buffer = io.StringIO()
+    sse = SSESink(buffer)
+    for chunk in ["Hello", ", ", "world", "!\n"]:
+        sse(chunk)
+    sse.close()
+    print(buffer.getvalue())
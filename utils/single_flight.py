@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Awaitable, Dict, Tuple
+
+logger = logging.getLogger("llm_single_flight")
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key.
+
+    The first caller of a key (the leader) runs the function; callers that
+    arrive while it is in flight (followers) wait for and share its result or
+    exception instead of running their own. Nothing is kept once the leader
+    finishes, so this is not a cache. Thread callers and coroutines are
+    tracked separately; coroutines only coalesce within one event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._async_calls: Dict[Tuple[int, str], asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn unless an identical call is in flight
+
+        Args:
+            key: Identity of the call
+            fn: Function to run as leader
+
+        Returns:
+            Tuple of (result, shared) where shared is True for followers
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Async version of do; fn returns an awaitable
+
+        If the leader is cancelled its followers are not: the next one
+        becomes the leader and runs its own fn.
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        while True:
+            with self._lock:
+                future = self._async_calls.get(loop_key)
+                leader = future is None
+                if leader:
+                    future = self._async_calls[loop_key] = asyncio.get_running_loop().create_future()
+                    self.leaders += 1
+                else:
+                    self.coalesced += 1
+            if not leader:
+                try:
+                    return await asyncio.shield(future), True
+                except asyncio.CancelledError:
+                    if future.cancelled():
+                        with self._lock:
+                            self.coalesced -= 1
+                        continue
+                    raise
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                # Retrieve it so an unawaited follower-less future does not warn
+                future.exception()
+                raise
+            else:
+                future.set_result(result)
+                return result, False
+            finally:
+                with self._lock:
+                    del self._async_calls[loop_key]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get coalescing statistics
+
+        Returns:
+            Dictionary with leader and coalesced follower counts and in-flight keys
+        """
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_ratio": self.coalesced / total if total else 0.0,
+                "in_flight": len(self._calls) + len(self._async_calls)
+            }
@@ -0,0 +1,93 @@
+import yaml
+from typing import Optional, Dict, Any, Iterable
+from .yaml_repair import load_yaml_reply
+
+class ToolDecisionStreamParser:
+    """
+    Incremental parser for a streamed tool decision.
+
+    Feed it streamed chunks; as soon as the fenced YAML block holding
+    tool/reason/params has been closed and parses to a decision, feed()
+    returns True so the caller can abort the rest of the generation
+    (usually trailing prose the agent never reads). Call close() when the
+    stream ends: a stop sequence on the closing fence cuts the fence
+    itself, leaving the block open, while a block left open by max_tokens
+    is truncated and must not be used. Malformed blocks are repaired
+    locally (see yaml_repair) before they are given up on.
+    """
+
+    FENCES = ("```yaml", "```yml", "```")
+    TOP_KEYS = ("tool", "reason", "params")
+
+    def __init__(self, keys: Optional[Iterable[str]] = None):
+        """
+        Args:
+            keys: Keys a decision may contain, used to repair malformed YAML
+        """
+        self.keys = list(keys) if keys is not None else None
+        self.buffer = ""
+        self.decision: Optional[Dict[str, Any]] = None
+        self._scan_from = 0
+        self._block_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Add a streamed chunk
+
+        Args:
+            chunk: Next piece of generated text
+
+        Returns:
+            True once a complete decision has been parsed
+        """
+        if self.decision is not None:
+            return True
+        self.buffer += chunk
+
+        # Only whole lines can open or close a fence
+        while True:
+            newline = self.buffer.find("\n", self._scan_from)
+            if newline == -1:
+                return False
+            line = self.buffer[self._scan_from:newline]
+            line_start = self._scan_from
+            self._scan_from = newline + 1
+
+            # Fences inside block scalars are indented, real fences are not
+            stripped = line.rstrip()
+            if self._block_start is None:
+                if stripped in self.FENCES:
+                    self._block_start = self._scan_from
+            elif stripped == "```":
+                if self._try_parse(self.buffer[self._block_start:line_start]):
+                    return True
+                # Not a decision, keep looking for the next block
+                self._block_start = None
+
+    def close(self, stopped: bool) -> bool:
+        """
+        End the stream
+
+        Args:
+            stopped: The backend ended the generation itself (finish reason "stop":
+                end of reply or the stop sequence), so a block still open is complete
+
+        Returns:
+            True if a decision has been parsed
+        """
+        # The last line has no newline after it
+        if self.feed("\n"):
+            return True
+        if self._block_start is None or not stopped:
+            return False
+        return self._try_parse(self.buffer[self._block_start:])
+
+    def _try_parse(self, block: str) -> bool:
+        try:
+            decision = load_yaml_reply(block, self.keys, self.TOP_KEYS)
+        except yaml.YAMLError:
+            return False
+        if isinstance(decision, dict) and "tool" in decision:
+            self.decision = decision
+            return True
+        return False
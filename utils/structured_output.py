@@ -0,0 +1,91 @@
+import re
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library parser is slower but equivalent
+    orjson = None
+
+logger = logging.getLogger("structured_output")
+
+# A reply wrapped in a markdown fence despite the JSON mode (the closing
+# fence may have been eaten by a stop sequence)
+_FENCE = re.compile(r"^```[a-zA-Z]*\s*\n(.*?)(?:\n?```)?\s*$", re.DOTALL)
+
+def loads(text: str) -> Any:
+    """Parse JSON text with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def parse_json_object(text: str) -> Dict[str, Any]:
+    """
+    Parse a structured-output reply into a dictionary
+
+    Args:
+        text: Model reply, a JSON object optionally wrapped in a ``` fence
+
+    Returns:
+        The parsed object
+
+    Raises:
+        ValueError: If the reply is not a JSON object
+    """
+    text = text.strip()
+    fenced = _FENCE.match(text)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        value = loads(text)
+    except ValueError as e:  # orjson.JSONDecodeError and json.JSONDecodeError are ValueErrors
+        raise ValueError(f"Invalid JSON in LLM response: {e}")
+    if not isinstance(value, dict):
+        raise ValueError("LLM response must be a JSON object")
+    return value
+
+def json_schema_format(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """OpenAI-style response_format for a JSON schema; the schema's title names it."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema.get("title", "response"),
+            "strict": True,
+            "schema": {k: v for k, v in schema.items() if k != "title"}
+        }
+    }
+
+def tool_call_text(function: Dict[str, Any]) -> str:
+    """
+    Encode a native tool call as the text generate() returns for it
+
+    Args:
+        function: The call's function object; arguments may be a JSON string (OpenAI) or an object (Ollama)
+
+    Returns:
+        JSON object text {"name": ..., "arguments": {...}}
+    """
+    arguments = function.get("arguments") or {}
+    if isinstance(arguments, str):
+        try:
+            arguments = loads(arguments) if arguments.strip() else {}
+        except ValueError:
+            # Kept as a string, which parse_tool_call rejects
+            pass
+    return json.dumps({"name": function.get("name"), "arguments": arguments})
+
+def parse_tool_call(text: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Decode the text of a native tool call
+
+    Returns:
+        Tuple of (tool name, arguments), or None if text is not a tool call
+    """
+    try:
+        value = parse_json_object(text)
+    except ValueError:
+        return None
+    if set(value) != {"name", "arguments"} or not isinstance(value["arguments"], dict):
+        return None
+    return value["name"], value["arguments"]
@@ -0,0 +1,322 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+from .tracing import span
+
+logger = logging.getLogger("llm_telemetry")
+
+# Upper bounds of the histogram buckets (Prometheus "le"); +Inf is implicit
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations, Prometheus style."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile (0-1) by interpolating within its bucket, like histogram_quantile()."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    # Beyond the last bound all we know is the bound itself
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class CallRecord:
+    """What one call_llm/acall_llm call did; filled in while it runs."""
+
+    def __init__(self, node: Optional[str]):
+        self.node = node or "unknown"
+        self.model = "unknown"
+        self.start = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        # Why the backend ended the generation: "stop" (end of reply or stop sequence), "length" (max_tokens), ...
+        self.finish_reason: Optional[str] = None
+        # ok, error, cache_hit or coalesced
+        self.outcome = "ok"
+
+    def first_token(self) -> None:
+        """Mark the arrival of the first streamed chunk."""
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.start
+
+# Call in progress in this thread or task; clients report usage and retries to it
+_current_call: contextvars.ContextVar[Optional[CallRecord]] = contextvars.ContextVar("llm_call", default=None)
+# Last finished call in this thread or task, for callers that need more than its text
+_last_call: contextvars.ContextVar[Optional[CallRecord]] = contextvars.ContextVar("last_llm_call", default=None)
+
+def note_usage(prompt_tokens: int = 0, completion_tokens: int = 0, cached_prompt_tokens: int = 0) -> None:
+    """Add provider-reported token usage to the current call, if any."""
+    call = _current_call.get()
+    if call is not None:
+        call.prompt_tokens += prompt_tokens or 0
+        call.completion_tokens += completion_tokens or 0
+        call.cached_prompt_tokens += cached_prompt_tokens or 0
+
+def note_retry() -> None:
+    """Count a retried attempt of the current call, if any."""
+    call = _current_call.get()
+    if call is not None:
+        call.retries += 1
+
+def note_server_ttft(seconds: float) -> None:
+    """Time to first token as reported by the server, for calls that were not streamed."""
+    call = _current_call.get()
+    if call is not None and call.ttft is None:
+        call.ttft = seconds
+
+def note_finish_reason(reason: Optional[str]) -> None:
+    """Record why the backend ended the current call's generation, if any."""
+    call = _current_call.get()
+    if call is not None and reason:
+        call.finish_reason = reason
+
+def last_finish_reason() -> Optional[str]:
+    """Finish reason of the last call made in this thread or task (None for cache hits and aborted streams)."""
+    call = _last_call.get()
+    return call.finish_reason if call is not None else None
+
+class Telemetry:
+    """
+    Per-node, per-model metrics of LLM calls.
+
+    Latency and time to first token are histograms, tokens, cache hits,
+    retries and requests are counters. Agent iterations are counted as well
+    so tokens per iteration can be derived. The metrics are exported in the
+    Prometheus text format by render(), which backs both the HTTP endpoint
+    and the textfile export (see start_metrics_export).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (node, model) -> series
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self._ttft: Dict[Tuple[str, str], Histogram] = {}
+        self._call_tokens: Dict[Tuple[str, str], Histogram] = {}
+        self._counters: Dict[str, Dict[Tuple[str, ...], float]] = {
+            "requests": {}, "prompt_tokens": {}, "cached_prompt_tokens": {},
+            "completion_tokens": {}, "retries": {}
+        }
+        self.iterations = 0
+
+    def record(self, call: CallRecord) -> None:
+        """Add a finished call."""
+        latency = time.monotonic() - call.start
+        key = (call.node, call.model)
+        with self._lock:
+            counters = self._counters
+            counters["requests"][key + (call.outcome,)] = counters["requests"].get(key + (call.outcome,), 0) + 1
+            counters["prompt_tokens"][key] = counters["prompt_tokens"].get(key, 0) + call.prompt_tokens
+            counters["cached_prompt_tokens"][key] = counters["cached_prompt_tokens"].get(key, 0) + call.cached_prompt_tokens
+            counters["completion_tokens"][key] = counters["completion_tokens"].get(key, 0) + call.completion_tokens
+            counters["retries"][key] = counters["retries"].get(key, 0) + call.retries
+            if call.outcome in ("ok", "error"):
+                # Cache hits and coalesced calls would drag the backend percentiles down
+                self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(latency)
+                if call.ttft is not None:
+                    self._ttft.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(call.ttft)
+                if call.prompt_tokens or call.completion_tokens:
+                    self._call_tokens.setdefault(key, Histogram(TOKEN_BUCKETS)).observe(call.prompt_tokens + call.completion_tokens)
+        logger.debug(
+            f"{call.node} {call.model} {call.outcome}: {latency:.3f}s"
+            f" ttft={f'{call.ttft:.3f}s' if call.ttft is not None else 'n/a'}"
+            f" tokens={call.prompt_tokens}/{call.completion_tokens} retries={call.retries}"
+        )
+
+    def record_iteration(self) -> None:
+        """Count one decision iteration of the agent."""
+        with self._lock:
+            self.iterations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the metrics
+
+        Returns:
+            Dictionary of "node model" to requests, latency/TTFT p50/p99, token and retry totals, plus
+            iterations and tokens per iteration
+        """
+        with self._lock:
+            series: Dict[str, Dict[str, Any]] = {}
+            for (node, model, outcome), count in self._counters["requests"].items():
+                entry = series.setdefault(f"{node} {model}", {"requests": {}})
+                entry["requests"][outcome] = int(count)
+            for key in {k[:2] for k in self._counters["requests"]}:
+                entry = series[f"{key[0]} {key[1]}"]
+                for name in ("prompt_tokens", "cached_prompt_tokens", "completion_tokens", "retries"):
+                    entry[name] = int(self._counters[name].get(key, 0))
+                for name, histograms in (("latency", self._latency), ("ttft", self._ttft)):
+                    histogram = histograms.get(key)
+                    if histogram is not None:
+                        entry[f"{name}_p50"] = histogram.quantile(0.5)
+                        entry[f"{name}_p99"] = histogram.quantile(0.99)
+            tokens = sum(self._counters["prompt_tokens"].values()) + sum(self._counters["completion_tokens"].values())
+            return {
+                "calls": series,
+                "iterations": self.iterations,
+                "tokens_per_iteration": tokens / self.iterations if self.iterations else None
+            }
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+
+        def labels(node: str, model: str, **extra: str) -> str:
+            pairs = {"node": node, "model": model, **extra}
+            return ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items())
+
+        def histogram(name: str, help_text: str, histograms: Dict[Tuple[str, str], Histogram]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (node, model), h in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{name}_bucket{{{labels(node, model, le=le)}}} {cumulative}")
+                lines.append(f"{name}_sum{{{labels(node, model)}}} {h.sum:g}")
+                lines.append(f"{name}_count{{{labels(node, model)}}} {h.count}")
+
+        def counter(name: str, help_text: str, values: Dict[Tuple[str, ...], float]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(values.items()):
+                extra = {"outcome": key[2]} if len(key) > 2 else {}
+                lines.append(f"{name}{{{labels(key[0], key[1], **extra)}}} {value:g}")
+
+        with self._lock:
+            histogram("llm_request_duration_seconds", "LLM call latency.", self._latency)
+            histogram("llm_time_to_first_token_seconds", "Time to the first generated token.", self._ttft)
+            histogram("llm_request_tokens", "Prompt plus completion tokens per LLM call.", self._call_tokens)
+            counter("llm_requests_total", "LLM calls by outcome (ok, error, cache_hit, coalesced).", self._counters["requests"])
+            counter("llm_prompt_tokens_total", "Prompt tokens reported by the provider.", self._counters["prompt_tokens"])
+            counter("llm_cached_prompt_tokens_total", "Prompt tokens served from the provider's prefix cache.", self._counters["cached_prompt_tokens"])
+            counter("llm_completion_tokens_total", "Completion tokens reported by the provider.", self._counters["completion_tokens"])
+            counter("llm_retries_total", "Retried attempts of LLM requests.", self._counters["retries"])
+            lines.append("# HELP agent_iterations_total Decision iterations of the agent.")
+            lines.append("# TYPE agent_iterations_total counter")
+            lines.append(f"agent_iterations_total {self.iterations}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Write render() to path atomically, for node_exporter's textfile collector."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+telemetry = Telemetry()
+
+@contextmanager
+def track_call(node: Optional[str]) -> Iterator[CallRecord]:
+    """
+    Measure one LLM call
+
+    Usage, retries and server-reported TTFT noted by the clients while the
+    block runs are attributed to the yielded record; the caller sets its
+    model and outcome. An exception marks the call as an error. When the
+    session is traced, the call is also an "llm" span.
+    """
+    call = CallRecord(node)
+    token = _current_call.set(call)
+    with span("llm", cat="llm", node=call.node) as current:
+        try:
+            yield call
+        except BaseException:
+            call.outcome = "error"
+            raise
+        finally:
+            _current_call.reset(token)
+            _last_call.set(call)
+            telemetry.record(call)
+            if current is not None:
+                current["args"].update(
+                    model=call.model, outcome=call.outcome, ttft=call.ttft, retries=call.retries,
+                    prompt_tokens=call.prompt_tokens, completion_tokens=call.completion_tokens
+                )
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = telemetry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+_export_lock = threading.Lock()
+_server: Optional[ThreadingHTTPServer] = None
+_textfile_thread: Optional[threading.Thread] = None
+
+def start_metrics_export() -> None:
+    """
+    Start the exports configured in the environment; later calls do nothing
+
+    LLM_METRICS_PORT serves /metrics on LLM_METRICS_HOST (default 127.0.0.1).
+    LLM_METRICS_TEXTFILE is rewritten every LLM_METRICS_INTERVAL seconds
+    (default 15); write_metrics_textfile() also writes it on demand.
+    """
+    global _server, _textfile_thread
+    with _export_lock:
+        port = os.getenv("LLM_METRICS_PORT")
+        if port and _server is None:
+            _server = ThreadingHTTPServer((os.getenv("LLM_METRICS_HOST", "127.0.0.1"), int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="llm-metrics", daemon=True).start()
+            logger.info(f"Serving LLM metrics on http://{_server.server_address[0]}:{_server.server_address[1]}/metrics")
+        path = os.getenv("LLM_METRICS_TEXTFILE")
+        if path and _textfile_thread is None:
+            interval = float(os.getenv("LLM_METRICS_INTERVAL", "15"))
+
+            def export():
+                while True:
+                    time.sleep(interval)
+                    write_metrics_textfile()
+
+            _textfile_thread = threading.Thread(target=export, name="llm-metrics-textfile", daemon=True)
+            _textfile_thread.start()
+
+def write_metrics_textfile() -> None:
+    """Write the metrics to LLM_METRICS_TEXTFILE, if set."""
+    path = os.getenv("LLM_METRICS_TEXTFILE")
+    if not path:
+        return
+    try:
+        telemetry.write_textfile(path)
+    except OSError as e:
+        logger.warning(f"Failed to write metrics textfile {path}: {e}")
@@ -0,0 +1,266 @@
+import os
+import re
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Union
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to the approximate counter
+    tiktoken = None
+
+logger = logging.getLogger("token_budget")
+
+# Words cost about one token per four characters, every other symbol one token
+_PIECE = re.compile(r"\w+|[^\w\s]")
+
+# Per-message framing overhead of chat formats
+MESSAGE_OVERHEAD = 4
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken when it is installed, otherwise with a fast
+    approximation that errs slightly high for code.
+    """
+
+    def __init__(self, encoding: Optional[str] = None):
+        """
+        Args:
+            encoding: tiktoken encoding name (defaults to TOKENIZER_ENCODING env var or 'cl100k_base')
+        """
+        self.encoding_name = encoding or os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+        self._encoding = None
+        if tiktoken is not None and os.getenv("TOKENIZER_APPROXIMATE", "false").lower() not in ("1", "true", "yes"):
+            try:
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:  # Unknown encoding or no cached vocabulary offline
+                logger.warning(f"tiktoken unavailable ({e}), using approximate token counts")
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text."""
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return sum((len(piece) + 3) // 4 for piece in _PIECE.findall(text))
+
+    def count_prompt(self, prompt: Union[str, List[Dict[str, Any]]]) -> int:
+        """Number of tokens in a prompt or list of chat messages."""
+        if isinstance(prompt, str):
+            return self.count(prompt)
+        return sum(self.count(str(m.get("content", ""))) + MESSAGE_OVERHEAD for m in prompt)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of text (cut at a line break where possible) within max_tokens."""
+        if self.count(text) <= max_tokens:
+            return text
+        lines = text.split("\n")
+        kept, used = [], 0
+        for line in lines:
+            cost = self.count(line) + 1
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(kept)
+
+class PromptBudget:
+    """
+    Token budget of one prompt, split into named sections.
+
+    Callers measure the fixed sections (system prompt, request, instructions)
+    with take(), then fit the variable ones into what is left: history with
+    fit_entries(), which keeps the newest entries in full and shortens or
+    drops the oldest, and file content with fit_lines(), which keeps a window
+    of lines around the part that matters. sections holds the token count of
+    every section for logging and PromptStats.
+    """
+
+    def __init__(self, limit: int, counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            limit: Maximum prompt tokens
+            counter: Token counter (defaults to the process-wide one)
+        """
+        self.limit = limit
+        self.counter = counter or get_token_counter()
+        self.sections: Dict[str, int] = {}
+        self.trimmed = False
+
+    @property
+    def used(self) -> int:
+        return sum(self.sections.values())
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used)
+
+    def take(self, name: str, text: str) -> int:
+        """Count a section that is always sent in full; returns its tokens."""
+        tokens = self.counter.count(text) + MESSAGE_OVERHEAD
+        self.sections[name] = self.sections.get(name, 0) + tokens
+        return tokens
+
+    def fit_entries(self, name: str, entries: List[Tuple[str, str]]) -> Tuple[List[str], int]:
+        """
+        Fit a chronological list of entries into the remaining budget
+
+        Entries are taken newest first: in full while they fit, then in their
+        compact form, and once even that does not fit the older ones are
+        dropped. The newest entry is always kept, truncated if need be.
+
+        Args:
+            name: Section name
+            entries: (full text, compact text) per entry, oldest first
+
+        Returns:
+            Tuple of (texts to send, oldest first; number of dropped entries)
+        """
+        available = self.remaining
+        chosen: List[str] = []
+        used = 0
+        compacting = False
+        for i, (full, compact) in enumerate(reversed(entries)):
+            text = full
+            cost = self.counter.count(full) + MESSAGE_OVERHEAD
+            if compacting or used + cost > available:
+                compacting = True
+                text = compact
+                cost = self.counter.count(compact) + MESSAGE_OVERHEAD
+            if used + cost > available:
+                if i == 0:
+                    text = self.counter.truncate(full, max(0, available - MESSAGE_OVERHEAD))
+                    cost = self.counter.count(text) + MESSAGE_OVERHEAD
+                else:
+                    break
+            chosen.append(text)
+            used += cost
+        dropped = len(entries) - len(chosen)
+        if compacting or dropped:
+            self.trimmed = True
+        self.sections[name] = self.sections.get(name, 0) + used
+        chosen.reverse()
+        return chosen, dropped
+
+    def fit_lines(self, name: str, lines: List[str], focus: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Choose the window of lines to send within the remaining budget
+
+        The window starts at the focus range (0-indexed, end exclusive) and
+        grows alternately after and before it while the lines fit.
+
+        Args:
+            name: Section name
+            lines: All lines
+            focus: Range of lines that must be included if at all possible
+
+        Returns:
+            (start, end) of the window, 0-indexed, end exclusive
+        """
+        costs = [self.counter.count(line) + 1 for line in lines]
+        available = self.remaining
+        if sum(costs) <= available:
+            self.sections[name] = self.sections.get(name, 0) + sum(costs)
+            return 0, len(lines)
+        self.trimmed = True
+        start, end = max(0, focus[0]), min(len(lines), max(focus[1], focus[0] + 1))
+        used = sum(costs[start:end])
+        # A focus larger than the budget is cut from the end
+        while used > available and end - start > 1:
+            end -= 1
+            used -= costs[end]
+        grown = True
+        while grown:
+            grown = False
+            if end < len(lines) and used + costs[end] <= available:
+                used += costs[end]
+                end += 1
+                grown = True
+            if start > 0 and used + costs[start - 1] <= available:
+                start -= 1
+                used += costs[start]
+                grown = True
+        self.sections[name] = self.sections.get(name, 0) + used
+        return start, end
+
+    def record(self, node: str) -> None:
+        """Log the section sizes and add them to the process-wide PromptStats."""
+        message = f"{node} prompt: {self.used}/{self.limit} tokens {self.sections}"
+        if self.trimmed:
+            logger.info(f"{message} (trimmed to fit)")
+        else:
+            logger.debug(message)
+        prompt_stats.record(node, self.sections, self.trimmed)
+
+class PromptStats:
+    """Running per-node, per-section token counts of built prompts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sections: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._trims: Dict[str, int] = {}
+
+    def record(self, node: str, sections: Dict[str, int], trimmed: bool = False) -> None:
+        """
+        Add the section sizes of one prompt
+
+        Args:
+            node: Node that built the prompt
+            sections: Section name to token count
+            trimmed: The prompt had to be trimmed to fit its budget
+        """
+        with self._lock:
+            per_node = self._sections.setdefault(node, {})
+            for name, tokens in sections.items():
+                entry = per_node.setdefault(name, {"prompts": 0, "total": 0, "max": 0})
+                entry["prompts"] += 1
+                entry["total"] += tokens
+                entry["max"] = max(entry["max"], tokens)
+            if trimmed:
+                self._trims[node] = self._trims.get(node, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the counts
+
+        Returns:
+            Dictionary of node to per-section prompts/mean/max tokens and trim count
+        """
+        with self._lock:
+            return {
+                node: {
+                    "trimmed": self._trims.get(node, 0),
+                    "sections": {
+                        name: {
+                            "mean": entry["total"] / entry["prompts"],
+                            "max": entry["max"],
+                            "prompts": entry["prompts"]
+                        } for name, entry in sections.items()
+                    }
+                } for node, sections in self._sections.items()
+            }
+
+_counter = None
+_counter_lock = threading.Lock()
+prompt_stats = PromptStats()
+
+def get_token_counter() -> TokenCounter:
+    """Return the process-wide token counter, loading the tokenizer on first use."""
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = TokenCounter()
+    return _counter
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text, using the process-wide counter."""
+    return get_token_counter().count(text)
+
+def count_prompt_tokens(prompt: Union[str, List[Dict[str, Any]]]) -> int:
+    """Number of tokens in a prompt or list of chat messages, using the process-wide counter."""
+    return get_token_counter().count_prompt(prompt)
@@ -0,0 +1,247 @@
+import os
+import copy
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterator
+
+from pocketflow import Flow
+
+logger = logging.getLogger("tracing")
+
+class Tracer:
+    """
+    Spans of one agent session.
+
+    A span is a dictionary with id, parent, name, cat(egory), start and dur
+    (seconds since the session started), thread and args. Categories used by
+    the agent are "session", "node" (one run of a node or sub-flow), "phase"
+    (its prep, exec and post) and "llm" (one call_llm). Spans nest through a
+    context variable, so a sub-flow's nodes are children of the sub-flow's
+    exec phase and LLM calls are children of the phase that made them.
+    """
+
+    def __init__(self, session: str):
+        self.session = session
+        self.started = datetime.now()
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.spans: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def span(self, name: str, cat: str = "", **args: Any) -> Iterator[Dict[str, Any]]:
+        """Record a span around the block; the yielded span's args may be updated while it runs."""
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+        parent = _current_span.get()
+        span = {
+            "id": span_id,
+            "parent": parent["id"] if parent is not None else None,
+            "name": name,
+            "cat": cat,
+            "start": time.perf_counter() - self._origin,
+            "dur": None,
+            "thread": threading.get_ident(),
+            "args": args
+        }
+        token = _current_span.set(span)
+        node_token = _current_node.set(span) if cat == "node" else None
+        try:
+            yield span
+        except BaseException as e:
+            span["args"]["error"] = type(e).__name__
+            raise
+        finally:
+            if node_token is not None:
+                _current_node.reset(node_token)
+            _current_span.reset(token)
+            span["dur"] = time.perf_counter() - self._origin - span["start"]
+            with self._lock:
+                self.spans.append(span)
+
+    def export_jsonl(self, path: str) -> None:
+        """Write one JSON span per line, in start order."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        with open(path, "w", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+
+    def export_chrome(self, path: str) -> None:
+        """Write the spans in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        with self._lock:
+            events = [{
+                "name": span["name"],
+                "cat": span["cat"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": span["dur"] * 1e6,
+                "pid": pid,
+                "tid": span["thread"],
+                "args": span["args"]
+            } for span in self.spans]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"session": self.session}}, f, default=str)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Aggregate the spans per node type
+
+        LLM time and tokens count towards the innermost node that made the
+        call; overhead is the session time not spent inside any node.
+
+        Returns:
+            Dictionary with session seconds, LLM seconds, overhead seconds and,
+            per node type, runs, seconds, LLM seconds, tokens and bytes read/written
+        """
+        with self._lock:
+            spans = list(self.spans)
+        by_id = {span["id"]: span for span in spans}
+
+        def owner(span: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            parent = by_id.get(span["parent"])
+            while parent is not None and parent["cat"] != "node":
+                parent = by_id.get(parent["parent"])
+            return parent
+
+        nodes: Dict[str, Dict[str, Any]] = {}
+
+        def entry(name: str) -> Dict[str, Any]:
+            return nodes.setdefault(name, {
+                "runs": 0, "seconds": 0.0, "llm_seconds": 0.0, "llm_calls": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "bytes_read": 0, "bytes_written": 0
+            })
+
+        session_seconds = sum(span["dur"] for span in spans if span["cat"] == "session")
+        top_level = 0.0
+        llm_seconds = 0.0
+        for span in spans:
+            if span["cat"] == "node":
+                stats = entry(span["name"])
+                stats["runs"] += 1
+                stats["seconds"] += span["dur"]
+                stats["bytes_read"] += span["args"].get("bytes_read", 0)
+                stats["bytes_written"] += span["args"].get("bytes_written", 0)
+                if owner(span) is None:
+                    top_level += span["dur"]
+            elif span["cat"] == "llm":
+                llm_seconds += span["dur"]
+                node = owner(span)
+                stats = entry(node["name"] if node is not None else span["args"].get("node") or "unknown")
+                stats["llm_calls"] += 1
+                stats["llm_seconds"] += span["dur"]
+                stats["prompt_tokens"] += span["args"].get("prompt_tokens", 0)
+                stats["completion_tokens"] += span["args"].get("completion_tokens", 0)
+        return {
+            "session_seconds": session_seconds,
+            "llm_seconds": llm_seconds,
+            "overhead_seconds": max(0.0, session_seconds - top_level),
+            "nodes": nodes
+        }
+
+# Tracer of the session running in this thread or task, and its innermost open span
+_current_tracer: contextvars.ContextVar[Optional[Tracer]] = contextvars.ContextVar("tracer", default=None)
+_current_span: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("span", default=None)
+_current_node: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("node_span", default=None)
+
+@contextmanager
+def span(name: str, cat: str = "", **args: Any) -> Iterator[Optional[Dict[str, Any]]]:
+    """Record a span in the current session's tracer; yields None (and costs nothing) when not tracing."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    with tracer.span(name, cat, **args) as current:
+        yield current
+
+def note_io(read: int = 0, written: int = 0) -> None:
+    """Add bytes read from / written to disk to the innermost running node's span."""
+    node = _current_node.get()
+    if node is not None:
+        node["args"]["bytes_read"] = node["args"].get("bytes_read", 0) + read
+        node["args"]["bytes_written"] = node["args"].get("bytes_written", 0) + written
+
+def set_span_args(**args: Any) -> None:
+    """Add arguments to the innermost open span, if tracing."""
+    current = _current_span.get()
+    if current is not None:
+        current["args"].update(args)
+
+def _trace_enabled() -> bool:
+    return os.getenv("AGENT_TRACE", "false").lower() in ("1", "true", "yes")
+
+@contextmanager
+def trace_session(name: Optional[str] = None) -> Iterator[Optional[Tracer]]:
+    """
+    Trace an agent session if AGENT_TRACE is set
+
+    On exit the spans are written to <dir>/<session>.jsonl and the Chrome
+    trace to <dir>/<session>.trace.json, with dir AGENT_TRACE_DIR (default
+    LOG_DIR/traces), and the per-node summary is logged.
+
+    Args:
+        name: Session name used in the file names (defaults to a timestamp)
+
+    Yields:
+        The session's Tracer, or None when tracing is off
+    """
+    if not _trace_enabled() or _current_tracer.get() is not None:
+        # Nested sessions (run_flow calling run_flow_with_limit) share the outer trace
+        yield _current_tracer.get()
+        return
+    tracer = Tracer(name or f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}")
+    token = _current_tracer.set(tracer)
+    try:
+        with tracer.span("session", cat="session"):
+            yield tracer
+    finally:
+        _current_tracer.reset(token)
+        trace_dir = os.getenv("AGENT_TRACE_DIR") or os.path.join(os.getenv("LOG_DIR", "logs"), "traces")
+        try:
+            os.makedirs(trace_dir, exist_ok=True)
+            tracer.export_jsonl(os.path.join(trace_dir, f"{tracer.session}.jsonl"))
+            tracer.export_chrome(os.path.join(trace_dir, f"{tracer.session}.trace.json"))
+            logger.info(f"Trace written to {trace_dir}/{tracer.session}.*")
+        except OSError as e:
+            logger.warning(f"Failed to write trace: {e}")
+        logger.info(f"Session time, tokens and runs per node: {tracer.summary()}")
+
+def _run_node(node: Any, shared: Dict[str, Any]) -> Any:
+    # BaseNode._run with a span per phase; a Flow's exec phase is its orchestration
+    with span(getattr(node, "name", None) or type(node).__name__, cat="node"):
+        with span("prep", cat="phase"):
+            prep_res = node.prep(shared)
+        with span("exec", cat="phase"):
+            exec_res = node._orch(shared) if isinstance(node, Flow) else node._exec(prep_res)
+        with span("post", cat="phase"):
+            return node.post(shared, prep_res, exec_res)
+
+class TracedFlow(Flow):
+    """Flow that records a span around the prep, exec and post of every node it runs."""
+
+    def __init__(self, start: Any = None, name: Optional[str] = None):
+        """
+        Args:
+            start: First node
+            name: Span name of this flow when it runs as a node of another flow (defaults to the class name)
+        """
+        super().__init__(start=start)
+        self.name = name
+
+    def _orch(self, shared: Dict[str, Any], params: Optional[Dict[str, Any]] = None) -> Any:
+        if _current_tracer.get() is None:
+            return super()._orch(shared, params)
+        # Same loop as Flow._orch, running each node through _run_node
+        curr, p, last_action = copy.copy(self.start_node), (params or {**self.params}), None
+        while curr:
+            curr.set_params(p)
+            last_action = _run_node(curr, shared)
+            curr = copy.copy(self.get_next_node(curr, last_action))
+        return last_action
@@ -0,0 +1,116 @@
+import threading
+from typing import Optional, Dict, Any
+
+class UsageStats:
+    """
+    Thread-safe running totals of token usage reported by an LLM provider.
+
+    cached_prompt_tokens counts prompt tokens served from the provider's
+    prefix cache; fresh prompt tokens are prompt_tokens - cached_prompt_tokens.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.last: Optional[Dict[str, int]] = None
+
+    def record(self, prompt_tokens: int = 0, cached_prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        """
+        Add the usage of one request
+
+        Args:
+            prompt_tokens: Total prompt tokens of the request
+            cached_prompt_tokens: Prompt tokens served from the prefix cache
+            completion_tokens: Generated tokens
+        """
+        last = {
+            "prompt_tokens": prompt_tokens or 0,
+            "cached_prompt_tokens": cached_prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0
+        }
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += last["prompt_tokens"]
+            self.cached_prompt_tokens += last["cached_prompt_tokens"]
+            self.completion_tokens += last["completion_tokens"]
+            self.last = last
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the running totals
+
+        Returns:
+            Dictionary of totals plus the cached share of prompt tokens
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "fresh_prompt_tokens": self.prompt_tokens - self.cached_prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_ratio": self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "last": dict(self.last) if self.last else None
+            }
+
+class ModelLoadStats:
+    """
+    Thread-safe record of model load times reported by a local LLM server.
+
+    A load longer than cold_threshold seconds means the model had to be
+    read into memory (a cold start); shorter ones are warm hits.
+    """
+
+    def __init__(self, cold_threshold: float = 0.5):
+        self.cold_threshold = cold_threshold
+        self._lock = threading.Lock()
+        self.cold = 0
+        self.warm = 0
+        self.cold_seconds = 0.0
+        self.warm_seconds = 0.0
+        self.max_cold_seconds = 0.0
+        self.preloads = 0
+
+    def record(self, seconds: float, preload: bool = False) -> bool:
+        """
+        Add the load time of one request
+
+        Args:
+            seconds: Time the server spent loading the model
+            preload: The request was a warm-up / keep-alive ping
+
+        Returns:
+            True if the load was cold
+        """
+        cold = seconds >= self.cold_threshold
+        with self._lock:
+            if preload:
+                self.preloads += 1
+            if cold:
+                self.cold += 1
+                self.cold_seconds += seconds
+                self.max_cold_seconds = max(self.max_cold_seconds, seconds)
+            else:
+                self.warm += 1
+                self.warm_seconds += seconds
+        return cold
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the load counters
+
+        Returns:
+            Dictionary of cold/warm counts and mean load times
+        """
+        with self._lock:
+            return {
+                "cold_loads": self.cold,
+                "warm_loads": self.warm,
+                "preloads": self.preloads,
+                "mean_cold_seconds": self.cold_seconds / self.cold if self.cold else 0.0,
+                "max_cold_seconds": self.max_cold_seconds,
+                "mean_warm_seconds": self.warm_seconds / self.warm if self.warm else 0.0
+            }
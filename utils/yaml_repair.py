@@ -0,0 +1,175 @@
+import re
+import json
+import logging
+from typing import Any, Iterable, List, Optional
+
+import yaml
+
+logger = logging.getLogger("yaml_repair")
+
+FENCES = ("```yaml", "```yml", "```")
+
+# "key:" or "- key:" at the start of a line, capturing indent and key
+_KEY_LINE = re.compile(r"^(\s*)(?:-\s+)?([A-Za-z_][A-Za-z0-9_]*):(?:\s|$)")
+# "key: value" with a plain (unquoted, inline) value
+_PLAIN_VALUE = re.compile(r"^(\s*(?:-\s+)?([A-Za-z_][A-Za-z0-9_]*):\s+)([^'\"|>\[{&*!].*?)\s*$")
+# A block scalar header such as "content: |", "- replacement: |-" or "reasoning: >"
+_BLOCK_HEADER = re.compile(r"^(\s*)((?:-\s+)?[A-Za-z_][A-Za-z0-9_]*:\s*)([|>])([+-]?)(\d?)([+-]?)\s*$")
+
+def extract_yaml_block(response: str) -> str:
+    """
+    Take the YAML out of a model reply
+
+    The first ```yaml, ```yml or bare ``` fence is used; a fence that was
+    never closed (cut off by a stop sequence or the token limit) runs to the
+    end of the reply. A reply without fences is returned whole.
+    """
+    for fence in FENCES:
+        start = response.find(fence)
+        if start == -1:
+            continue
+        body = response[start + len(fence):]
+        if fence == "```":
+            # A bare fence may carry another language tag, e.g. ```json
+            first, _, rest = body.partition("\n")
+            body = rest if first.strip() else body
+        end = body.find("\n```")
+        if end == -1 and body.startswith("```"):
+            end = 0
+        return (body[:end] if end != -1 else body).strip("\n")
+    return response.strip()
+
+def _strip_leading_prose(lines: List[str]) -> List[str]:
+    # Everything before the first unindented key, e.g. "Here is my decision:"
+    start = next((i for i, line in enumerate(lines) if _KEY_LINE.match(line) and not line[0].isspace()), 0)
+    return lines[start:]
+
+def _strip_trailing_prose(lines: List[str]) -> List[str]:
+    # Once block scalars are indented, an unindented line that is not a key,
+    # list item or comment is prose after the document
+    end = len(lines)
+    for i, line in enumerate(lines):
+        if line and not line[0].isspace() and not _KEY_LINE.match(line) and not line.startswith(("-", "#", "...")):
+            end = i
+            break
+    while end > 0 and not lines[end - 1].strip():
+        end -= 1
+    return lines[:end]
+
+def _ends_block(line: str, indent: int, keys: Optional[set]) -> bool:
+    # A key at or left of the header's indentation closes a block scalar; with
+    # known keys, other key-like lines (e.g. "foo:" in code) stay content
+    match = _KEY_LINE.match(line)
+    if not match or len(match.group(1)) > indent:
+        return False
+    return keys is None or match.group(2) in keys
+
+def _quote_value(line: str, keys: Optional[set]) -> str:
+    # "reason: read it: all of it" is a syntax error; quote such values
+    match = _PLAIN_VALUE.match(line)
+    if not match or (keys is not None and match.group(2) not in keys):
+        return line
+    value = match.group(3)
+    if ": " not in value and " #" not in value and not value.endswith(":"):
+        return line
+    return match.group(1) + json.dumps(value)
+
+def _reindent_block_scalars(lines: List[str], keys: Optional[set]) -> List[str]:
+    # Also quotes plain values outside block scalars (see _quote_value)
+    out: List[str] = []
+    i = 0
+    while i < len(lines):
+        header = _BLOCK_HEADER.match(lines[i])
+        if not header:
+            out.append(_quote_value(lines[i], keys))
+            i += 1
+            continue
+        indent = len(header.group(1))
+        if header.group(2).lstrip().startswith("-"):
+            # Keys of a list item are indented past the dash
+            indent += len(header.group(2)) - len(header.group(2).lstrip("- "))
+        j = i + 1
+        while j < len(lines) and not _ends_block(lines[j], indent, keys):
+            j += 1
+        body = lines[i + 1:j]
+        while body and not body[-1].strip():
+            body.pop()
+        content = [line for line in body if line.strip()]
+        base = min((len(line) - len(line.lstrip(" ")) for line in content), default=0)
+        target = indent + 2
+        reindented = [(" " * target + line[base:]) if line.strip() else "" for line in body]
+        # An indentation indicator keeps a first line indented past the rest
+        first_extra = (len(content[0]) - len(content[0].lstrip(" ")) - base) if content else 0
+        indicator = "2" if first_extra > 0 else ""
+        chomp = header.group(4) or header.group(6)
+        out.append(f"{header.group(1)}{header.group(2)}{header.group(3)}{indicator}{chomp}")
+        out.extend(reindented)
+        out.extend(lines[i + 1 + len(body):j])
+        i = j
+    return out
+
+def repair_yaml(text: str, keys: Optional[Iterable[str]] = None) -> str:
+    """
+    Fix the usual ways model-written YAML fails to parse
+
+    Tabs become spaces, prose around the document is dropped, plain values
+    containing ": " are quoted, and block scalars ("key: |") are re-indented
+    so every line sits under its key, with an indentation indicator when the
+    first line is indented past the others. keys lists the mapping keys the document may contain; a line
+    inside a block scalar only ends it if it is one of them.
+
+    Args:
+        text: YAML text, already taken out of its fence
+        keys: Known keys of the document, or None to treat any key-like line as a key
+
+    Returns:
+        Repaired YAML text (not guaranteed to parse)
+    """
+    lines = text.replace("\r\n", "\n").expandtabs(4).split("\n")
+    lines = _strip_leading_prose(lines)
+    lines = _reindent_block_scalars(lines, set(keys) if keys is not None else None)
+    lines = _strip_trailing_prose(lines)
+    return "\n".join(lines)
+
+def load_yaml_reply(response: str, keys: Optional[Iterable[str]] = None, top_keys: Optional[Iterable[str]] = None) -> Any:
+    """
+    Parse the YAML of a model reply, repairing it locally if needed
+
+    A reply is repaired if it does not parse, or if it parses to a mapping
+    with top-level keys outside top_keys (typically code that escaped its
+    block scalar and was read as keys).
+
+    Args:
+        response: Model reply
+        keys: Known keys of the document (see repair_yaml)
+        top_keys: Allowed top-level keys, None to accept any
+
+    Returns:
+        The parsed document
+
+    Raises:
+        yaml.YAMLError: If the YAML does not parse even after repair
+    """
+    allowed = set(top_keys) if top_keys is not None else None
+
+    def plausible(value: Any) -> bool:
+        return allowed is None or not isinstance(value, dict) or set(value) <= allowed
+
+    text = extract_yaml_block(response)
+    error = None
+    try:
+        value = yaml.safe_load(text)
+        if plausible(value):
+            return value
+    except yaml.YAMLError as e:
+        error = e
+    try:
+        repaired = yaml.safe_load(repair_yaml(text, keys))
+    except yaml.YAMLError:
+        if error is not None:
+            raise error
+        return value
+    if error is None and not plausible(repaired):
+        return value
+    logger.info("Repaired malformed YAML reply locally")
+    return repaired